@@ -4,43 +4,160 @@ import time
 import re
 import json
 import os
-from openai import OpenAI
+import threading
+from collections import deque
 from config import (
     CHECK_INTERVAL, BLACKLIST_MAX, BATCH_SIZE,
     AI_API_URL, AI_API_KEY, CHAIN_NAME,
     AI_PROMPT_TEMPLATE,
-    ANALYZE_FILES, USE_TAIL_COMMAND
+    ANALYZE_FILES, USE_TAIL_COMMAND,
+    METRICS_HOST, METRICS_PORT,
+    INGEST_WORKERS, SHARD_MODE,
+    IP_STATS_SNAPSHOT_FILE, IP_STATS_PUBLISH_INTERVAL,
+    ANOMALY_GATE_AI, AI_STREAM, AI_TIMEOUT, AI_MAX_RETRIES, AI_MODEL, AI_MAX_TOKENS
+)
+from logger import AegisLogger, log_queue_depth
+from blocked_index import BlockedIndex
+from model_router import TIER_FULL, TIER_LATENCY, TIER_REQUESTS, needs_full_model, record_tier_usage
+from log_parsers import LogParser
+from ip_stats import get_ip_stats
+from verdict_cache import get_verdict_cache
+from models import get_db_manager
+from metrics import (
+    LINES_READ, LINES_FILTERED, BATCHES_SENT, AI_LATENCY, AI_TOKENS, AI_ERRORS,
+    AI_PARSE_FAILURES, AI_FIRST_VERDICT_LATENCY, ATTACKS_DETECTED, DB_WRITE_LATENCY,
+    FIREWALL_LATENCY, QUEUE_DEPTH, start_http_server
 )
-from logger import AegisLogger
-from models import db_manager
 
 logger = AegisLogger()
 
+# AI 客户端在首次调用时创建并复用 (openai SDK 导入较慢，且每次新建客户端会重建连接池)
+_ai_client = None
+_ai_client_lock = threading.Lock()
+
+def get_ai_client():
+    """获取复用的 OpenAI 兼容客户端"""
+    global _ai_client
+    if _ai_client is None:
+        with _ai_client_lock:
+            if _ai_client is None:
+                from openai import OpenAI
+                _ai_client = OpenAI(
+                    api_key=AI_API_KEY,
+                    base_url=AI_API_URL,
+                    timeout=AI_TIMEOUT,
+                    max_retries=AI_MAX_RETRIES,
+                )
+    return _ai_client
+
+def set_ai_client(client):
+    """替换 AI 客户端 (测试/压测时指向本地桩服务)"""
+    global _ai_client
+    _ai_client = client
+
 
 # ================= iptables 管理 =================
-class FirewallAI:
+class DryRunIptables:
+    """模拟 iptables 的命令执行器，只在内存中维护规则，不修改系统防火墙
+
+    用于压测与回放: 支持 FirewallAI 用到的 -S/-N/-I/-A/-D/-L 子命令，
+    并记录每个 IP 被加入黑名单的时间
+    """
+
     def __init__(self):
+        self.chains = {'INPUT': []}
+        self.blocked_at = {}  # ip -> time.time()
+        self.commands = 0
+
+    def run(self, cmd):
+        self.commands += 1
+        args = cmd.split()
+        if args and args[0] == 'sudo':
+            args = args[1:]
+        args = args[1:]  # 去掉 iptables
+        op = args[0]
+        if op == '-S':
+            if len(args) > 1:
+                return '\n'.join(f"-A {args[1]} {rule}" for rule in self.chains.get(args[1], []))
+            out = ['-P INPUT ACCEPT']
+            out += [f"-N {name}" for name in self.chains if name != 'INPUT']
+            for name, rules in self.chains.items():
+                out += [f"-A {name} {rule}" for rule in rules]
+            return '\n'.join(out)
+        if op == '-N':
+            self.chains.setdefault(args[1], [])
+            return ''
+        if op == '-I':
+            self.chains.setdefault(args[1], []).insert(0, ' '.join(args[2:]))
+            return ''
+        if op == '-A':
+            rule = ' '.join(args[2:])
+            if '-s' in args:
+                ip = args[args.index('-s') + 1]
+                if '/' not in ip:
+                    rule = rule.replace(f"-s {ip}", f"-s {ip}/32")
+                self.blocked_at.setdefault(ip.split('/')[0], time.time())
+            self.chains.setdefault(args[1], []).append(rule)
+            return ''
+        if op == '-D':
+            rule = ' '.join(args[2:])
+            rules = self.chains.get(args[1], [])
+            if rule in rules:
+                rules.remove(rule)
+            return ''
+        if op == '-L':
+            out = [f"Chain {args[1]} (1 references)", "target     prot opt source               destination"]
+            for rule in self.chains.get(args[1], []):
+                parts = rule.split()
+                if '-s' in parts:
+                    source = parts[parts.index('-s') + 1]
+                    if source.endswith('/32'):
+                        source = source[:-3]
+                    out.append(f"DROP       all  --  {source}            0.0.0.0/0")
+            return '\n'.join(out)
+        return ''
+
+
+class FirewallAI:
+    def __init__(self, dry_run=False, blocked=None):
+        """
+        Args:
+            blocked: 检查点中保存的黑名单; 链已存在时直接使用, 不再列出 iptables 规则
+                     (统计周期内的 sync_blacklist 会按实际规则校正)
+        """
         self.chain = CHAIN_NAME
-        self.init_chain()
+        # dry_run 模式下命令由 DryRunIptables 在内存中模拟执行
+        self.dry_run = DryRunIptables() if dry_run else None
+        chain_existed = self.init_chain()
+        # 内存中的黑名单索引: add_ip 去重和流水线过滤已封禁来源都不再调用 iptables
+        if blocked is not None and chain_existed:
+            self.blocked = BlockedIndex(blocked)
+        else:
+            # 链是新建的 (例如重启后规则已清空) 时检查点中的黑名单已失效
+            self.blocked = BlockedIndex(self.get_blacklist())
 
     def _run_cmd(self, cmd):
+        if self.dry_run is not None:
+            with FIREWALL_LATENCY.time():
+                return self.dry_run.run(cmd)
         try:
-            result = subprocess.run(cmd, shell=True, check=True,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    text=True)
+            with FIREWALL_LATENCY.time():
+                result = subprocess.run(cmd, shell=True, check=True,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        text=True)
             return result.stdout.strip()
         except subprocess.CalledProcessError as e:
             logger.error(f"命令失败: {e.stderr.strip()}")
             return None
 
     def init_chain(self):
-        """初始化自定义黑名单链"""
+        """初始化自定义黑名单链, 返回链原本是否已存在"""
         # FIX: 使用 `iptables -S` 精确判断链是否已存在，并确保 INPUT 链已跳转到自定义链
         rules = self._run_cmd("sudo iptables -S")
         if not rules:
             logger.error("无法获取 iptables 规则，跳过链初始化")
-            return
+            return False
 
         lines = rules.splitlines()
         has_chain = any(line.strip() == f"-N {self.chain}" for line in lines)
@@ -58,12 +175,16 @@ class FirewallAI:
             logger.info(f"链 {self.chain} 已加入 INPUT")
         else:
             logger.info(f"INPUT 已包含跳转到 {self.chain}")
+        return has_chain
 
     def add_ip(self, ip):
-        """添加 IP 到黑名单"""
-        if ip not in self.get_blacklist():
-            self._run_cmd(f"sudo iptables -A {self.chain} -s {ip} -j DROP")
-            logger.info(f"IP {ip} 加入黑名单")
+        """添加 IP 到黑名单 (已封禁或落在已封禁网段内的地址直接返回)"""
+        if ip in self.blocked:
+            return
+        self._run_cmd(f"sudo iptables -A {self.chain} -s {ip} -j DROP")
+        self.blocked.add(ip)
+        logger.info(f"IP {ip} 加入黑名单")
+        if len(self.blocked) > BLACKLIST_MAX:
             self.trim_blacklist()
 
     def remove_ip(self, ip):
@@ -81,6 +202,7 @@ class FirewallAI:
                 delete_cmd = "sudo iptables " + line.replace("-A", "-D", 1)
                 out = self._run_cmd(delete_cmd)
                 removed_any = True
+        self.blocked.discard(ip)
         if removed_any:
             logger.info(f"IP {ip} 已删除")
         else:
@@ -94,7 +216,7 @@ class FirewallAI:
             return []
         ips = []
         for line in rules.splitlines():
-            m = re.search(r"(\d{1,3}\.){3}\d{1,3}", line)
+            m = re.search(r"(\d{1,3}\.){3}\d{1,3}(/\d{1,2})?", line)
             if m:
                 # FIX: group(0) 才是完整 IP
                 ips.append(m.group(0))
@@ -118,19 +240,84 @@ class FirewallAI:
                 break
         if len(ips) > BLACKLIST_MAX:
             logger.warning(f"黑名单长度仍为 {len(ips)}，超过上限 {BLACKLIST_MAX}，请检查规则删除是否受限")
+        self.blocked.replace(ips)
+
+    def sync_blacklist(self):
+        """按 iptables 中的实际规则重建黑名单索引 (规则可能被手动修改)"""
+        self.blocked.replace(self.get_blacklist())
 
 # ================= 日志分析 =================
-def sample_log_lines(batch_size=BATCH_SIZE):
+def analyze_file_paths():
+    """返回配置中需要分析的日志文件列表"""
+    if not ANALYZE_FILES:
+        return []
+    return [path.strip() for path in ANALYZE_FILES.split(',') if path.strip()]
+
+def _read_tail(file_path, batch_size):
+    """读取文件最后 batch_size 行"""
+    lines = []
+    if USE_TAIL_COMMAND:
+        # 使用 tail 命令直接读取文件最后 batch_size 行
+        result = subprocess.run(
+            ['tail', '-n', str(batch_size), file_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        if result.returncode == 0:
+            lines = result.stdout.splitlines()
+        else:
+            logger.warning(f"tail 命令失败: {result.stderr}")
+
+    # 如果没成功或禁用 tail, 使用 Python 读取
+    if not lines:
+        with open(file_path, 'r') as f:
+            lines = f.readlines()[-batch_size:]
+    return lines
+
+def _read_new_lines(file_path, batch_size, offsets):
+    """读取上次记录的偏移之后新写入的完整行 (只保留最后 batch_size 行), 并推进 offsets[file_path]
+    文件首次出现时与 _read_tail 一致只取尾部; 被轮转或截断时从头读取
+    """
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        saved = offsets.get(file_path)
+        if saved is None:
+            # 按每行最多 8KB 估算尾部位置, 第一行可能不完整, 丢弃
+            start = max(0, st.st_size - batch_size * 8192)
+            f.seek(start)
+            skipped = f.readline() if start else b''
+            if skipped.endswith(b'\n'):
+                start += len(skipped)
+            else:
+                f.seek(start)
+        elif saved[0] == st.st_ino and saved[1] <= st.st_size:
+            start = saved[1]
+            f.seek(start)
+        else:
+            start = 0
+        lines = deque(maxlen=batch_size)
+        offset = start
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # 还没写完的半行留到下次读取
+            offset += len(raw)
+            lines.append(raw.decode('utf-8', 'replace'))
+    offsets[file_path] = [st.st_ino, offset]
+    return list(lines)
+
+def sample_log_lines(batch_size=BATCH_SIZE, file_paths=None, offsets=None):
     """遍历多个日志文件, 取出每个文件的最后 batch_size 行, 按批次返回
     Args:
         batch_size: 每批次的最大行数
+        file_paths: 日志文件列表, 默认使用配置中的 ANALYZE_FILES
+        offsets: {文件: [inode, 已读偏移]}; 传入时只取上次之后新写入的行并更新偏移,
+                 没有新内容的文件不再重复返回同样的尾部 (主循环把它保存在检查点中)
     Returns:
         list[list[str]]: 每个子列表是一个批次的日志行
     """
-    if not ANALYZE_FILES:
-        return []
-
-    file_paths = [path.strip() for path in ANALYZE_FILES.split(',')]
+    if file_paths is None:
+        file_paths = analyze_file_paths()
     batches = []
 
     for file_path in file_paths:
@@ -139,29 +326,21 @@ def sample_log_lines(batch_size=BATCH_SIZE):
             continue
 
         try:
-            lines = []
-            if USE_TAIL_COMMAND:
-                # 使用 tail 命令直接读取文件最后 batch_size 行
-                result = subprocess.run(
-                    ['tail', '-n', str(batch_size), file_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                if result.returncode == 0:
-                    lines = result.stdout.splitlines()
-                else:
-                    logger.warning(f"tail 命令失败: {result.stderr}")
+            if offsets is not None:
+                lines = _read_new_lines(file_path, batch_size, offsets)
+            else:
+                lines = _read_tail(file_path, batch_size)
 
-            # 如果没成功或禁用 tail, 使用 Python 读取
-            if not lines:
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()[-batch_size:]
+            LINES_READ.inc(len(lines))
 
-            # 按 batch_size 分组
+            # 按 batch_size 分组 (空行不发送给 AI)
             current_batch = []
             for line in lines:
-                current_batch.append(line.rstrip('\n'))
+                line = line.rstrip('\n')
+                if not line.strip():
+                    LINES_FILTERED.labels('empty').inc()
+                    continue
+                current_batch.append(line)
                 if len(current_batch) >= batch_size:
                     batches.append(current_batch)
                     current_batch = []
@@ -173,95 +352,418 @@ def sample_log_lines(batch_size=BATCH_SIZE):
 
     return batches
 
-def analyze_lines_ai(lines):
-    """一次发送多行日志给 AI 分析，返回攻击IP和类型信息"""
-    # 准备日志内容
-    log_content = "\n".join(lines)
-    
+def stream_log_files(file_paths=None, tail_mode=False, poll_interval=0.5):
+    """逐行流式读取日志文件, 内存占用与文件大小无关
+    Args:
+        file_paths: 日志文件列表, 默认使用配置中的 ANALYZE_FILES
+        tail_mode: False 时顺序读完所有文件后结束;
+                   True 时从文件末尾开始持续跟踪新写入的行 (类似 tail -F, 支持日志轮转)
+        poll_interval: tail 模式下没有新数据时的轮询间隔(秒)
+    Yields:
+        str: 去掉换行符的日志行
+    """
+    if file_paths is None:
+        file_paths = analyze_file_paths()
+
+    if not tail_mode:
+        for file_path in file_paths:
+            if not os.path.exists(file_path):
+                logger.warning(f"日志文件不存在: {file_path}")
+                continue
+            with open(file_path, 'r', errors='replace') as f:
+                for line in f:
+                    LINES_READ.inc()
+                    yield line.rstrip('\n')
+        return
+
+    # tail 模式: {path: [文件对象, inode, 未完成的半行]}
+    followers = {}
+    for file_path in file_paths:
+        if os.path.exists(file_path):
+            f = open(file_path, 'r', errors='replace')
+            f.seek(0, os.SEEK_END)
+            followers[file_path] = [f, os.fstat(f.fileno()).st_ino, '']
+        else:
+            logger.warning(f"日志文件不存在: {file_path}")
+
     try:
-        # 使用OpenAI SDK格式调用DeepSeek API
-        client = OpenAI(
-            api_key=AI_API_KEY,
-            base_url=AI_API_URL,
-        )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": AI_PROMPT_TEMPLATE},
-                {"role": "user", "content": log_content}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.1,
-            max_tokens=2000
-        )
-        
-        # 解析AI响应
-        response_content = response.choices[0].message.content
-        
-        # 处理AI返回的JSON响应，可能包含```json ```标签
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_content, re.DOTALL)
-        if json_match:
-            # 提取JSON部分
-            json_content = json_match.group(1)
-            try:
-                result = json.loads(json_content)
-            except json.JSONDecodeError:
-                # 如果提取失败，尝试直接解析整个响应
+        while True:
+            got_data = False
+            for file_path, state in followers.items():
+                f = state[0]
+                chunk = f.read()
+                if chunk:
+                    got_data = True
+                    data = state[2] + chunk
+                    lines = data.split('\n')
+                    state[2] = lines.pop()  # 最后一段可能是还没写完的半行
+                    for line in lines:
+                        LINES_READ.inc()
+                        yield line
+                    continue
+                # 没有新数据时检查轮转/截断
                 try:
-                    result = json.loads(response_content)
-                except json.JSONDecodeError:
-                    logger.error("AI响应JSON解析失败")
-                    return []
-        else:
-            # 没有```json ```标签，直接解析
+                    st = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                if st.st_ino != state[1] or st.st_size < f.tell():
+                    f.close()
+                    state[0] = open(file_path, 'r', errors='replace')
+                    state[1] = os.fstat(state[0].fileno()).st_ino
+                    state[2] = ''
+                    got_data = True
+            if not got_data:
+                time.sleep(poll_interval)
+    finally:
+        for state in followers.values():
+            state[0].close()
+
+def iter_batches(lines, batch_size=BATCH_SIZE):
+    """把行流切分为批次, 跳过空行"""
+    batch = []
+    for line in lines:
+        if not line.strip():
+            LINES_FILTERED.labels('empty').inc()
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parse_ai_response(response_content):
+    """解析 AI 返回的 JSON (可能包含```json ```标签)
+    Returns:
+        list[dict]: [{"ip": "1.2.3.4", "attack_type": "DDoS"}, ...]; 解析失败返回 None
+    """
+    # 处理AI返回的JSON响应，可能包含```json ```标签
+    json_match = re.search(r'```json\s*(.*?)\s*```', response_content, re.DOTALL)
+    if json_match:
+        # 提取JSON部分
+        json_content = json_match.group(1)
+        try:
+            result = json.loads(json_content)
+        except json.JSONDecodeError:
+            # 如果提取失败，尝试直接解析整个响应
             try:
                 result = json.loads(response_content)
             except json.JSONDecodeError:
+                AI_PARSE_FAILURES.inc()
                 logger.error("AI响应JSON解析失败")
-                return []
-        
-        # 解析新的JSON格式: {"attack_ips": [{"ip": "1.2.3.4", "attack_type": "DDoS"}, ...]}
-        attack_data = result.get("attack_ips", [])
-        
-        # 记录攻击信息到数据库
-        for attack in attack_data:
-            ip = attack.get("ip")
-            attack_type = attack.get("attack_type", "未知攻击")
-            log_content = "\n".join(lines)  # 使用批次日志作为内容
-            
-            if ip:
-                try:
-                    # 记录攻击到数据库
-                    db_manager.add_attack_record(
+                return None
+    else:
+        # 没有```json ```标签，直接解析
+        try:
+            result = json.loads(response_content)
+        except json.JSONDecodeError:
+            AI_PARSE_FAILURES.inc()
+            logger.error("AI响应JSON解析失败")
+            return None
+
+    # 解析新的JSON格式: {"attack_ips": [{"ip": "1.2.3.4", "attack_type": "DDoS"}, ...]}
+    return result.get("attack_ips", [])
+
+def _ai_messages(lines):
+    return [
+        {"role": "system", "content": AI_PROMPT_TEMPLATE},
+        {"role": "user", "content": "\n".join(lines)}
+    ]
+
+def _record_usage(usage):
+    if usage is not None:
+        AI_TOKENS.labels('prompt').inc(usage.prompt_tokens or 0)
+        AI_TOKENS.labels('completion').inc(usage.completion_tokens or 0)
+        record_tier_usage(TIER_FULL, usage)
+
+def _stream_ai_verdicts(client, lines, on_verdict):
+    """流式调用: 每个攻击对象一闭合就回调 on_verdict
+    Returns:
+        (攻击列表, 响应是否完整): 响应被截断 (如达到 max_tokens) 时返回已解析出的部分, 没有则为 None
+    """
+    from ai_stream import VerdictStreamParser
+
+    parser = VerdictStreamParser()
+    started = time.perf_counter()
+    stream = client.chat.completions.create(
+        model=AI_MODEL,
+        messages=_ai_messages(lines),
+        response_format={"type": "json_object"},
+        temperature=0.1,
+        max_tokens=AI_MAX_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    first_seen = False
+    for chunk in stream:
+        _record_usage(getattr(chunk, 'usage', None))
+        if not chunk.choices:
+            continue
+        for verdict in parser.feed(chunk.choices[0].delta.content):
+            if not first_seen:
+                # 一个增量可能同时闭合多个对象, 不能用 len(parser.verdicts) == 1 判断
+                first_seen = True
+                AI_FIRST_VERDICT_LATENCY.observe(time.perf_counter() - started)
+            if on_verdict is not None:
+                on_verdict(verdict)
+    if not parser.complete:
+        AI_PARSE_FAILURES.inc()
+        logger.error("AI 流式响应不是完整的 JSON")
+        # 已解析出的攻击对象仍然有效
+        return (parser.verdicts if parser.verdicts else None), False
+    return parser.verdicts, True
+
+def _isolated_callback(on_verdict):
+    """包装判定回调: 写库/封禁失败只记录日志并跳过该判定, 不计入 AI 调用失败, 也不触发熔断和降级"""
+    if on_verdict is None:
+        return None
+
+    def call(verdict):
+        try:
+            on_verdict(verdict)
+        except Exception as e:
+            logger.error(f"处理 AI 判定失败: {verdict!r}: {e}")
+    return call
+
+def _call_ai(lines, on_verdict):
+    """调用 AI 接口; 熔断期间或调用失败时改由本地特征签名分类 (降级模式), 日志行进入复核队列等待 AI 恢复
+    配置了初筛模型时先初筛, 只有阳性或不确定的批次交给完整模型
+    已分析过的相同批次直接返回缓存的判定, 并同样回调 on_verdict: 之后被裁剪或手动解封的 IP 会重新封禁,
+    仍在封禁中的 IP 由回调方按黑名单去重
+    """
+    from circuit_breaker import get_ai_breaker
+    from fallback import degrade
+
+    on_verdict = _isolated_callback(on_verdict)
+    cache = get_verdict_cache()
+    key = cache.key(lines)
+    cached = cache.get(key)
+    if cached is not None:
+        LINES_FILTERED.labels('cached').inc(len(lines))
+        if on_verdict is not None:
+            for verdict in cached:
+                on_verdict(verdict)
+        return cached
+
+    breaker = get_ai_breaker()
+    if not breaker.allow():
+        return degrade(lines, on_verdict)
+    try:
+        # 使用OpenAI SDK格式调用DeepSeek API
+        client = get_ai_client()
+
+        BATCHES_SENT.inc()
+        if not needs_full_model(client, lines):
+            breaker.record_success()
+            cache.put(key, [])
+            return []
+
+        if AI_STREAM:
+            with AI_LATENCY.time(), TIER_LATENCY.labels(TIER_FULL).time():
+                attack_data, complete = _stream_ai_verdicts(client, lines, on_verdict)
+            breaker.record_success()
+        else:
+            with AI_LATENCY.time(), TIER_LATENCY.labels(TIER_FULL).time():
+                response = client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=_ai_messages(lines),
+                    response_format={"type": "json_object"},
+                    temperature=0.1,
+                    max_tokens=AI_MAX_TOKENS
+                )
+            breaker.record_success()
+            _record_usage(getattr(response, 'usage', None))
+
+            # 解析AI响应
+            attack_data = parse_ai_response(response.choices[0].message.content)
+            complete = attack_data is not None
+            if attack_data and on_verdict is not None:
+                for verdict in attack_data:
+                    on_verdict(verdict)
+        TIER_REQUESTS.labels(TIER_FULL, 'attack' if attack_data else 'clean').inc()
+        # 降级、解析失败和被截断的结果不缓存, 复核或重试时仍交给 AI
+        if complete:
+            cache.put(key, attack_data)
+        return attack_data
+
+    except Exception as e:
+        AI_ERRORS.inc()
+        TIER_REQUESTS.labels(TIER_FULL, 'error').inc()
+        breaker.record_failure()
+        logger.error(f"调用 AI 接口失败: {e}")
+        return degrade(lines, on_verdict)
+
+def request_ai_verdicts(lines, on_verdict=None):
+    """分析一批日志, 只返回判定结果, 不写数据库 (可在线程池中并发调用)
+    已训练本地分类器时先由分类器判定, 只有低置信度的行交给 AI
+    Args:
+        on_verdict: 每个攻击对象的回调; AI_STREAM 开启时在对象解析完成时立即调用,
+                    否则在完整响应解析后依次调用
+    Returns:
+        list[dict]: 攻击列表; 响应解析失败且本地没有判定时返回 None
+    """
+    # numpy 导入较慢, 在首次分析时才加载
+    from ml_classifier import get_ml_classifier
+
+    local_verdicts = []
+    classifier = get_ml_classifier()
+    if classifier is not None:
+        local_verdicts, lines = classifier.triage(lines)
+        if on_verdict is not None:
+            for verdict in local_verdicts:
+                on_verdict(verdict)
+        if not lines:
+            return local_verdicts
+    attack_data = _call_ai(lines, on_verdict)
+    if attack_data is None:
+        return local_verdicts or None
+    return local_verdicts + attack_data
+
+def verdict_ip(verdict):
+    """判定对象中可用的源 IP; 不是对象、缺少 ip 或 ip 不是字符串时返回 None"""
+    ip = verdict.get("ip") if isinstance(verdict, dict) else None
+    return ip if isinstance(ip, str) and ip else None
+
+def record_attacks(lines, attack_data, analyzed_by="AI"):
+    """把判定的攻击写入数据库, 返回攻击信息字典
+    Args:
+        analyzed_by: 判定来源; 攻击对象自带 analyzed_by 时以对象为准 (本地分类器/降级签名)
+    """
+    log_content = "\n".join(lines)  # 使用批次日志作为内容
+
+    # 记录攻击信息到数据库
+    for attack in attack_data:
+        ip = attack.get("ip")
+        attack_type = attack.get("attack_type", "未知攻击")
+
+        if ip:
+            ATTACKS_DETECTED.labels(attack_type).inc()
+            try:
+                # 记录攻击到数据库
+                with DB_WRITE_LATENCY.time():
+                    get_db_manager().add_attack_record(
                         source_ip=ip,
                         attack_type=attack_type,
                         log_content=log_content,
                         severity=3,  # 默认中等严重程度
-                        is_blocked=True  # 标记为需要封禁
+                        is_blocked=True,  # 标记为需要封禁
+                        analyzed_by=attack.get("analyzed_by", analyzed_by)
                     )
-                    logger.info(f"记录攻击: IP={ip}, 类型={attack_type}")
-                except Exception as db_error:
-                    logger.error(f"数据库记录失败: {db_error}")
-        
-        # 返回攻击信息字典格式
-        attack_ips = [attack["ip"] for attack in attack_data if attack.get("ip")]
-        attack_types = list(set([attack.get("attack_type", "未知攻击") for attack in attack_data]))
-        
-        return {
-            "attack_ips": attack_ips,
-            "attack_types": attack_types
-        }
-        
-    except Exception as e:
-        logger.error(f"调用 AI 接口失败: {e}")
-        return []
+                logger.info(f"记录攻击: IP={ip}, 类型={attack_type}")
+            except Exception as db_error:
+                logger.error(f"数据库记录失败: {db_error}")
+
+    # 返回攻击信息字典格式
+    attack_ips = [attack["ip"] for attack in attack_data if attack.get("ip")]
+    attack_types = list(set([attack.get("attack_type", "未知攻击") for attack in attack_data]))
+
+    return {
+        "attack_ips": attack_ips,
+        "attack_types": attack_types
+    }
+
+def analyze_lines_ai(lines, on_attack=None, blocked=None):
+    """一次发送多行日志给 AI 分析，返回攻击IP和类型信息
+    Args:
+        on_attack: 每个攻击 IP 写库后立即回调 (例如封禁)，流式模式下无需等待完整响应
+        blocked: 已封禁地址索引; 对已封禁 IP 的重复判定不再写库
+    """
+    attack_ips = []
+    attack_types = set()
+
+    def handle(verdict):
+        ip = verdict_ip(verdict)
+        if ip is None or (blocked is not None and ip in blocked):
+            return
+        result = record_attacks(lines, [verdict])
+        attack_types.update(result["attack_types"])
+        for ip in result["attack_ips"]:
+            attack_ips.append(ip)
+            if on_attack is not None:
+                on_attack(ip)
+
+    request_ai_verdicts(lines, handle)
+    return {
+        "attack_ips": attack_ips,
+        "attack_types": list(attack_types)
+    }
+
+def observe_lines(lines, use_log_time=False, blocked=None):
+    """解析日志行，计入按 IP 的滑动窗口统计和速率异常检测
+    Args:
+        use_log_time: True 时以日志自身的时间戳划分窗口 (回放历史日志时使用)，否则使用读入时刻
+        blocked: 已封禁地址索引; 这些来源的流量仍计入统计, 但不参与异常检测, 避免重复判定
+    Returns:
+        AnomalyReport: 异常检测窗口结束时返回，否则为 None
+    """
+    parser = LogParser()
+    return observe_records([parser.parse(line) for line in lines], use_log_time, blocked)
+
+def observe_records(records, use_log_time=False, blocked=None):
+    """同 observe_lines，输入为已解析的 LogRecord (分片 worker 已完成解析时使用)"""
+    # numpy 导入较慢，在首次处理日志时才加载
+    from anomaly import get_anomaly_detector
+
+    now = None
+    if use_log_time:
+        now = next((r.timestamp for r in reversed(records) if r is not None and r.timestamp), None)
+    get_ip_stats().add_records(records, now)
+    if blocked is not None and len(blocked):
+        records = [r for r in records if r is None or r.ip is None or r.ip not in blocked]
+    return get_anomaly_detector().feed(records, now)
+
+def record_local_verdicts(report):
+    """把异常检测在本地判定的容量型攻击写入数据库, 返回攻击 IP 列表"""
+    attack_ips = []
+    for verdict in report.verdicts:
+        logger.warning(f"本地检测到容量型攻击: IP={verdict['ip']}, 类型={verdict['attack_type']}")
+        result = record_attacks(report.verdict_lines[verdict["ip"]], [verdict], analyzed_by="anomaly")
+        attack_ips.extend(result["attack_ips"])
+    return attack_ips
+
+def start_ip_stats_publisher(path=IP_STATS_SNAPSHOT_FILE, interval=IP_STATS_PUBLISH_INTERVAL):
+    """后台定期发布 IP 统计快照，供 Dashboard 的 /api/ip-stats 读取"""
+    from cache_snapshot import SingleRefresher
+
+    publisher = SingleRefresher(get_ip_stats().snapshot, path, f"{path}.lock", interval, logger=logger)
+    publisher.start()
+    return publisher
+
+def screen_batch(batch, fw, batch_size=BATCH_SIZE):
+    """本地处理一个批次: 统计、异常检测并封禁容量型攻击, 返回需要交给 AI 的批次 [(日志行, 调度分数)]
+    ANOMALY_GATE_AI 开启时只返回异常实体的日志行, 按 batch_size 切分, 容量型攻击候选排在最前 (分数为 URGENT_SCORE);
+    分数为 None 的批次由调度器按可疑度评分
+    """
+    from scheduler import URGENT_SCORE
+
+    report = observe_lines(batch, blocked=fw.blocked)
+    if report is not None:
+        for ip in record_local_verdicts(report):
+            fw.add_ip(ip)
+    if ANOMALY_GATE_AI:
+        if report is None:
+            return []
+        return ([(lines, URGENT_SCORE) for lines in iter_batches(report.urgent_lines, batch_size)] +
+                [(lines, None) for lines in iter_batches(report.forward_lines, batch_size)])
+    # 已封禁来源的日志行不再交给 AI
+    batch = fw.blocked.drop_blocked(batch)
+    return [(batch, None)] if batch else []
+
+def process_batch(batch, fw):
+    """分析一个批次并封禁检测到的攻击 IP"""
+    attack_ips = []
+    attack_types = set()
+    for lines, _ in screen_batch(batch, fw):
+        result = analyze_lines_ai(lines, on_attack=fw.add_ip, blocked=fw.blocked)
+        attack_ips += result["attack_ips"]
+        attack_types.update(result["attack_types"])
+    return {"attack_ips": attack_ips, "attack_types": list(attack_types)}
 
 # ================= 统计展示 =================
 def show_attack_statistics():
     """显示攻击类型分组统计"""
     try:
-        stats = db_manager.get_attack_type_summary()
+        stats = get_db_manager().get_attack_type_summary()
         if stats:
             logger.info("=== 攻击类型统计 ===")
             total_attacks = sum(data["count"] for data in stats.values())
@@ -276,44 +778,132 @@ def show_attack_statistics():
     except Exception as e:
         logger.error(f"获取统计信息失败: {e}")
 
+def register_checkpoint(checkpoint, fw, scheduler, offsets=None):
+    """把分析进程的状态注册到检查点, 已读取的检查点中有对应分段时立即恢复
+    Args:
+        offsets: sample_log_lines 的读取偏移 (分片模式下 worker 从文件末尾跟踪, 不需要)
+    """
+    from fallback import get_reanalysis_queue
+
+    cache = get_verdict_cache()
+    stats = get_ip_stats()
+    reanalysis = get_reanalysis_queue()
+    # 黑名单在创建 FirewallAI 时已经恢复
+    checkpoint.register('blocked', fw.blocked.entries)
+    sections = [
+        ('verdicts', cache.dump, cache.load),
+        ('ip_stats', stats.dump_state, stats.load_state),
+        ('scheduler', scheduler.pending, scheduler.restore),
+        ('reanalysis', reanalysis.pending, reanalysis.restore),
+    ]
+    if offsets is not None:
+        sections.append(('offsets', lambda: offsets, offsets.update))
+    restored = [name for name, dump, restore in sections if checkpoint.register(name, dump, restore)]
+    if restored:
+        logger.info(f"已从检查点恢复: {', '.join(restored)}")
+
 # ================= 主循环 =================
 def main():
-    fw = FirewallAI()
+    # 先读取检查点: 链已存在时黑名单直接从检查点恢复
+    from checkpoint import Checkpointer
+    checkpoint = Checkpointer()
+    fw = FirewallAI(blocked=checkpoint.load().get('blocked'))
     logger.info("开始监控日志，按 Ctrl+C 停止")
+    logger.debug(f"AI 提示词:\n{AI_PROMPT_TEMPLATE}")
     
     # 初始化数据库连接
     try:
         # 测试数据库连接
-        db_manager.get_attack_statistics()
+        get_db_manager().get_attack_statistics()
         logger.info("数据库连接正常")
     except Exception as e:
         logger.error(f"数据库连接失败: {e}")
         return
     
+    # 独立端口导出 Prometheus 指标
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_HOST)
+        QUEUE_DEPTH.labels('log').set_function(log_queue_depth)
+        logger.info(f"指标服务已启动: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    start_ip_stats_publisher()
+    # 定期记录进程资源占用, 供 Dashboard 显示运行时间和资源趋势
+    from resource_sampler import ResourceSampler
+    ResourceSampler().start()
+    
+    if INGEST_WORKERS > 0:
+        run_sharded(fw, checkpoint)
+        return
+    
     # 统计展示计数器
     stat_counter = 0
     stat_interval = 10  # 每10次循环显示一次统计
     
+    # 按可疑度调度 AI 批次, 受每分钟请求数和 token 预算限制
+    from scheduler import BatchScheduler
+    from circuit_breaker import get_ai_breaker
+    from fallback import get_reanalysis_queue
+    scheduler = BatchScheduler()
+    # 每个文件已读到的位置, 只分析新写入的行
+    offsets = {}
+    register_checkpoint(checkpoint, fw, scheduler, offsets)
+    
     try:
         while True:
-            batches = sample_log_lines()
-            for batch in batches:
+            deadline = time.monotonic() + CHECK_INTERVAL
+            for batch in sample_log_lines(offsets=offsets):
                 if batch:  # 确保批次不为空
-                    result = analyze_lines_ai(batch)
-                    for ip in result["attack_ips"]:
-                        fw.add_ip(ip)
+                    for lines, score in screen_batch(batch, fw):
+                        scheduler.submit(lines, score=score)
+            # AI 恢复后, 降级期间本地分类过的批次重新交给 AI 复核
+            get_reanalysis_queue().drain_to(scheduler, get_ai_breaker())
+            # 本周期内先分析最可疑的批次, 来不及分析的留到下个周期与新批次一起排序
+            while True:
+                batch = scheduler.get(timeout=max(0.0, deadline - time.monotonic()))
+                if batch is None:
+                    break
+                analyze_lines_ai(batch, on_attack=fw.add_ip, blocked=fw.blocked)
             
-            # 定期显示统计信息
+            # 定期显示统计信息, 并按 iptables 实际规则校正黑名单索引
             stat_counter += 1
             if stat_counter >= stat_interval:
                 show_attack_statistics()
+                fw.sync_blacklist()
                 stat_counter = 0
+            # 本周期的读取位置与未分析完的批次一起保存
+            checkpoint.maybe_save()
                 
-            time.sleep(CHECK_INTERVAL)
+            time.sleep(max(0.0, deadline - time.monotonic()))
     except KeyboardInterrupt:
         print("监控停止")
+        checkpoint.save()
         # 退出前显示最终统计
         show_attack_statistics()
 
+def run_sharded(fw, checkpoint):
+    """多进程分片模式: worker 进程持续跟踪日志文件, 本进程负责 AI 调度、写库和封禁"""
+    from sharded import ShardedIngestor
+
+    ingestor = ShardedIngestor(analyze_file_paths(), fw, workers=INGEST_WORKERS,
+                               shard_mode=SHARD_MODE, tail_mode=True)
+    register_checkpoint(checkpoint, fw, ingestor.scheduler)
+    last_stats = time.monotonic()
+
+    def on_idle():
+        nonlocal last_stats
+        # 与单进程模式一致, 约每 10 个检测周期显示一次统计
+        if time.monotonic() - last_stats >= CHECK_INTERVAL * 10:
+            show_attack_statistics()
+            fw.sync_blacklist()
+            last_stats = time.monotonic()
+        checkpoint.maybe_save()
+
+    try:
+        ingestor.run(on_idle=on_idle)
+    except KeyboardInterrupt:
+        print("监控停止")
+        ingestor.stop()
+        checkpoint.save()
+        show_attack_statistics()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI 流式响应的增量 JSON 解析
+逐段喂入 chat completion 的增量内容，数组中的每个 {"ip", "attack_type"} 对象一闭合就立即返回，
+不必等完整响应 (最多 max_tokens) 生成完毕再解析；对象之外的文字 (如 ```json 代码块标记) 会被忽略，
+说明文字中的括号 (如 "Found [2] attacks:") 不会被当作 JSON 的开始
+"""
+
+import json
+
+
+class VerdictStreamParser:
+    """增量解析 {"attack_ips": [{"ip": ..., "attack_type": ...}, ...]}"""
+
+    def __init__(self):
+        self.verdicts = []
+        self.started = False    # 是否已进入顶层 JSON
+        self.complete = False   # 顶层 JSON 是否已闭合
+        self._stack = []        # 未闭合的 { / [
+        self._opening = False   # 刚读到顶层的 {，尚未确认是 JSON 对象
+        self._in_string = False
+        self._escape = False
+        self._buf = None        # 正在捕获的数组元素对象
+        self._capture_depth = 0
+
+    def feed(self, text):
+        """喂入一段增量内容，返回本段内新闭合的攻击对象列表"""
+        if not text or self.complete:
+            return []
+        emitted = []
+        stack = self._stack
+        for ch in text:
+            if self._opening:
+                # 顶层 { 之后的第一个非空白字符必须是键或 }，否则只是说明文字中的括号，继续向后查找
+                if ch.isspace():
+                    continue
+                self._opening = False
+                if ch != '"' and ch != '}':
+                    stack.clear()
+                    self.started = False
+            if not stack:
+                # 顶层 JSON 对象之前的文字 (代码块标记、说明) 直接跳过
+                if ch == '{':
+                    stack.append(ch)
+                    self.started = True
+                    self._opening = True
+                continue
+            if self._buf is not None:
+                self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == '{' or ch == '[':
+                if ch == '{' and self._buf is None and stack[-1] == '[':
+                    # 数组中的对象: 开始捕获
+                    self._buf = ['{']
+                    self._capture_depth = len(stack)
+                stack.append(ch)
+            elif ch == '}' or ch == ']':
+                stack.pop()
+                if self._buf is not None and len(stack) == self._capture_depth:
+                    verdict = self._emit(''.join(self._buf))
+                    self._buf = None
+                    if verdict is not None:
+                        emitted.append(verdict)
+                if not stack:
+                    self.complete = True
+                    break
+        return emitted
+
+    def _emit(self, text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(obj, dict) or not obj.get('ip'):
+            return None
+        self.verdicts.append(obj)
+        return obj
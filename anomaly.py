@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基于 NumPy 的速率异常检测
+按源 IP、路径 (无路径时为协议端口)、状态类别三个维度，把实体哈希到固定大小的数组中，
+每个槽位维护请求数的 EWMA 均值/方差；每个窗口用 bincount 一次算出全部槽位的计数和 z 分数
+
+    - z 分数超过阈值的实体视为异常，附带其日志行转交 AI 分析
+    - 源 IP 的容量型异常 (DDoS / SYN Flood / UDP Flood) 默认以最高优先级交给 AI 确认；
+      开启 ANOMALY_LOCAL_BLOCK 后直接在本地判定，无需等待 AI。ANOMALY_ALLOWLIST 中的地址不做容量型判定
+"""
+
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from config import (
+    ANOMALY_WINDOW, ANOMALY_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_MIN_COUNT, ANOMALY_WARMUP_WINDOWS,
+    ANOMALY_IP_SLOTS, ANOMALY_PATH_SLOTS, ANOMALY_FLOOD_MIN, ANOMALY_LINES_PER_ENTITY,
+    ANOMALY_MAX_FORWARD_LINES, ANOMALY_LOCAL_BLOCK, ANOMALY_ALLOWLIST
+)
+from blocked_index import BlockedIndex
+from log_parsers import AUTH_FAILED, AUTH_INVALID_USER
+from metrics import REGISTRY
+
+ANOMALIES = REGISTRY.counter('aegis_anomalies_total', '速率异常检测标记的实体数', ['kind'])
+ANOMALY_SCORE_LATENCY = REGISTRY.histogram('aegis_anomaly_score_seconds', '每个窗口异常评分耗时')
+
+KIND_IP = 'ip'
+KIND_PATH = 'path'
+KIND_STATUS = 'status'
+
+# 状态类别维度的槽位数 (类别很少，哈希冲突可以忽略)
+STATUS_SLOTS = 64
+
+
+def _path_key(record):
+    if record.path is not None:
+        return record.path.split('?', 1)[0]
+    if record.port is not None:
+        return f"{record.proto or ''}:{record.port}"
+    return None
+
+
+def _status_key(record):
+    if record.status is not None:
+        return f"{record.status // 100}xx"
+    if record.auth in (AUTH_FAILED, AUTH_INVALID_USER):
+        return 'auth_failed'
+    return None
+
+
+def _is_failure(record):
+    return record.auth in (AUTH_FAILED, AUTH_INVALID_USER) or (
+        record.status is not None and record.status >= 400)
+
+
+def classify_volumetric(records):
+    """按协议特征判定容量型攻击类型；以认证失败/错误请求为主的流量不在本地判定，返回 None"""
+    n = len(records)
+    if sum(1 for r in records if _is_failure(r)) * 2 >= n:
+        return None
+    syn = sum(1 for r in records if r.flags and 'SYN' in r.flags.split() and 'ACK' not in r.flags.split())
+    if syn * 2 >= n:
+        return 'SYN Flood'
+    udp = sum(1 for r in records if r.proto and r.proto.upper() == 'UDP')
+    if udp * 2 >= n:
+        return 'UDP Flood'
+    return 'DDoS'
+
+
+class EWMABaseline:
+    """一组哈希槽位的 EWMA 均值与方差"""
+
+    def __init__(self, slots, alpha=ANOMALY_ALPHA):
+        self.slots = slots
+        self.alpha = alpha
+        self.mean = np.zeros(slots)
+        self.var = np.zeros(slots)
+
+    def index(self, keys):
+        """实体键 -> 槽位下标 (crc32 在进程间稳定)"""
+        return np.fromiter((zlib.crc32(k.encode('utf-8', 'surrogateescape')) for k in keys),
+                           dtype=np.uint32, count=len(keys)) % self.slots
+
+    def score(self, counts):
+        """z 分数；方差下限取均值 (泊松近似) 和 1，避免稀疏槽位被放大"""
+        std = np.sqrt(np.maximum(self.var, np.maximum(self.mean, 1.0)))
+        return (counts - self.mean) / std
+
+    def update(self, counts, frozen=None):
+        """用本窗口计数更新基线；异常槽位 (frozen) 不更新，避免攻击流量污染基线"""
+        diff = counts - self.mean
+        incr = self.alpha * diff
+        var = (1 - self.alpha) * (self.var + diff * incr)
+        if frozen is not None and frozen.any():
+            incr[frozen] = 0.0
+            var[frozen] = self.var[frozen]
+        self.mean += incr
+        self.var = var
+
+
+class Anomaly:
+    """一个被标记的实体"""
+
+    __slots__ = ('kind', 'key', 'count', 'zscore', 'records')
+
+    def __init__(self, kind, key, count, zscore, records):
+        self.kind = kind
+        self.key = key
+        self.count = count
+        self.zscore = zscore
+        self.records = records
+
+    def to_dict(self):
+        return {'kind': self.kind, 'key': self.key, 'count': self.count, 'zscore': round(self.zscore, 2)}
+
+
+class AnomalyReport:
+    """一个窗口的检测结果
+    verdicts: 本地判定的容量型攻击 [{"ip", "attack_type"}]，对应日志行在 verdict_lines[ip]
+    urgent_lines: 未开启本地封禁时容量型攻击候选的日志行，应以最高优先级交给 AI
+    forward_lines: 其余异常实体的日志行，交给 AI 分析
+    """
+
+    def __init__(self, window_start, window_end, records, anomalies, verdicts, verdict_lines, forward_lines,
+                 urgent_lines=None):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.records = records
+        self.anomalies = anomalies
+        self.verdicts = verdicts
+        self.verdict_lines = verdict_lines
+        self.forward_lines = forward_lines
+        self.urgent_lines = urgent_lines or []
+
+
+class AnomalyDetector:
+    """窗口化的速率异常检测器 (线程安全)"""
+
+    def __init__(self, window=ANOMALY_WINDOW, alpha=ANOMALY_ALPHA, threshold=ANOMALY_Z_THRESHOLD,
+                 min_count=ANOMALY_MIN_COUNT, warmup=ANOMALY_WARMUP_WINDOWS, ip_slots=ANOMALY_IP_SLOTS,
+                 path_slots=ANOMALY_PATH_SLOTS, flood_min=ANOMALY_FLOOD_MIN, local_block=ANOMALY_LOCAL_BLOCK,
+                 allowlist=ANOMALY_ALLOWLIST):
+        self.window = window
+        self.threshold = threshold
+        self.min_count = min_count
+        self.warmup = warmup
+        self.flood_min = flood_min
+        self.local_block = local_block
+        self.allowlist = BlockedIndex(allowlist)
+        self.baselines = {
+            KIND_IP: EWMABaseline(ip_slots, alpha),
+            KIND_PATH: EWMABaseline(path_slots, alpha),
+            KIND_STATUS: EWMABaseline(STATUS_SLOTS, alpha),
+        }
+        self.windows = 0
+        self._pending = []
+        self._window_start = None
+        self._lock = threading.Lock()
+
+    def feed(self, records, now=None):
+        """加入一批解析后的记录；窗口结束时评分并返回 AnomalyReport，否则返回 None"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._window_start is None:
+                self._window_start = now
+            self._pending.extend(r for r in records if r is not None and r.ip is not None)
+            if now - self._window_start < self.window:
+                return None
+            records, self._pending = self._pending, []
+            start, self._window_start = self._window_start, now
+            return self._score(records, start, now)
+
+    def flush(self, now=None):
+        """立即结束当前窗口 (退出前或测试时调用)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            records, self._pending = self._pending, []
+            start, self._window_start = self._window_start or now, now
+            return self._score(records, start, now)
+
+    def score_window(self, records, now=None):
+        """把 records 作为一个完整窗口评分"""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._score([r for r in records if r is not None and r.ip is not None], now, now)
+
+    def _score(self, records, start, end):
+        with ANOMALY_SCORE_LATENCY.time():
+            anomalies = []
+            key_fns = ((KIND_IP, lambda r: r.ip), (KIND_PATH, _path_key), (KIND_STATUS, _status_key))
+            for kind, key_fn in key_fns:
+                baseline = self.baselines[kind]
+                keyed = [(key_fn(r), r) for r in records]
+                keyed = [(k, r) for k, r in keyed if k is not None]
+                idx = baseline.index([k for k, _ in keyed]) if keyed else np.zeros(0, dtype=np.uint32)
+                counts = np.bincount(idx, minlength=baseline.slots).astype(float)
+                z = baseline.score(counts)
+                flagged = (z >= self.threshold) & (counts >= self.min_count)
+                if self.windows < self.warmup:
+                    # 基线尚未建立: 只标记达到容量型攻击规模的源 IP
+                    if kind == KIND_IP:
+                        flagged &= counts >= self.flood_min
+                    else:
+                        flagged[:] = False
+                slots = np.flatnonzero(flagged)
+                if len(slots):
+                    # 稳定排序一次把同槽位的记录聚在一起 (保持原顺序)，只展开被标记的槽位
+                    order = np.argsort(idx, kind='stable')
+                    starts = np.searchsorted(idx[order], slots, side='left')
+                    ends = np.searchsorted(idx[order], slots, side='right')
+                else:
+                    starts = ends = ()
+                for slot, lo, hi in zip(slots, starts, ends):
+                    # 同一槽位可能有多个实体 (哈希冲突)，按实际键拆开
+                    groups = {}
+                    for pos in order[lo:hi]:
+                        k, r = keyed[pos]
+                        groups.setdefault(k, []).append(r)
+                    for k, rs in groups.items():
+                        if len(rs) >= self.min_count:
+                            anomalies.append(Anomaly(kind, k, len(rs), float(z[slot]), rs))
+                            ANOMALIES.labels(kind).inc()
+                baseline.update(counts, flagged)
+            self.windows += 1
+            return self._build_report(records, anomalies, start, end)
+
+    def _build_report(self, records, anomalies, start, end):
+        verdicts = []
+        verdict_lines = {}
+        urgent = {}
+        for anomaly in anomalies:
+            if anomaly.kind == KIND_IP and anomaly.count >= self.flood_min and anomaly.key not in self.allowlist:
+                attack_type = classify_volumetric(anomaly.records)
+                if attack_type is None:
+                    continue
+                lines = [r.raw for r in anomaly.records[:ANOMALY_LINES_PER_ENTITY]]
+                if self.local_block:
+                    verdicts.append({'ip': anomaly.key, 'attack_type': attack_type})
+                    verdict_lines[anomaly.key] = lines
+                else:
+                    urgent[anomaly.key] = lines
+
+        # 其余异常实体的日志行交给 AI，容量型攻击的 IP 已单独处理，不再重复发送
+        forward = []
+        seen = set()
+        for anomaly in anomalies:
+            for r in anomaly.records[:ANOMALY_LINES_PER_ENTITY]:
+                if len(forward) >= ANOMALY_MAX_FORWARD_LINES:
+                    break
+                if r.ip not in verdict_lines and r.ip not in urgent and r.raw not in seen:
+                    seen.add(r.raw)
+                    forward.append(r.raw)
+        urgent_lines = [line for lines in urgent.values() for line in lines]
+        return AnomalyReport(start, end, len(records), anomalies, verdicts, verdict_lines, forward, urgent_lines)
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_anomaly_detector():
+    """进程内共享的 AnomalyDetector (首次调用时创建)"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = AnomalyDetector()
+    return _detector
+
+
+def set_anomaly_detector(detector):
+    """替换共享的 AnomalyDetector (测试用)"""
+    global _detector
+    _detector = detector
@@ -6,7 +6,8 @@ AegisLog Web Dashboard - 态势感知大屏界面
 提供实时攻击统计、最近攻击记录、被拦截IP列表和系统状态监控
 """
 
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
+import calendar
 import sqlite3
 import json
 from datetime import datetime, timedelta
@@ -14,15 +15,25 @@ import threading
 import time
 from typing import Dict, List, Any
 
-from config import DB_PATH, ATTACK_TYPES, CHECK_INTERVAL, ATTACK_TYPE_MAPPING
-from models import DatabaseManager
+from config import (
+    DB_PATH, ATTACK_TYPES, CHECK_INTERVAL, ATTACK_TYPE_MAPPING,
+    DASHBOARD_SNAPSHOT_FILE, DASHBOARD_LOCK_FILE, IP_STATS_SNAPSHOT_FILE,
+    RESOURCE_SAMPLE_INTERVAL, RESOURCE_HOUR_RETENTION
+)
+from models import get_db_manager
 from logger import AegisLogger
+from cache_snapshot import SnapshotReader, SingleRefresher
+from metrics import REGISTRY, CONTENT_TYPE
 
 # 初始化日志记录器
 logger = AegisLogger()
 
 app = Flask(__name__)
 
+# Dashboard 进程指标 (gunicorn 多 worker 时每个 worker 各自计数)
+HTTP_REQUESTS = REGISTRY.counter('aegis_http_requests_total', 'Dashboard HTTP 请求数', ['endpoint', 'status'])
+CACHE_REFRESH_LATENCY = REGISTRY.histogram('aegis_dashboard_cache_refresh_seconds', 'Dashboard 缓存刷新耗时')
+
 # 全局缓存变量，减少数据库查询频率
 cached_stats = {
     'attack_types': {},
@@ -32,10 +43,23 @@ cached_stats = {
     'last_update': None
 }
 
+# 生产模式 (create_app) 下 worker 只读取共享快照，由 SingleRefresher 负责发布
+snapshot_reader = None
+snapshot_refresher = None
+
+# 分析进程发布的按 IP 窗口统计快照 (ip_stats.py)
+ip_stats_reader = SnapshotReader(IP_STATS_SNAPSHOT_FILE)
+
+def current_stats() -> Dict[str, Any]:
+    """返回当前缓存数据，生产模式下读取已发布的共享快照"""
+    if snapshot_reader is not None:
+        return snapshot_reader.read() or cached_stats
+    return cached_stats
+
 def get_attack_type_stats() -> Dict[str, int]:
     """获取攻击类型统计"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         return db_manager.get_attack_type_statistics()
     except Exception as e:
         logger.error(f"获取攻击类型统计失败: {e}")
@@ -44,7 +68,7 @@ def get_attack_type_stats() -> Dict[str, int]:
 def get_recent_attacks(limit: int = 20) -> List[Dict[str, Any]]:
     """获取最近攻击记录"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         return db_manager.get_recent_attacks(limit)
     except Exception as e:
         logger.error(f"获取最近攻击记录失败: {e}")
@@ -53,7 +77,7 @@ def get_recent_attacks(limit: int = 20) -> List[Dict[str, Any]]:
 def get_blocked_ips(limit: int = 50) -> List[Dict[str, Any]]:
     """获取被拦截IP列表"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         return db_manager.get_blocked_ips(limit)
     except Exception as e:
         logger.error(f"获取被拦截IP列表失败: {e}")
@@ -62,7 +86,7 @@ def get_blocked_ips(limit: int = 50) -> List[Dict[str, Any]]:
 def get_system_status() -> Dict[str, Any]:
     """获取系统状态信息"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         total_attacks = db_manager.get_total_attacks()
         today_attacks = db_manager.get_today_attacks()
         blocked_count = db_manager.get_total_blocked_ips()
@@ -78,22 +102,49 @@ def get_system_status() -> Dict[str, Any]:
         logger.error(f"获取系统状态失败: {e}")
         return {}
 
-def get_uptime() -> str:
-    """获取系统运行时间（模拟）"""
-    # 这里可以扩展为实际的系统运行时间监控
-    return "24小时"
+def format_duration(seconds: float) -> str:
+    """把秒数格式化为 "3天4小时" / "2小时5分" / "7分钟" """
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}天{hours}小时"
+    if hours:
+        return f"{hours}小时{minutes}分"
+    return f"{minutes}分钟"
 
-def update_cache():
-    """更新缓存数据"""
-    global cached_stats
+def get_uptime() -> str:
+    """获取分析进程运行时间 (来自资源采样器写入 system_status 的启动时间)"""
     try:
-        cached_stats = {
+        status = get_db_manager().get_latest_system_status()
+    except Exception as e:
+        logger.error(f"获取运行时间失败: {e}")
+        return "未知"
+    if not status.get('started_at'):
+        return "未知"
+    now = time.time()
+    sampled_at = calendar.timegm(time.strptime(status['timestamp'], '%Y-%m-%d %H:%M:%S'))
+    # 连续多个采样周期没有新样本, 说明分析进程已经退出
+    if now - sampled_at > max(RESOURCE_SAMPLE_INTERVAL, 1) * 3:
+        return "已停止"
+    return format_duration(now - status['started_at'])
+
+def build_cache() -> Dict[str, Any]:
+    """查询数据库生成一份完整的缓存数据"""
+    with CACHE_REFRESH_LATENCY.time():
+        return {
             'attack_types': get_attack_type_stats(),
             'recent_attacks': get_recent_attacks(),
             'blocked_ips': get_blocked_ips(),
             'system_status': get_system_status(),
             'last_update': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
+
+def update_cache():
+    """更新缓存数据"""
+    global cached_stats
+    try:
+        cached_stats = build_cache()
         logger.info("缓存数据更新成功")
     except Exception as e:
         logger.error(f"更新缓存失败: {e}")
@@ -109,18 +160,18 @@ def dashboard():
     """主仪表板页面"""
     return render_template('dashboard.html', 
                          attack_types=ATTACK_TYPES,
-                         last_update=cached_stats['last_update'])
+                         last_update=current_stats()['last_update'])
 
 @app.route('/api/stats')
 def get_stats():
     """获取统计数据的API接口"""
-    return jsonify(cached_stats)
+    return jsonify(current_stats())
 
 @app.route('/api/attack-types')
 def get_attack_types_data():
     """获取攻击类型数据的API接口"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         stats = db_manager.get_attack_type_statistics()
         
         # 格式化数据用于图表显示 - 使用映射表转换数据库中的英文类型到中文显示
@@ -157,13 +208,131 @@ def get_attack_types_data():
 def get_recent_attacks_api():
     """获取最近攻击记录的API接口"""
     try:
-        db_manager = DatabaseManager()
+        db_manager = get_db_manager()
         attacks = db_manager.get_recent_attacks(50)
         return jsonify(attacks)
     except Exception as e:
         logger.error(f"获取最近攻击记录失败: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ip-stats')
+def get_ip_stats_api():
+    """获取按 IP 的滑动窗口统计 (热点 IP、失败数、独立路径数)"""
+    snapshot = ip_stats_reader.read()
+    if snapshot is None:
+        return jsonify({'error': 'IP 统计快照尚未发布'}), 503
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        snapshot = dict(snapshot, top_ips=snapshot.get('top_ips', [])[:max(0, limit)])
+    return jsonify(snapshot)
+
+@app.route('/api/search')
+def search_attacks_api():
+    """在攻击记录的日志内容中全文搜索 (路径、User-Agent、payload 等子串)
+    q: 查询字符串 (按字面子串匹配，不区分大小写); attack_type/source_ip: 可选过滤
+    sort: rank 按相关度 (page/per_page 分页) 或 recent 按从新到旧 (before_id 翻页，取上一页的 next_before_id)
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少查询参数 q'}), 400
+    sort = request.args.get('sort', 'rank')
+    if sort not in ('rank', 'recent'):
+        return jsonify({'error': 'sort 只能是 rank 或 recent'}), 400
+    page = max(request.args.get('page', default=1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', default=20, type=int), 1), 100)
+    before_id = request.args.get('before_id', type=int)
+    started = time.perf_counter()
+    try:
+        # 多取一条判断是否还有下一页，避免对全部命中记录计数
+        results = get_db_manager().search_attack_records(
+            query, limit=per_page + 1, offset=0 if before_id is not None else (page - 1) * per_page,
+            sort=sort, before_id=before_id,
+            attack_type=request.args.get('attack_type') or None,
+            source_ip=request.args.get('source_ip') or None
+        )
+    except Exception as e:
+        logger.error(f"搜索攻击记录失败: {e}")
+        return jsonify({'error': str(e)}), 500
+    has_more = len(results) > per_page
+    results = results[:per_page]
+    return jsonify({
+        'query': query,
+        'sort': sort,
+        'page': page,
+        'per_page': per_page,
+        'has_more': has_more,
+        'next_before_id': results[-1]['id'] if has_more and sort == 'recent' else None,
+        'results': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route('/api/asn-stats')
+def get_asn_stats_api():
+    """按 ASN 汇总封禁 IP (需要先用 geoip.py 生成离线库)
+    limit: 返回的 ASN 数，默认 20
+    """
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), 500)
+    try:
+        return jsonify(get_db_manager().get_asn_statistics(limit))
+    except Exception as e:
+        logger.error(f"获取 ASN 统计失败: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system-trends')
+def get_system_trends_api():
+    """获取分析进程的资源趋势 (RSS、CPU、每秒行数、队列长度)
+    hours: 时间范围(小时)，默认 24；较早的样本已降采样为每分钟/每小时一条
+    """
+    hours = request.args.get('hours', default=24, type=float)
+    seconds = min(max(hours, 0) * 3600, RESOURCE_HOUR_RETENTION)
+    try:
+        samples = get_db_manager().get_system_trends(seconds)
+    except Exception as e:
+        logger.error(f"获取资源趋势失败: {e}")
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'samples': samples, 'uptime': get_uptime()})
+
+@app.route('/api/export/<name>')
+def export_api(name):
+    """流式导出全部攻击记录 (attacks) 或封禁 IP (blocked_ips)，内存占用与行数无关
+    format: ndjson (默认) / csv; gzip=1: 边读边压缩 (Content-Encoding: gzip)
+    since/until: 时间范围 (unix 时间戳或 ISO 格式，含 since 不含 until)
+    after_id: 从上次中断处继续 (最后收到的一行的 id); 其余参数按列过滤，例如 attack_type=XSS
+    """
+    from exporter import FORMATS, MIME_TYPES, export_stream, parse_time
+
+    db_manager = get_db_manager()
+    if name not in db_manager.EXPORT_TABLES:
+        return jsonify({'error': f'未知的导出对象: {name}'}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({'error': 'format 只能是 ndjson 或 csv'}), 400
+    filterable = db_manager.EXPORT_TABLES[name][3]
+    filters = {column: request.args[column] for column in filterable if request.args.get(column)}
+    try:
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'error': f'时间格式错误: {e}'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    stream = export_stream(db_manager, name, fmt, compress, since=since, until=until,
+                           after_id=request.args.get('after_id', type=int), filters=filters)
+    response = Response(stream, mimetype=MIME_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标导出"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.after_request
+def count_request(response):
+    HTTP_REQUESTS.labels(request.endpoint or 'unknown', response.status_code).inc()
+    return response
+
 def calculate_percentage(part: int, total: int) -> float:
     """计算百分比"""
     if total == 0:
@@ -181,9 +350,25 @@ def initialize():
     thread.start()
     logger.info("缓存更新线程已启动")
 
-# 在应用启动时立即初始化
-initialize()
+def create_app(snapshot_path: str = DASHBOARD_SNAPSHOT_FILE,
+               lock_path: str = DASHBOARD_LOCK_FILE,
+               interval: float = CHECK_INTERVAL) -> Flask:
+    """生产环境 WSGI 工厂 (gunicorn 'app:create_app()')
+
+    每个 worker 都会启动一个 SingleRefresher，但跨进程只有持有文件锁的那个真正查询数据库
+    并发布快照；其余 worker 只读取快照文件，持锁进程退出后自动由其他 worker 接管
+    """
+    global snapshot_reader, snapshot_refresher
+    if snapshot_reader is None:
+        snapshot_reader = SnapshotReader(snapshot_path)
+        snapshot_refresher = SingleRefresher(build_cache, snapshot_path, lock_path,
+                                             interval, logger=logger)
+        snapshot_refresher.start()
+        logger.info("AegisLog Web Dashboard 以快照模式启动")
+    return app
 
 if __name__ == '__main__':
+    # 开发服务器: 单进程内存缓存
+    initialize()
     logger.info("启动 Flask 开发服务器...")
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dashboard 压测脚本 - 测量 requests/sec
+
+用法:
+    gunicorn -w 4 -b 127.0.0.1:8000 'app:create_app()'
+    python3 bench_dashboard_load.py --url http://127.0.0.1:8000 --concurrency 32 --duration 10
+"""
+
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def worker(host, port, paths, deadline, latencies, errors, lock):
+    """单个压测线程: 复用 keep-alive 连接循环请求"""
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    local_latencies = []
+    local_errors = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def run_load_test(url, paths, concurrency, duration):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(host, port, paths, deadline, latencies, errors, lock))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        'requests': total,
+        'errors': sum(errors),
+        'elapsed': elapsed,
+        'rps': total / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p99_ms': latencies[min(total - 1, int(total * 0.99))] * 1000 if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AegisLog Dashboard 压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Dashboard 地址')
+    parser.add_argument('--paths', default='/api/stats', help='压测路径(逗号分隔)')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    parser.add_argument('--duration', type=float, default=10.0, help='压测时长(秒)')
+    args = parser.parse_args()
+
+    paths = [p.strip() for p in args.paths.split(',') if p.strip()]
+    result = run_load_test(args.url, paths, args.concurrency, args.duration)
+    print(f"请求数: {result['requests']}, 错误: {result['errors']}, 耗时: {result['elapsed']:.2f}s")
+    print(f"吞吐: {result['rps']:.1f} req/s, p50: {result['p50_ms']:.2f}ms, p99: {result['p99_ms']:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
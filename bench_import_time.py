@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+导入耗时预算检查 - 基于 `python -X importtime`
+
+每个模块在独立的解释器中导入多次，取累计耗时的最小值与预算比较；
+加 --check 时超出预算返回非零退出码，可接入 CI
+
+用法:
+    python3 bench_import_time.py --check
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 模块导入耗时预算 (毫秒，累计值，包含依赖)
+IMPORT_BUDGET_MS = {
+    'config': 10,
+    'logger': 40,      # 主要是标准库 logging 本身
+    'models': 60,
+    'aegis_log': 120,  # openai SDK 延迟到首次调用时导入
+    'app': 500,        # Flask 本身的导入开销
+}
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.+)$')
+
+
+def measure_import(module: str, repeat: int = 5) -> float:
+    """返回模块导入的累计耗时(毫秒)，多次测量取最小值"""
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"导入 {module} 失败:\n{result.stderr}")
+        for line in result.stderr.splitlines():
+            m = _IMPORTTIME_RE.match(line)
+            if m and m.group(3).strip() == module:
+                cumulative_ms = int(m.group(2)) / 1000
+                best = cumulative_ms if best is None else min(best, cumulative_ms)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AegisLog 模块导入耗时预算')
+    parser.add_argument('--check', action='store_true', help='超出预算时返回非零退出码')
+    parser.add_argument('--repeat', type=int, default=5, help='每个模块的测量次数')
+    args = parser.parse_args()
+
+    over_budget = []
+    for module, budget in IMPORT_BUDGET_MS.items():
+        elapsed = measure_import(module, args.repeat)
+        status = 'OK' if elapsed <= budget else 'OVER'
+        print(f"{module:<12} {elapsed:8.1f} ms  (预算 {budget} ms)  {status}")
+        if elapsed > budget:
+            over_budget.append(module)
+
+    if args.check and over_budget:
+        print(f"超出导入预算: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
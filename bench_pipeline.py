@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+端到端流水线压测 - 完全离线
+合成日志 -> stream_log_files -> process_batch (本地桩 AI + 临时 SQLite) -> dry-run 防火墙，
+报告 lines/sec、从读到攻击行到封禁的延迟 p50/p99、峰值 RSS 和检出率
+
+用法:
+    python3 bench_pipeline.py --lines 20000 --batch-size 50 --ai-latency 0.05
+    python3 bench_pipeline.py --json result.json --min-lines-per-sec 2000 --max-p99 1.0
+    python3 bench_pipeline.py --files 8 --workers 0,1,2,4,8   # 多进程分片的扩展性
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+
+import aegis_log
+from logger import set_log_level
+from models import DatabaseManager, set_db_manager
+from mock_ai_server import IP_RE
+from synthetic_logs import write_log_file
+
+
+def start_mock_server(latency, jitter, fail_rate, mode, chunk_delay=0.0):
+    """在独立进程中启动桩服务，避免其内存和 CPU 计入被测进程"""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'mock_ai_server.py'), '--port', '0',
+         '--latency', str(latency), '--jitter', str(jitter),
+         '--fail-rate', str(fail_rate), '--mode', mode, '--chunk-delay', str(chunk_delay)],
+        stdout=subprocess.PIPE, text=True
+    )
+    line = proc.stdout.readline().strip()
+    if not line.startswith('MOCK_AI_URL='):
+        proc.kill()
+        raise RuntimeError(f"桩服务启动失败: {line}")
+    return proc, line.split('=', 1)[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_pipeline(paths, batch_size, fw):
+    """单进程顺序执行整条流水线，返回 (行数, 每个攻击 IP 首次被读入流水线的时间)"""
+    first_seen = {}
+    total = 0
+    for batch in aegis_log.iter_batches(aegis_log.stream_log_files(paths), batch_size):
+        now = time.time()
+        total += len(batch)
+        for line in batch:
+            m = IP_RE.search(line)
+            if m:
+                first_seen.setdefault(m.group(1), now)
+        aegis_log.process_batch(batch, fw)
+    return total, first_seen
+
+
+def run_sharded_pipeline(paths, batch_size, fw, workers, shard_mode, ai_concurrency):
+    """多进程分片执行流水线"""
+    from sharded import ShardedIngestor
+
+    first_seen = {}
+
+    def on_batch(batch):
+        now = time.time()
+        for line in batch:
+            m = IP_RE.search(line)
+            if m:
+                first_seen.setdefault(m.group(1), now)
+
+    ingestor = ShardedIngestor(paths, fw, workers=workers, shard_mode=shard_mode,
+                               batch_size=batch_size, tail_mode=False, ai_concurrency=ai_concurrency)
+    ingestor.run(on_batch=on_batch)
+    return ingestor.lines, first_seen
+
+
+def run_benchmark(args, workers=0):
+    from openai import OpenAI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        truth = {}
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(tmp, f'access{i}.log')
+            truth.update(write_log_file(path, args.lines // args.files, attack_ratio=args.attack_ratio,
+                                        attackers=args.attackers, seed=args.seed + i))
+            paths.append(path)
+
+        set_db_manager(DatabaseManager(os.path.join(tmp, 'bench.db')))
+        proc, base_url = start_mock_server(args.ai_latency, args.ai_jitter, args.fail_rate, args.mode,
+                                           args.ai_chunk_delay)
+        try:
+            aegis_log.AI_STREAM = not args.no_stream
+            aegis_log.set_ai_client(OpenAI(api_key='bench', base_url=base_url, max_retries=0))
+            fw = aegis_log.FirewallAI(dry_run=True)
+
+            started = time.perf_counter()
+            if workers > 0:
+                total, first_seen = run_sharded_pipeline(paths, args.batch_size, fw, workers,
+                                                         args.shard_mode, args.ai_concurrency)
+            else:
+                total, first_seen = run_pipeline(paths, args.batch_size, fw)
+            elapsed = time.perf_counter() - started
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        blocked_at = fw.dry_run.blocked_at
+        latencies = [blocked_at[ip] - first_seen[ip] for ip in blocked_at if ip in first_seen]
+        detected = set(blocked_at) & set(truth)
+        return {
+            'workers': workers,
+            'lines': total,
+            'elapsed_s': round(elapsed, 3),
+            'lines_per_sec': round(total / elapsed, 1) if elapsed > 0 else 0.0,
+            'block_latency_p50_s': round(percentile(latencies, 50), 4),
+            'block_latency_p99_s': round(percentile(latencies, 99), 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'attackers': len(truth),
+            'blocked': len(blocked_at),
+            'recall': round(len(detected) / len(truth), 3) if truth else 1.0,
+            'false_blocks': len(set(blocked_at) - set(truth)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AegisLog 端到端流水线压测')
+    parser.add_argument('--lines', type=int, default=20000, help='总日志行数')
+    parser.add_argument('--files', type=int, default=2, help='日志文件数')
+    parser.add_argument('--batch-size', type=int, default=50, help='每批发送给 AI 的行数')
+    parser.add_argument('--attack-ratio', type=float, default=0.02, help='攻击流量占比')
+    parser.add_argument('--attackers', type=int, default=20, help='攻击者 IP 数')
+    parser.add_argument('--ai-latency', type=float, default=0.05, help='桩 AI 响应延迟(秒)')
+    parser.add_argument('--ai-jitter', type=float, default=0.0, help='桩 AI 延迟抖动(秒)')
+    parser.add_argument('--ai-chunk-delay', type=float, default=0.0, help='桩 AI 流式响应每个增量的间隔(秒)')
+    parser.add_argument('--no-stream', action='store_true', help='关闭流式响应，等待完整响应后再解析')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='桩 AI 失败率')
+    parser.add_argument('--mode', default='rules', choices=['rules', 'none', 'all'], help='桩 AI 判定模式')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--workers', default='0',
+                        help='采集 worker 进程数, 逗号分隔可依次测试多个值 (0 表示单进程)')
+    parser.add_argument('--shard-mode', default='file', choices=['file', 'ip'], help='分片方式')
+    parser.add_argument('--ai-concurrency', type=int, default=4, help='多进程模式下并发的 AI 请求数')
+    parser.add_argument('--log-level', default='WARNING', help='压测期间 AegisLogger 的日志级别')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    parser.add_argument('--min-lines-per-sec', type=float, help='吞吐低于该值时返回非零退出码')
+    parser.add_argument('--max-p99', type=float, help='封禁延迟 p99 高于该值(秒)时返回非零退出码')
+    args = parser.parse_args()
+
+    set_log_level(args.log_level)
+    results = []
+    for workers in [int(w) for w in args.workers.split(',')]:
+        result = run_benchmark(args, workers)
+        results.append(result)
+        for key, value in result.items():
+            print(f"{key:<22} {value}")
+        print()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results if len(results) > 1 else results[0], f, indent=2)
+
+    failed = []
+    for result in results:
+        if args.min_lines_per_sec is not None and result['lines_per_sec'] < args.min_lines_per_sec:
+            failed.append(f"workers={result['workers']} 吞吐 {result['lines_per_sec']} < {args.min_lines_per_sec}")
+        if args.max_p99 is not None and result['block_latency_p99_s'] > args.max_p99:
+            failed.append(f"workers={result['workers']} p99 {result['block_latency_p99_s']}s > {args.max_p99}s")
+    if failed:
+        print("性能回归: " + '; '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+已封禁地址索引
+精确地址用哈希集合，CIDR 网段用按位前缀树，与 FirewallAI 的黑名单保持同步；
+流水线在发送给 AI 之前用它丢弃已封禁来源的日志行，这些行只计入计数器，不再消耗 token 和数据库记录
+"""
+
+import ipaddress
+import socket
+import threading
+
+from log_parsers import LogParser
+from metrics import LINES_FILTERED
+
+
+class _PrefixTrie:
+    """单一地址族的二进制前缀树，节点为 [子节点0, 子节点1, 是否为已封禁网段]"""
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = [None, None, False]
+        self.size = 0
+
+    def add(self, value, prefixlen):
+        node = self.root
+        for i in range(prefixlen):
+            bit = (value >> (self.bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        if not node[2]:
+            node[2] = True
+            self.size += 1
+
+    def discard(self, value, prefixlen):
+        node = self.root
+        for i in range(prefixlen):
+            node = node[(value >> (self.bits - 1 - i)) & 1]
+            if node is None:
+                return
+        if node[2]:
+            node[2] = False
+            self.size -= 1
+
+    def networks(self):
+        """生成全部已封禁网段 (网络地址, 前缀长度)"""
+        stack = [(self.root, 0, 0)]
+        while stack:
+            node, value, depth = stack.pop()
+            if node[2]:
+                yield value << (self.bits - depth), depth
+            for bit in (0, 1):
+                if node[bit] is not None:
+                    stack.append((node[bit], (value << 1) | bit, depth + 1))
+
+    def contains(self, value):
+        node = self.root
+        for i in range(self.bits):
+            if node[2]:
+                return True
+            node = node[(value >> (self.bits - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+class BlockedIndex:
+    """已封禁的地址和网段 (写操作加锁，查询无锁)"""
+
+    def __init__(self, entries=()):
+        self._lock = threading.Lock()
+        self._exact = set()
+        self._tries = {4: _PrefixTrie(32), 6: _PrefixTrie(128)}
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self._exact) + self._tries[4].size + self._tries[6].size
+
+    def __contains__(self, ip):
+        """ip 是否已封禁 (精确匹配或落在已封禁网段内)；不是字符串的值 (如 AI 返回的 null) 视为未封禁"""
+        if not isinstance(ip, str):
+            return False
+        if ip in self._exact:
+            return True
+        if ':' in ip:
+            trie, family = self._tries[6], socket.AF_INET6
+        else:
+            trie, family = self._tries[4], socket.AF_INET
+        if not trie.size:
+            return False
+        try:
+            value = int.from_bytes(socket.inet_pton(family, ip), 'big')
+        except OSError:
+            return False
+        return trie.contains(value)
+
+    @staticmethod
+    def _parse(entry):
+        network = ipaddress.ip_network(entry.strip(), strict=False)
+        return network, network.prefixlen == network.max_prefixlen
+
+    def add(self, entry):
+        """加入地址 (1.2.3.4) 或网段 (10.0.0.0/8)；无法解析的条目忽略并返回 False"""
+        try:
+            network, exact = self._parse(entry)
+        except ValueError:
+            return False
+        with self._lock:
+            if exact:
+                self._exact.add(str(network.network_address))
+            else:
+                self._tries[network.version].add(int(network.network_address), network.prefixlen)
+        return True
+
+    def discard(self, entry):
+        try:
+            network, exact = self._parse(entry)
+        except ValueError:
+            return
+        with self._lock:
+            if exact:
+                self._exact.discard(str(network.network_address))
+            else:
+                self._tries[network.version].discard(int(network.network_address), network.prefixlen)
+
+    def entries(self):
+        """全部已封禁的地址和网段 (可以交给 BlockedIndex(entries) 重建)"""
+        with self._lock:
+            entries = sorted(self._exact)
+            for trie in self._tries.values():
+                address = ipaddress.IPv4Address if trie.bits == 32 else ipaddress.IPv6Address
+                entries += [f"{address(value)}/{prefixlen}" for value, prefixlen in trie.networks()]
+        return entries
+
+    def replace(self, entries):
+        """用完整的黑名单重建索引"""
+        fresh = BlockedIndex(entries)
+        with self._lock:
+            self._exact = fresh._exact
+            self._tries = fresh._tries
+
+    def drop_blocked(self, lines):
+        """去掉来源已封禁的日志行，计入 aegis_lines_filtered_total{reason="blocked"}"""
+        if not len(self):
+            return lines
+        parser = LogParser()
+        keep = self.keep_mask([parser.parse(line) for line in lines])
+        return [line for line, kept in zip(lines, keep) if kept]
+
+    def keep_mask(self, records):
+        """已解析记录中哪些来源未封禁 (与 records 对齐的布尔列表)，同样计入 blocked 过滤计数"""
+        keep = [record is None or record.ip is None or record.ip not in self for record in records]
+        dropped = len(keep) - sum(keep)
+        if dropped:
+            LINES_FILTERED.labels('blocked').inc(dropped)
+        return keep
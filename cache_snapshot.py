@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Dashboard 缓存快照 - 多进程共享
+gunicorn 多 worker 部署时，只有持有文件锁的进程刷新数据库统计并发布快照文件，
+其余 worker 只读取已发布的快照，避免 N 个刷新线程同时查询数据库
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+def write_snapshot(path: str, data: Dict[str, Any]):
+    """原子写入快照: 先写临时文件再 rename，读者不会看到半个文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+
+
+class SnapshotReader:
+    """快照读取器，文件未变化时直接返回内存中的副本"""
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._data = None
+        self._signature = None
+        self._next_check = 0.0
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        """返回最新快照；快照尚未发布时返回 None"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._data
+        self._next_check = now + self.check_interval
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._data
+
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if signature != self._signature:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+                self._signature = signature
+            except (OSError, ValueError):
+                # 读取失败时保留旧快照，下个周期重试
+                pass
+        return self._data
+
+
+class SingleRefresher:
+    """跨进程唯一的缓存刷新器
+
+    每个进程都可以启动一个 SingleRefresher，但只有成功获取文件锁的进程会执行刷新；
+    其余进程定期重试获取锁，持锁进程退出后由它们自动接管
+    """
+
+    def __init__(self, build_fn: Callable[[], Dict[str, Any]], snapshot_path: str,
+                 lock_path: str, interval: float, logger=None):
+        self.build_fn = build_fn
+        self.snapshot_path = snapshot_path
+        self.lock_path = lock_path
+        self.interval = interval
+        self.logger = logger
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_file is not None
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试获取刷新锁"""
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        """释放刷新锁"""
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def refresh_once(self):
+        """刷新一次并发布快照"""
+        data = self.build_fn()
+        write_snapshot(self.snapshot_path, data)
+
+    def run(self):
+        while not self._stop.is_set():
+            if self.try_acquire():
+                try:
+                    self.refresh_once()
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"发布缓存快照失败: {e}")
+            self._stop.wait(self.interval)
+        self.release()
+
+    def start(self):
+        """启动后台刷新线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='cache-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
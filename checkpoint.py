@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+分析进程状态检查点
+重启 aegis_log.py 时内存中的状态会全部丢失: 读到了日志的哪个位置、哪些批次已经分析过、
+按 IP 的滑动窗口统计、还在排队等待 AI 的批次。各组件把自己的状态注册到 Checkpointer，
+分析进程定期把它们原子写入一个二进制文件，启动时读取并恢复，重启后从中断处继续，不重复调用 AI
+
+文件格式 (整数均为大端):
+    头部 24 字节: 魔数 b'AEGCKP1\\0'，保存时间 (double)，正文长度 (u32)，正文 CRC32 (u32)
+    正文 (zlib 压缩): 若干个分段，每段为 名称长度 u16，类型 u8 (0 二进制 / 1 JSON)，数据长度 u32，名称，数据
+
+魔数、长度或 CRC 不符的文件 (例如写入时断电) 整体忽略，分析进程按冷启动处理
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+
+from config import CHECKPOINT_FILE, CHECKPOINT_INTERVAL
+from logger import AegisLogger
+from metrics import REGISTRY
+
+logger = AegisLogger()
+
+CHECKPOINT_SAVE_LATENCY = REGISTRY.histogram('aegis_checkpoint_save_seconds', '检查点保存耗时')
+CHECKPOINT_SIZE = REGISTRY.gauge('aegis_checkpoint_bytes', '最近一次保存的检查点大小 (字节)')
+
+MAGIC = b'AEGCKP1\0'
+HEADER = struct.Struct('>8sdII')
+SECTION = struct.Struct('>HBI')
+KIND_BYTES = 0
+KIND_JSON = 1
+
+
+class CheckpointError(ValueError):
+    """检查点文件损坏或格式不符"""
+
+
+def write_checkpoint(path, sections, saved_at=None):
+    """把 {名称: bytes 或可 JSON 序列化的对象} 原子写入 path (先写临时文件并 fsync 再替换)，返回文件大小"""
+    parts = []
+    for name, value in sections.items():
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            kind, data = KIND_BYTES, bytes(value)
+        else:
+            kind, data = KIND_JSON, json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        encoded = name.encode('utf-8')
+        parts += [SECTION.pack(len(encoded), kind, len(data)), encoded, data]
+    body = zlib.compress(b''.join(parts), 1)
+    header = HEADER.pack(MAGIC, time.time() if saved_at is None else saved_at, len(body), zlib.crc32(body))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(header) + len(body)
+
+
+def read_checkpoint(path):
+    """读取检查点，返回 (保存时间, {名称: bytes 或 JSON 对象})；文件不存在时返回 None
+    Raises:
+        CheckpointError: 文件损坏 (截断、CRC 不符等)
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        raise CheckpointError(f"{path} 长度不足")
+    magic, saved_at, length, crc = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise CheckpointError(f"{path} 不是检查点文件")
+    body = data[HEADER.size:]
+    if len(body) != length or zlib.crc32(body) != crc:
+        raise CheckpointError(f"{path} 已损坏 (长度或 CRC 不符)")
+    try:
+        body = zlib.decompress(body)
+    except zlib.error as e:
+        raise CheckpointError(f"{path} 解压失败: {e}")
+
+    sections = {}
+    pos = 0
+    while pos < len(body):
+        if pos + SECTION.size > len(body):
+            raise CheckpointError(f"{path} 分段头不完整")
+        name_length, kind, data_length = SECTION.unpack_from(body, pos)
+        pos += SECTION.size
+        name = body[pos:pos + name_length].decode('utf-8')
+        pos += name_length
+        value = body[pos:pos + data_length]
+        pos += data_length
+        if len(value) != data_length:
+            raise CheckpointError(f"{path} 分段 {name} 不完整")
+        sections[name] = json.loads(value) if kind == KIND_JSON else value
+    return saved_at, sections
+
+
+class Checkpointer:
+    """收集各组件的状态定期保存，启动时把读到的状态交还给注册的组件
+
+    register(名称, 导出函数, 恢复函数): 导出函数返回 bytes 或可 JSON 序列化的对象；
+    检查点中有同名分段时立即调用恢复函数，单个分段恢复失败只记录警告，不影响其余分段
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE, interval=CHECKPOINT_INTERVAL, clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.saved = {}
+        self.saved_at = None
+        self._providers = {}
+        self._next_save = clock() + interval
+
+    def load(self):
+        """读取检查点文件，返回其中的分段 (文件不存在或损坏时为空字典)"""
+        if not self.path:
+            return {}
+        try:
+            result = read_checkpoint(self.path)
+        except (OSError, CheckpointError) as e:
+            logger.warning(f"读取检查点失败，按冷启动处理: {e}")
+            result = None
+        if result is not None:
+            self.saved_at, self.saved = result
+            logger.info(f"已读取检查点 {self.path} (保存于 {time.time() - self.saved_at:.0f} 秒前)")
+        return self.saved
+
+    def register(self, name, dump, restore=None):
+        """注册状态分段，返回是否从检查点恢复了该分段"""
+        self._providers[name] = dump
+        if restore is None or name not in self.saved:
+            return False
+        try:
+            restore(self.saved[name])
+        except Exception as e:
+            logger.warning(f"检查点分段 {name} 恢复失败，忽略: {e}")
+            return False
+        return True
+
+    def save(self):
+        """立即保存全部已注册的分段，返回是否成功 (失败只记录错误，不影响分析)"""
+        self._next_save = self.clock() + self.interval
+        if not self.path:
+            return False
+        try:
+            with CHECKPOINT_SAVE_LATENCY.time():
+                size = write_checkpoint(self.path, {name: dump() for name, dump in self._providers.items()})
+        except Exception as e:
+            logger.error(f"保存检查点失败: {e}")
+            return False
+        CHECKPOINT_SIZE.set(size)
+        return True
+
+    def maybe_save(self):
+        """距上次保存超过 interval 秒时保存"""
+        if self.clock() >= self._next_save:
+            return self.save()
+        return False
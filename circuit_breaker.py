@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI 接口熔断器
+时间窗口内失败率过高时熔断 (open)，期间请求直接走本地降级处理，不再逐个等待超时；
+冷却 AI_BREAKER_COOLDOWN 秒后进入半开 (half_open)，放行少量探测请求，成功则恢复 (closed)，失败则重新熔断
+"""
+
+import threading
+import time
+from collections import deque
+
+from config import (
+    AI_BREAKER_WINDOW, AI_BREAKER_MIN_CALLS, AI_BREAKER_FAILURE_RATE,
+    AI_BREAKER_COOLDOWN, AI_BREAKER_HALF_OPEN_PROBES
+)
+from logger import AegisLogger
+from metrics import REGISTRY
+
+logger = AegisLogger()
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_OPEN: 1, STATE_HALF_OPEN: 2}
+
+AI_BREAKER_STATE = REGISTRY.gauge('aegis_ai_breaker_state', 'AI 熔断器状态 (0 闭合 / 1 熔断 / 2 半开)')
+AI_BREAKER_TRANSITIONS = REGISTRY.counter('aegis_ai_breaker_transitions_total', 'AI 熔断器状态切换次数', ['state'])
+
+
+class CircuitBreaker:
+    """基于失败率的熔断器 (线程安全)"""
+
+    def __init__(self, window=AI_BREAKER_WINDOW, min_calls=AI_BREAKER_MIN_CALLS,
+                 failure_rate=AI_BREAKER_FAILURE_RATE, cooldown=AI_BREAKER_COOLDOWN,
+                 half_open_probes=AI_BREAKER_HALF_OPEN_PROBES, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.state = STATE_CLOSED
+        self._calls = deque()   # (时间, 是否失败)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        AI_BREAKER_STATE.set(_STATE_VALUES[state])
+        AI_BREAKER_TRANSITIONS.labels(state).inc()
+        if state == STATE_OPEN:
+            self._opened_at = self.clock()
+            logger.warning(f"AI 接口熔断，{self.cooldown} 秒内改用本地降级分析")
+        elif state == STATE_HALF_OPEN:
+            self._probes = 0
+            logger.info("AI 熔断器半开，发送探测请求")
+        else:
+            self._calls.clear()
+            self._failures = 0
+            logger.info("AI 接口已恢复")
+
+    def rejecting(self):
+        """当前是否处于熔断冷却期 (不改变状态，供调度器判断是否需要计量)"""
+        with self._lock:
+            return self.state == STATE_OPEN and self.clock() - self._opened_at < self.cooldown
+
+    def allow(self):
+        """本次是否可以调用 AI；半开状态下只放行有限的探测请求"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                if self.clock() - self._opened_at < self.cooldown:
+                    return False
+                self._transition(STATE_HALF_OPEN)
+            if self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._transition(STATE_CLOSED)
+            elif self.state == STATE_CLOSED:
+                self._record(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._transition(STATE_OPEN)
+            elif self.state == STATE_CLOSED:
+                self._record(True)
+                calls = len(self._calls)
+                if calls >= self.min_calls and self._failures >= calls * self.failure_rate:
+                    self._transition(STATE_OPEN)
+
+    def _record(self, failed):
+        now = self.clock()
+        self._calls.append((now, failed))
+        self._failures += failed
+        cutoff = now - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            self._failures -= self._calls.popleft()[1]
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_ai_breaker():
+    """进程内共享的 AI 熔断器 (首次调用时创建)"""
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker()
+    return _breaker
+
+
+def set_ai_breaker(breaker):
+    """替换共享的 AI 熔断器 (测试用)"""
+    global _breaker
+    _breaker = breaker
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多主机部署: 轻量 agent + 中心 collector
+agent 在各主机上跟踪日志、预过滤并把日志行压缩分批发给 collector；
+collector 统一调用 AI 分析 (每条日志只分析一次)、写入数据库，并把封禁决定广播给所有 agent，
+某个节点发现的攻击者会同时在全部节点上被封禁
+
+协议: 每帧 = 1 字节类型 + 4 字节长度 + zlib 压缩的 JSON
+连接建立时 collector 先下发随机 nonce，agent 的 HELLO 带上用 CLUSTER_SECRET 计算的 HMAC，
+认证通过后才同步黑名单和接收日志；未配置密钥时只允许 unix:// 或本机地址
+
+用法 (CLUSTER_SECRET 在各节点的 config.py 中配置为相同的值):
+    python3 cluster.py collector --listen tcp://10.0.0.1:7410
+    python3 cluster.py agent --connect tcp://10.0.0.1:7410 --files /var/log/nginx/access.log
+    (单机测试可使用 unix:///tmp/aegis.sock)
+"""
+
+import argparse
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from functools import partial
+
+from circuit_breaker import get_ai_breaker
+from config import (
+    BATCH_SIZE, AI_CONCURRENCY, ANOMALY_GATE_AI, CLUSTER_ADDRESS, CLUSTER_COMPRESS_LEVEL,
+    CLUSTER_SECRET, CLUSTER_AUTH_TIMEOUT, AGENT_BATCH_LINES, AGENT_FLUSH_INTERVAL, AGENT_BUFFER_BATCHES
+)
+from log_parsers import LogParser
+from logger import AegisLogger
+from metrics import LINES_FILTERED
+from scheduler import BatchScheduler, URGENT_SCORE
+
+logger = AegisLogger()
+
+FRAME_HELLO = 1      # agent -> collector: {"agent_id", "hostname", "mac"}
+FRAME_BATCH = 2      # agent -> collector: {"lines": [...]}
+FRAME_BLOCK = 3      # collector -> agent: {"ips": [{"ip", "attack_type"}]}
+FRAME_SYNC = 4       # collector -> agent: 认证通过后下发的完整黑名单，格式同 FRAME_BLOCK
+FRAME_CHALLENGE = 5  # collector -> agent: 连接建立时下发 {"nonce"}
+
+_HEADER = struct.Struct('!BI')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+# ================= 协议 =================
+def encode_frame(kind, payload):
+    body = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                         CLUSTER_COMPRESS_LEVEL)
+    return _HEADER.pack(kind, len(body)) + body
+
+
+def read_frame(stream):
+    """从 socket.makefile('rb') 读取一帧，连接关闭时返回 None"""
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    kind, length = _HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"帧长度 {length} 超过上限")
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    # 限制解压后的大小，防止压缩炸弹
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(body, MAX_FRAME_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f"帧解压后超过上限 {MAX_FRAME_SIZE}")
+    return kind, json.loads(data)
+
+
+def hello_mac(secret, nonce, agent_id):
+    """HELLO 帧的认证码: HMAC-SHA256(密钥, nonce:agent_id)"""
+    return hmac.new(secret.encode('utf-8'), f"{nonce}:{agent_id}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def parse_address(address):
+    """解析 tcp://host:port 或 unix:///path
+    Returns:
+        (地址族, socket 地址)
+    """
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def is_local_address(address):
+    """unix:// 或回环地址 (不经过网络，无需密钥)"""
+    family, sockaddr = parse_address(address)
+    if family == socket.AF_UNIX:
+        return True
+    if sockaddr[0] == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(sockaddr[0]).is_loopback
+    except ValueError:
+        return False
+
+
+def _require_secret(address, secret):
+    if not secret and not is_local_address(address):
+        raise ValueError(f"{address} 不是本机地址，需要配置 CLUSTER_SECRET")
+
+
+# ================= collector =================
+class _Connection:
+    """collector 端的一个 agent 连接，发送需加锁 (广播与同步可能并发)"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.agent_id = None
+        self._send_lock = threading.Lock()
+
+    def send(self, data):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+
+class Collector:
+    """中心分析节点"""
+
+    def __init__(self, address=CLUSTER_ADDRESS, fw=None, batch_size=BATCH_SIZE,
+                 ai_concurrency=AI_CONCURRENCY, scheduler=None, secret=CLUSTER_SECRET):
+        _require_secret(address, secret)
+        self.address = address
+        self.secret = secret
+        self.fw = fw  # 可选: collector 所在主机也执行封禁
+        self.batch_size = batch_size
+        self.ai_concurrency = max(1, ai_concurrency)
+        self.blocked = {}  # ip -> attack_type
+        # 所有 agent 的批次按可疑度统一排队，过载时丢弃低优先级批次而不是拖慢 agent
+        self._scheduler = scheduler or BatchScheduler()
+        self._connections = set()
+        self._conn_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    @property
+    def agents(self):
+        with self._conn_lock:
+            return [c.agent_id for c in self._connections]
+
+    def _make_server(self):
+        family, sockaddr = parse_address(self.address)
+        collector = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                collector._serve_connection(self.request)
+
+        if family == socket.AF_UNIX:
+            if os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            server_cls = socketserver.ThreadingUnixStreamServer
+        else:
+            server_cls = socketserver.ThreadingTCPServer
+            server_cls.allow_reuse_address = True
+        server = server_cls(sockaddr, Handler)
+        server.daemon_threads = True
+        return server
+
+    def _handshake(self, conn, stream):
+        """下发 nonce 并校验 HELLO 的认证码, 通过时返回 HELLO 内容"""
+        nonce = os.urandom(16).hex()
+        conn.sock.settimeout(CLUSTER_AUTH_TIMEOUT)
+        conn.send(encode_frame(FRAME_CHALLENGE, {'nonce': nonce}))
+        frame = read_frame(stream)
+        if frame is None or frame[0] != FRAME_HELLO:
+            return None
+        hello = frame[1]
+        expected = hello_mac(self.secret, nonce, str(hello.get('agent_id')))
+        if not hmac.compare_digest(expected, str(hello.get('mac', ''))):
+            return None
+        conn.sock.settimeout(None)
+        return hello
+
+    def _serve_connection(self, sock):
+        from aegis_log import observe_lines, record_local_verdicts
+
+        conn = _Connection(sock)
+        stream = sock.makefile('rb')
+        try:
+            hello = self._handshake(conn, stream)
+        except (OSError, ValueError, zlib.error) as e:
+            hello = None
+            logger.warning(f"agent 握手失败: {e}")
+        if hello is None:
+            logger.warning("拒绝未通过认证的 agent 连接")
+            return
+        conn.agent_id = hello.get('agent_id')
+        logger.info(f"agent 已连接: {conn.agent_id} ({hello.get('hostname')})")
+
+        with self._conn_lock:
+            self._connections.add(conn)
+        try:
+            # 认证通过后先同步完整黑名单
+            with self._write_lock:
+                snapshot = [{'ip': ip, 'attack_type': t} for ip, t in self.blocked.items()]
+            conn.send(encode_frame(FRAME_SYNC, {'ips': snapshot}))
+
+            while not self._stop.is_set():
+                frame = read_frame(stream)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == FRAME_BATCH:
+                    lines = payload.get('lines', [])
+                    report = observe_lines(lines)
+                    if report is not None and report.verdicts:
+                        # 容量型攻击在本地判定，立即下发
+                        with self._write_lock:
+                            attack_ips = set(record_local_verdicts(report))
+                            self._block([v for v in report.verdicts if v['ip'] in attack_ips])
+                    if report is not None:
+                        # 未开启本地封禁时，容量型攻击候选先于其它批次交给 AI 确认
+                        urgent = report.urgent_lines
+                        for i in range(0, len(urgent), self.batch_size):
+                            self._scheduler.submit(urgent[i:i + self.batch_size], score=URGENT_SCORE)
+                    if ANOMALY_GATE_AI:
+                        lines = report.forward_lines if report is not None else []
+                    # 按 BATCH_SIZE 重新切分后交给调度器
+                    for i in range(0, len(lines), self.batch_size):
+                        self._scheduler.submit(lines[i:i + self.batch_size])
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"agent 连接异常 {conn.agent_id}: {e}")
+        finally:
+            with self._conn_lock:
+                self._connections.discard(conn)
+            logger.info(f"agent 已断开: {conn.agent_id}")
+
+    def _analysis_loop(self):
+        from aegis_log import request_ai_verdicts
+        from fallback import get_reanalysis_queue
+
+        while not self._stop.is_set():
+            # AI 恢复后, 降级期间本地分类过的批次重新交给 AI 复核
+            get_reanalysis_queue().drain_to(self._scheduler, get_ai_breaker())
+            lines = self._scheduler.get(timeout=0.5)
+            if lines is None:
+                continue
+            request_ai_verdicts(lines, partial(self._on_verdict, lines))
+
+    def _on_verdict(self, lines, verdict):
+        """每个攻击对象解析完成即写库、封禁并广播 (串行执行)"""
+        from aegis_log import record_attacks, verdict_ip
+
+        ip = verdict_ip(verdict)
+        if ip is None:
+            return
+        with self._write_lock:
+            if ip in self.blocked:
+                # 已封禁 IP 的重复判定不再写库
+                return
+            result = record_attacks(lines, [verdict])
+            if result['attack_ips']:
+                self._block([verdict])
+
+    def _block(self, attacks):
+        """封禁尚未封禁的 IP 并广播 (调用方持有 _write_lock)"""
+        new_blocks = []
+        for attack in attacks:
+            ip = attack['ip']
+            if ip not in self.blocked:
+                self.blocked[ip] = attack.get('attack_type', 'Unknown')
+                new_blocks.append({'ip': ip, 'attack_type': self.blocked[ip]})
+                if self.fw is not None:
+                    self.fw.add_ip(ip)
+        if new_blocks:
+            self.broadcast(new_blocks)
+
+    def broadcast(self, blocks):
+        """把封禁决定下发给所有 agent"""
+        frame = encode_frame(FRAME_BLOCK, {'ips': blocks})
+        with self._conn_lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.send(frame)
+            except OSError as e:
+                logger.warning(f"下发封禁到 {conn.agent_id} 失败: {e}")
+
+    def load_blocked(self):
+        """从数据库和本机防火墙恢复黑名单, collector 重启后 agent 重连时仍能同步到完整黑名单"""
+        from models import get_db_manager
+
+        blocked = get_db_manager().get_active_blocked_ips()
+        if self.fw is not None:
+            for ip in self.fw.get_blacklist():
+                blocked.setdefault(ip, 'Unknown')
+        with self._write_lock:
+            for ip, attack_type in blocked.items():
+                self.blocked.setdefault(ip, attack_type)
+        return len(blocked)
+
+    def start(self):
+        logger.info(f"collector 已恢复 {self.load_blocked()} 个封禁 IP")
+        self._server = self._make_server()
+        self._threads.append(threading.Thread(target=self._server.serve_forever,
+                                              name='collector-server', daemon=True))
+        for i in range(self.ai_concurrency):
+            self._threads.append(threading.Thread(target=self._analysis_loop,
+                                                  name=f'collector-ai-{i}', daemon=True))
+        for t in self._threads:
+            t.start()
+        logger.info(f"collector 已启动: {self.address}")
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        with self._conn_lock:
+            for conn in self._connections:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+
+# ================= agent =================
+class Agent:
+    """日志采集节点: 只做读取、预过滤、压缩分批上报和执行封禁"""
+
+    def __init__(self, address, file_paths, fw, agent_id=None, tail_mode=True,
+                 batch_lines=AGENT_BATCH_LINES, flush_interval=AGENT_FLUSH_INTERVAL,
+                 buffer_batches=AGENT_BUFFER_BATCHES, secret=CLUSTER_SECRET):
+        _require_secret(address, secret)
+        self.address = address
+        self.secret = secret
+        self.file_paths = list(file_paths)
+        self.fw = fw
+        self.agent_id = agent_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.tail_mode = tail_mode
+        self.batch_lines = batch_lines
+        self.flush_interval = flush_interval
+        self.blocked = set()
+        self.lines_sent = 0
+        self.reader_done = threading.Event()
+        self._lines = queue.Queue(batch_lines * 10)
+        # 与 collector 断开期间缓存的批次，超出上限丢弃最旧的
+        self._pending = deque(maxlen=buffer_batches)
+        self._pending_sizes = deque()
+        self._block_lock = threading.Lock()
+        self._stop = threading.Event()
+        # 当前连接: 发送线程建立, 发送失败或接收线程发现 collector 断开时清空
+        self._sock = None
+        self._sock_lock = threading.Lock()
+        self._threads = []
+
+    def _reader_loop(self):
+        from aegis_log import stream_log_files
+
+        parser = LogParser()
+        try:
+            for line in stream_log_files(self.file_paths, tail_mode=self.tail_mode):
+                if self._stop.is_set():
+                    break
+                # 预过滤: 空行、无源 IP 的行以及已封禁 IP 的行不上报
+                record = parser.parse(line)
+                if record is None:
+                    LINES_FILTERED.labels('empty').inc()
+                    continue
+                if record.ip is None:
+                    LINES_FILTERED.labels('no_ip').inc()
+                    continue
+                if record.ip in self.blocked:
+                    LINES_FILTERED.labels('blocked').inc()
+                    continue
+                self._lines.put(line)
+        finally:
+            self.reader_done.set()
+
+    def _apply_blocks(self, blocks):
+        with self._block_lock:
+            for item in blocks:
+                ip = item.get('ip')
+                if ip and ip not in self.blocked:
+                    self.fw.add_ip(ip)
+                    self.blocked.add(ip)
+
+    def _receiver_loop(self, sock, stream):
+        try:
+            while not self._stop.is_set():
+                frame = read_frame(stream)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind in (FRAME_BLOCK, FRAME_SYNC):
+                    self._apply_blocks(payload.get('ips', []))
+        except (OSError, ValueError, zlib.error):
+            pass
+        # collector 关闭了连接: 清空连接，空闲的 agent 也会由发送线程重连，继续接收封禁广播
+        self._disconnect(sock)
+
+    def _disconnect(self, sock):
+        """关闭连接; 仍是当前连接时清空 self._sock，下一轮由发送线程重连"""
+        with self._sock_lock:
+            if self._sock is sock:
+                self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _connect(self):
+        """连接并完成握手，设为当前连接后启动接收线程"""
+        family, sockaddr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(CLUSTER_AUTH_TIMEOUT)
+        try:
+            sock.connect(sockaddr)
+            if family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            stream = sock.makefile('rb')
+            frame = read_frame(stream)
+            if frame is None or frame[0] != FRAME_CHALLENGE:
+                raise OSError("collector 握手失败")
+            mac = hello_mac(self.secret, frame[1].get('nonce', ''), self.agent_id)
+            sock.sendall(encode_frame(FRAME_HELLO, {'agent_id': self.agent_id, 'hostname': socket.gethostname(),
+                                                    'mac': mac}))
+            sock.settimeout(None)
+        except (OSError, ValueError, zlib.error) as e:
+            sock.close()
+            raise OSError(f"连接 collector 失败: {e}") from e
+        with self._sock_lock:
+            self._sock = sock
+        # 同一个缓冲流继续读取, 握手时可能已预读了后续的帧
+        threading.Thread(target=self._receiver_loop, args=(sock, stream), name='agent-receiver',
+                         daemon=True).start()
+        return sock
+
+    def _flush(self):
+        """发送缓存的批次，失败时保留并断开重连"""
+        while self._pending:
+            sock = self._sock
+            if sock is None:
+                try:
+                    sock = self._connect()
+                    logger.info(f"agent {self.agent_id} 已连接 collector {self.address}")
+                except OSError as e:
+                    logger.warning(f"连接 collector 失败: {e}")
+                    return False
+            try:
+                sock.sendall(self._pending[0])
+            except OSError as e:
+                logger.warning(f"发送批次失败，稍后重试: {e}")
+                self._disconnect(sock)
+                return False
+            self.lines_sent += self._pending_sizes.popleft()
+            self._pending.popleft()
+        return True
+
+    def _sender_loop(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        backoff = 0.5
+        while not self._stop.is_set():
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._lines.get(timeout=timeout))
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if len(batch) >= self.batch_lines or (batch and now >= deadline):
+                if len(self._pending) == self._pending.maxlen:
+                    self._pending_sizes.popleft()
+                self._pending.append(encode_frame(FRAME_BATCH, {'lines': batch}))
+                self._pending_sizes.append(len(batch))
+                batch = []
+            if now >= deadline:
+                deadline = now + self.flush_interval
+                if self._pending and not self._flush():
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                else:
+                    backoff = 0.5
+                if self._sock is None and not self._pending:
+                    # 没有数据时也保持连接，以便接收封禁广播
+                    try:
+                        self._connect()
+                        logger.info(f"agent {self.agent_id} 已连接 collector {self.address}")
+                    except OSError:
+                        pass
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._reader_loop, name='agent-reader', daemon=True),
+            threading.Thread(target=self._sender_loop, name='agent-sender', daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info(f"agent {self.agent_id} 已启动, 跟踪 {len(self.file_paths)} 个文件")
+
+    def stop(self):
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._disconnect(sock)
+        for t in self._threads:
+            t.join(timeout=5)
+
+
+def main():
+    from aegis_log import FirewallAI, analyze_file_paths, start_ip_stats_publisher
+
+    parser = argparse.ArgumentParser(description='AegisLog agent/collector')
+    sub = parser.add_subparsers(dest='role', required=True)
+
+    p_collector = sub.add_parser('collector', help='中心分析节点')
+    p_collector.add_argument('--listen', default=CLUSTER_ADDRESS, help='监听地址 tcp://host:port 或 unix:///path')
+    p_collector.add_argument('--firewall', action='store_true', help='collector 所在主机也执行封禁')
+    p_collector.add_argument('--dry-run-firewall', action='store_true', help='只模拟 iptables 命令')
+
+    p_agent = sub.add_parser('agent', help='日志采集节点')
+    p_agent.add_argument('--connect', default=CLUSTER_ADDRESS, help='collector 地址')
+    p_agent.add_argument('--files', help='日志文件(逗号分隔)，默认使用 ANALYZE_FILES')
+    p_agent.add_argument('--agent-id', help='agent 标识，默认 主机名-随机后缀')
+    p_agent.add_argument('--dry-run-firewall', action='store_true', help='只模拟 iptables 命令')
+    args = parser.parse_args()
+
+    if args.role == 'collector':
+        fw = FirewallAI(dry_run=args.dry_run_firewall) if (args.firewall or args.dry_run_firewall) else None
+        node = Collector(args.listen, fw=fw)
+        start_ip_stats_publisher()
+    else:
+        files = [f.strip() for f in args.files.split(',')] if args.files else analyze_file_paths()
+        node = Agent(args.connect, files, FirewallAI(dry_run=args.dry_run_firewall), agent_id=args.agent_id)
+
+    node.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        node.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,9 @@ ANALYZE_FILES = "test_log1.log,test_log2.log"  # 需要分析的日志文件(逗
 LOG_RETENTION_DAYS = 7                     # 日志保留天数
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"  # 日志格式
 LOG_CONSOLE = True                         # 是否输出到终端
+LOG_JSON = False                           # 是否输出结构化 JSON 日志(每行一个 JSON 对象)
+LOG_QUEUE_SIZE = 10000                     # 异步日志队列长度，队列满时丢弃新日志而不阻塞
+LOG_DEDUP_INTERVAL = 10                    # 相同日志在该秒数内只输出一次(0 表示不限流)
 CHECK_INTERVAL = 60                        # 每隔多少秒检测日志
 BLACKLIST_MAX = 100                        # 最大黑名单条数
 BATCH_SIZE = 2                             # 每次发送给 AI 的日志行数
@@ -12,11 +15,93 @@ BATCH_SIZE = 2                             # 每次发送给 AI 的日志行数
 # 日志文件读取优化配置
 USE_TAIL_COMMAND = True                    # 是否使用tail命令优化大文件读取
 
+# 多进程分片采集配置
+INGEST_WORKERS = 0                         # 采集 worker 进程数 (0 表示单进程按 CHECK_INTERVAL 抽样尾部)
+SHARD_MODE = "file"                        # 分片方式: file 按文件 / ip 按源 IP 哈希
+SHARD_QUEUE_SIZE = 1000                    # worker 到协调者的批次队列长度 (满时 worker 阻塞)
+AI_CONCURRENCY = 4                         # 协调者并发的 AI 请求数
+
+# 多主机 agent/collector 配置
+CLUSTER_ADDRESS = "tcp://127.0.0.1:7410"   # collector 地址 (tcp://host:port 或 unix:///path)
+CLUSTER_COMPRESS_LEVEL = 6                 # 帧压缩级别 (zlib 0-9)
+CLUSTER_SECRET = ""                        # agent 与 collector 共享的密钥 (握手时 HMAC 认证)；为空时只能使用 unix:// 或本机地址
+CLUSTER_AUTH_TIMEOUT = 5.0                 # 握手的超时(秒)
+AGENT_BATCH_LINES = 200                    # agent 每批上报的最大行数
+AGENT_FLUSH_INTERVAL = 1.0                 # agent 未凑满一批时的最长等待(秒)
+AGENT_BUFFER_BATCHES = 1000                # 与 collector 断开期间最多缓存的批次数
+
+# 按 IP 滑动窗口统计配置 (固定内存的 sketch)
+IP_STATS_WINDOW = 60                       # 统计窗口(秒)
+IP_STATS_BUCKETS = 6                       # 窗口划分的子窗口数，过期按子窗口整体清零
+IP_STATS_CMS_WIDTH = 2048                  # Count-Min Sketch 宽度
+IP_STATS_CMS_DEPTH = 4                     # Count-Min Sketch 深度
+IP_STATS_TOP_K = 200                       # 每个子窗口跟踪的热点 IP 数
+IP_STATS_HLL_PRECISION = 12                # 独立 IP 数 HyperLogLog 精度 (2^p 个寄存器)
+IP_STATS_SNAPSHOT_FILE = "ip_stats_snapshot.json"  # 统计快照文件，供 Dashboard 读取
+IP_STATS_PUBLISH_INTERVAL = 5              # 快照发布间隔(秒)
+
+# 速率异常检测配置 (anomaly.py)
+ANOMALY_WINDOW = 5                         # 评分窗口(秒)
+ANOMALY_ALPHA = 0.1                        # EWMA 平滑系数
+ANOMALY_Z_THRESHOLD = 6.0                  # z 分数阈值
+ANOMALY_MIN_COUNT = 20                     # 窗口内请求数低于该值的实体不标记
+ANOMALY_WARMUP_WINDOWS = 3                 # 建立基线所需的窗口数，期间不标记
+ANOMALY_IP_SLOTS = 65536                   # 源 IP 维度的哈希槽位数
+ANOMALY_PATH_SLOTS = 16384                 # 路径维度的哈希槽位数
+ANOMALY_FLOOD_MIN = 200                    # 单个 IP 窗口内请求数达到该值才在本地判定为容量型攻击
+ANOMALY_LINES_PER_ENTITY = 20              # 每个异常实体附带的日志行数
+ANOMALY_MAX_FORWARD_LINES = 200            # 每个窗口转交 AI 的最大行数
+ANOMALY_GATE_AI = False                    # True: 只把异常实体的日志行交给 AI (大幅减少 AI 调用)
+ANOMALY_LOCAL_BLOCK = False                # True: 容量型攻击在本地直接判定并封禁; False: 候选 IP 的日志行以最高优先级交给 AI 确认
+ANOMALY_ALLOWLIST = []                     # 不做容量型判定的地址/网段 (负载均衡、健康检查、NAT 出口等)，如 ["10.0.0.0/8"]
+
+# 历史日志回放配置 (replay.py)
+REPLAY_CHECKPOINT_FILE = "replay_checkpoint.json"  # 回放检查点文件
+REPLAY_CHECKPOINT_INTERVAL = 5             # 检查点保存间隔(秒)
+REPLAY_PROGRESS_INTERVAL = 2               # 进度输出间隔(秒)
+
+# 分析进程状态检查点 (checkpoint.py，重启后恢复读取位置、判定缓存、IP 统计和待分析队列)
+CHECKPOINT_FILE = "analyzer_checkpoint.bin"  # 检查点文件 (空字符串表示不保存)
+CHECKPOINT_INTERVAL = 30                   # 保存间隔(秒)
+VERDICT_CACHE_SIZE = 10000                 # 记住判定结果的最近批次数，相同批次不再发给 AI (0 表示不缓存)
+
+# AI 批次调度配置 (scheduler.py，按可疑度优先发送)
+SCHEDULER_MAX_PENDING = 1000               # 等待 AI 分析的最大批次数，超出时丢弃分数最低的批次
+SCHEDULER_MAX_AGE = 300                    # 低优先级批次最长排队时间(秒)，超时丢弃 (0 表示不丢弃)
+SCHEDULER_SHED_SCORE = 2.0                 # 分数低于该值的批次视为低优先级
+SCHEDULER_SEEN_IPS = 100000                # 评分时记住的最近源 IP 数 (用于识别新 IP)
+
 # AI 接口配置
 AI_API_URL = "https://api.deepseek.com/v1"           # AI 判定接口
 AI_API_KEY = ""   # AI 接口 key
+AI_STREAM = True                           # 流式接收 AI 响应，每个攻击对象解析完成即写库封禁
+AI_RATE_PER_MINUTE = 0                     # 每分钟最多发起的 AI 请求数 (0 表示不限制)
+AI_TOKEN_BUDGET_PER_MINUTE = 0             # 每分钟 AI token 预算，按估算值扣减 (0 表示不限制)
+AI_TIMEOUT = 20                            # 单次 AI 请求超时(秒)
+AI_MAX_RETRIES = 1                         # SDK 内部重试次数 (失败由熔断器统计)
+AI_MODEL = "deepseek-chat"                 # 完整分类模型
+AI_MAX_TOKENS = 2000                       # 完整分类的最大输出 token
+AI_TRIAGE_MODEL = ""                       # 初筛模型，留空不初筛；可与 AI_MODEL 相同 (只换短输出提示词)
+AI_TRIAGE_MAX_TOKENS = 100                 # 初筛的最大输出 token
 CHAIN_NAME = "BLACKLIST"                   # iptables 黑名单链名
 
+# AI 熔断与降级配置 (circuit_breaker.py / fallback.py)
+AI_BREAKER_WINDOW = 60                     # 统计失败率的时间窗口(秒)
+AI_BREAKER_MIN_CALLS = 5                   # 窗口内调用数不少于该值才可能熔断
+AI_BREAKER_FAILURE_RATE = 0.5              # 窗口内失败率达到该值时熔断
+AI_BREAKER_COOLDOWN = 30                   # 熔断后多少秒进入半开状态，放行探测请求
+AI_BREAKER_HALF_OPEN_PROBES = 1            # 半开状态同时放行的探测请求数
+FALLBACK_BRUTE_FORCE_MIN = 5               # 降级模式下判定登录爆破所需的窗口内失败次数
+REANALYSIS_QUEUE_SIZE = 1000               # 降级期间等待 AI 复核的最大批次数，超出时丢弃最早的
+REANALYSIS_MAX_ATTEMPTS = 3                # 同一批次最多进入复核队列的次数，之后只保留本地判定
+
+# 本地 ML 分类器配置 (ml_classifier.py)
+ML_MODEL_FILE = "ml_model.npz"             # 模型文件，不存在时不启用 (python3 ml_classifier.py train 生成)
+ML_CONFIDENCE = 0.99                       # 置信度不低于该值的行在本地判定，其余交给 AI
+ML_HASH_DIM = 262144                       # 字符 n-gram 的哈希空间大小
+ML_NGRAM_MIN = 3                           # 字符 n-gram 最小长度
+ML_NGRAM_MAX = 5                           # 字符 n-gram 最大长度
+
 # 攻击类型映射表 (数据库存储的英文类型 -> 界面显示的中文类型)
 ATTACK_TYPE_MAPPING = {
     "DDoS": "DDoS",
@@ -51,7 +136,33 @@ AI_PROMPT_COMMON = (
 AI_PROMPT_CUSTOM = """ """
 
 AI_PROMPT_TEMPLATE = AI_PROMPT_COMMON + "\n" + AI_PROMPT_CUSTOM + "\n请分析日志内容并返回JSON格式的攻击信息。"
-print(AI_PROMPT_TEMPLATE)
+
+# 初筛提示词: 只回答是否存在攻击和可疑 IP，不分类型，输出很短
+AI_TRIAGE_PROMPT = (
+    "请快速判断以下日志中是否存在网络攻击行为 (" + ", ".join(ATTACK_TYPES_EN) + ")，不需要给出攻击类型。\n"
+    "只返回 JSON: {\"attack\": \"yes\" | \"no\" | \"unsure\", \"ips\": [\"可疑ip\", ...]}"
+)
 
 # 数据库配置
 DB_PATH = "aegis_log.db"  # SQLite数据库文件路径
+
+# 指标导出配置 (Prometheus 文本格式，aegis_log.py 独立端口 /metrics)
+METRICS_HOST = "127.0.0.1"                 # 指标服务监听地址 (默认只监听本机，需要远程抓取时改为内网地址)
+METRICS_PORT = 9108                        # 指标服务端口 (0 表示不启动)
+
+# 资源采样配置 (resource_sampler.py，写入 system_status 表)
+RESOURCE_SAMPLE_INTERVAL = 10              # 采样间隔(秒) (0 表示不采样)
+RESOURCE_RAW_RETENTION = 3600              # 原始样本保留时间(秒)，更早的合并为每分钟一条
+RESOURCE_MINUTE_RETENTION = 86400          # 每分钟样本保留时间(秒)，更早的合并为每小时一条
+RESOURCE_HOUR_RETENTION = 30 * 86400       # 每小时样本保留时间(秒)，更早的删除
+
+# GeoIP/ASN 离线查询配置 (geoip.py，封禁 IP 时记录国家和 ASN)
+GEOIP_DB_FILE = "geoip.dat"                # 库文件 (python3 geoip.py build 生成，不存在时不做查询)
+GEOIP_CACHE_SIZE = 65536                   # 每个 IP 查询结果的 LRU 缓存条数
+
+# 流式导出配置 (exporter.py / /api/export)
+EXPORT_CHUNK_SIZE = 1000                   # 每次查询读取的行数 (内存占用只与它有关)
+
+# Web Dashboard 生产部署配置 (gunicorn 多 worker 共享同一份缓存快照)
+DASHBOARD_SNAPSHOT_FILE = "dashboard_snapshot.json"  # 缓存快照文件
+DASHBOARD_LOCK_FILE = "dashboard_refresh.lock"       # 刷新锁文件，保证跨进程只有一个刷新线程
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+检测效果评估 - 在带标注的日志语料上比较不同配置的准确率和成本
+把语料逐批送入完整流水线 (process_batch + 临时 SQLite + dry-run 防火墙)，按 (IP, 攻击类型) 计算
+每种攻击类型的精确率/召回率，同时统计 AI 调用次数、token、耗时和吞吐，
+在 BATCH_SIZE / 提示词 / 模型 / 初筛模型的组合上逐一运行，用数据而不是猜测选择配置
+
+AI 可以是本地桩服务 (默认，规则判定，不受提示词和模型影响)、真实 API (--live，可用 --record 录制响应)
+或录制的响应 (--replay，离线重放真实模型的回答)
+
+语料为 JSONL，每行 {"line": 原始日志, "ip": 来源IP, "label": ATTACK_TYPES_EN 中的类型或 null (正常流量)}
+
+用法:
+    python3 evaluate.py corpus corpus.jsonl --lines 20000 --attack-ratio 0.05    # 由合成日志生成标注语料
+    python3 evaluate.py run corpus.jsonl --batch-size 2,10,50
+    python3 evaluate.py run corpus.jsonl --live --record responses.jsonl --prompt strict=strict.txt
+    python3 evaluate.py run corpus.jsonl --replay responses.jsonl --prompt strict=strict.txt --json eval.json
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import aegis_log
+import model_router
+from anomaly import AnomalyDetector, get_anomaly_detector, set_anomaly_detector
+from circuit_breaker import CircuitBreaker, get_ai_breaker, set_ai_breaker
+from config import AI_MODEL, AI_PROMPT_COMMON, AI_PROMPT_CUSTOM, AI_TRIAGE_MODEL, ATTACK_TYPES_EN, BATCH_SIZE
+from fallback import ReanalysisQueue, get_reanalysis_queue, set_reanalysis_queue
+from ip_stats import IPStats, get_ip_stats, set_ip_stats
+from logger import set_log_level
+from metrics import AI_ERRORS
+from mock_ai_server import MockAIServer
+from model_router import TIER_REQUESTS, TIER_TOKENS
+from models import temporary_db_manager
+from verdict_cache import VerdictCache, get_verdict_cache, set_verdict_cache
+
+DEFAULT_PROMPT = 'default'
+
+
+# ================= 标注语料 =================
+def write_corpus(path, num_lines, **kwargs):
+    """由合成日志生成标注语料 (参数同 synthetic_logs.generate_lines), 返回写入的行数"""
+    from synthetic_logs import generate_lines
+
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for line, ip, attack_type in generate_lines(num_lines, **kwargs):
+            f.write(json.dumps({'line': line, 'ip': ip, 'label': attack_type}, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def load_corpus(path):
+    """读取标注语料
+    Returns:
+        list[tuple]: [(日志行, IP, 攻击类型或 None)]
+    Raises:
+        ValueError: 格式错误或标签不在 ATTACK_TYPES_EN 中
+    """
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for number, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                item = json.loads(text)
+                line, ip, label = item['line'], item.get('ip'), item.get('label')
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}:{number} 格式错误: {e}")
+            if label is not None and label not in ATTACK_TYPES_EN:
+                raise ValueError(f"{path}:{number} 未知的攻击类型: {label}")
+            if label is not None and not ip:
+                raise ValueError(f"{path}:{number} 攻击行缺少 ip")
+            corpus.append((line, ip, label))
+    return corpus
+
+
+def score(truth, predicted):
+    """按 (IP, 攻击类型) 对计算每种类型的精确率/召回率
+    Args:
+        truth: {(ip, 类型)} 真值
+        predicted: {(ip, 类型)} 流水线的判定
+    Returns:
+        dict: {"per_type": {类型: {...}}, "overall": {...}, "detection": {...}}
+              overall 对全部 (IP, 类型) 对计算; detection 只看 IP 是否被判为攻击, 不看类型
+    """
+    def metrics(tp, fp, fn):
+        precision = tp / (tp + fp) if tp + fp else 1.0
+        recall = tp / (tp + fn) if tp + fn else 1.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {'tp': tp, 'fp': fp, 'fn': fn, 'precision': round(precision, 4),
+                'recall': round(recall, 4), 'f1': round(f1, 4)}
+
+    per_type = {}
+    for attack_type in sorted({t for _, t in truth | predicted}):
+        expected = {pair for pair in truth if pair[1] == attack_type}
+        got = {pair for pair in predicted if pair[1] == attack_type}
+        per_type[attack_type] = metrics(len(expected & got), len(got - expected), len(expected - got))
+    truth_ips = {ip for ip, _ in truth}
+    predicted_ips = {ip for ip, _ in predicted}
+    return {
+        'per_type': per_type,
+        'overall': metrics(len(truth & predicted), len(predicted - truth), len(truth - predicted)),
+        'detection': metrics(len(truth_ips & predicted_ips), len(predicted_ips - truth_ips),
+                             len(truth_ips - predicted_ips)),
+    }
+
+
+# ================= 录制与重放 =================
+def recording_key(request):
+    """录制响应的键: 模型和完整消息 (提示词或批次不同即为不同请求)"""
+    payload = json.dumps({'model': request.get('model'), 'messages': request.get('messages')},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def load_recordings(path):
+    """读取录制文件, 返回 {键: 记录}; 同一请求录制多次时以最后一次为准"""
+    recordings = {}
+    with open(path, encoding='utf-8') as f:
+        for text in f:
+            if text.strip():
+                record = json.loads(text)
+                recordings[record['key']] = record
+    return recordings
+
+
+class ResponseRecorder:
+    """包装 OpenAI 客户端, 把每次 chat.completions 请求的响应追加到录制文件 (只支持非流式请求)"""
+
+    def __init__(self, client, path):
+        self.chat = SimpleNamespace(completions=self)
+        self._client = client
+        self.path = path
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        if kwargs.get('stream'):
+            raise ValueError("录制响应时需要关闭流式响应 (AI_STREAM)")
+        started = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        usage = getattr(response, 'usage', None)
+        record = {
+            'key': recording_key(kwargs),
+            'model': kwargs.get('model'),
+            'content': response.choices[0].message.content,
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+            'latency': round(time.perf_counter() - started, 4),
+        }
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return response
+
+
+class ReplayAIServer(MockAIServer):
+    """按录制文件回答请求的桩服务, 流式和非流式请求都可以重放
+    没有录制的请求返回 404 (流水线按 AI 调用失败降级处理), 计入 misses
+    """
+
+    def __init__(self, recordings, latency_scale=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.recordings = recordings
+        self.latency_scale = latency_scale   # 按录制时的耗时等待的比例，0 表示立即返回
+        self.misses = 0
+
+    def complete(self, body):
+        record = self.recordings.get(recording_key(body))
+        with self._lock:
+            self.requests += 1
+            model = body.get('model', 'mock')
+            self.requests_by_model[model] = self.requests_by_model.get(model, 0) + 1
+            if record is None:
+                self.misses += 1
+        if record is None:
+            return 404, {'error': {'message': 'no recorded response', 'type': 'invalid_request_error'}}
+        if self.latency_scale:
+            time.sleep(record.get('latency', 0.0) * self.latency_scale)
+        return 200, self.response_payload(body, record['content'], record['prompt_tokens'],
+                                          record['completion_tokens'])
+
+
+# ================= 评估 =================
+def build_prompt(custom):
+    """按 AI_PROMPT_CUSTOM 生成完整提示词 (与 config.AI_PROMPT_TEMPLATE 的拼接方式相同)"""
+    return AI_PROMPT_COMMON + "\n" + custom + "\n请分析日志内容并返回JSON格式的攻击信息。"
+
+
+@contextmanager
+def _overrides(model, triage_model, prompt, stream):
+    """临时替换流水线读取的配置, 退出时恢复"""
+    saved = (aegis_log.AI_MODEL, aegis_log.AI_PROMPT_TEMPLATE, aegis_log.AI_STREAM, model_router.AI_TRIAGE_MODEL)
+    aegis_log.AI_MODEL, aegis_log.AI_PROMPT_TEMPLATE = model, prompt
+    aegis_log.AI_STREAM, model_router.AI_TRIAGE_MODEL = stream, triage_model
+    try:
+        yield
+    finally:
+        aegis_log.AI_MODEL, aegis_log.AI_PROMPT_TEMPLATE, aegis_log.AI_STREAM, model_router.AI_TRIAGE_MODEL = saved
+
+
+@contextmanager
+def _fresh_state():
+    """每个配置使用全新的临时数据库、判定缓存、统计和熔断器, 互不影响; 退出时恢复原有实例"""
+    singletons = [
+        (get_verdict_cache, set_verdict_cache, VerdictCache),
+        (get_ip_stats, set_ip_stats, IPStats),
+        (get_anomaly_detector, set_anomaly_detector, AnomalyDetector),
+        (get_ai_breaker, set_ai_breaker, CircuitBreaker),
+        (get_reanalysis_queue, set_reanalysis_queue, ReanalysisQueue),
+    ]
+    saved = [get() for get, _, _ in singletons]
+    for _, set_, create in singletons:
+        set_(create())
+    try:
+        with temporary_db_manager() as db:
+            yield db
+    finally:
+        for (_, set_, _), previous in zip(singletons, saved):
+            set_(previous)
+
+
+def _cost_snapshot():
+    calls = defaultdict(float)
+    for (tier, _), child in TIER_REQUESTS.children().items():
+        calls[tier] += child.value
+    tokens = {f'{tier}_{kind}': child.value for (tier, kind), child in TIER_TOKENS.children().items()}
+    return calls, tokens, AI_ERRORS.value
+
+
+def run_config(corpus, batch_size=BATCH_SIZE, prompt=None, model=AI_MODEL, triage_model=AI_TRIAGE_MODEL,
+               stream=None):
+    """用一组配置跑完整个语料
+    Args:
+        corpus: load_corpus 的结果
+        prompt: 完整的 AI 提示词, 默认 config.AI_PROMPT_TEMPLATE
+        stream: 是否流式接收响应, 默认 config.AI_STREAM
+    Returns:
+        dict: score 的结果加上 lines / api_calls / tokens / ai_errors / elapsed_s / lines_per_sec
+    """
+    truth = {(ip, label) for _, ip, label in corpus if label is not None}
+    lines = [line for line, _, _ in corpus]
+    prompt = aegis_log.AI_PROMPT_TEMPLATE if prompt is None else prompt
+    stream = aegis_log.AI_STREAM if stream is None else stream
+
+    with _fresh_state() as db, _overrides(model, triage_model, prompt, stream):
+        calls_before, tokens_before, errors_before = _cost_snapshot()
+        fw = aegis_log.FirewallAI(dry_run=True)
+        started = time.perf_counter()
+        for batch in aegis_log.iter_batches(lines, batch_size):
+            aegis_log.process_batch(batch, fw)
+        elapsed = time.perf_counter() - started
+        calls_after, tokens_after, errors_after = _cost_snapshot()
+        predicted = {(row['source_ip'], row['attack_type']) for row in db.export_rows('attacks')}
+
+    result = score(truth, predicted)
+    api_calls = {tier: int(calls_after[tier] - calls_before.get(tier, 0)) for tier in calls_after}
+    tokens = {key: int(value - tokens_before.get(key, 0)) for key, value in tokens_after.items()}
+    result.update(
+        lines=len(lines),
+        api_calls=dict((tier, count) for tier, count in sorted(api_calls.items()) if count),
+        tokens=dict((key, count) for key, count in sorted(tokens.items()) if count),
+        ai_errors=int(errors_after - errors_before),
+        elapsed_s=round(elapsed, 3),
+        lines_per_sec=round(len(lines) / elapsed, 1) if elapsed > 0 else 0.0,
+    )
+    return result
+
+
+def run_grid(corpus, batch_sizes=(BATCH_SIZE,), prompts=None, models=(AI_MODEL,),
+             triage_models=(AI_TRIAGE_MODEL,), stream=None):
+    """在配置组合上逐一运行 run_config
+    Args:
+        prompts: {名称: 完整提示词}, 默认只有 config.AI_PROMPT_TEMPLATE
+    Returns:
+        list[dict]: 每个组合的 {"config": {...}, 以及 run_config 的结果}
+    """
+    prompts = prompts or {DEFAULT_PROMPT: aegis_log.AI_PROMPT_TEMPLATE}
+    results = []
+    for batch_size, (name, prompt), model, triage_model in itertools.product(
+            batch_sizes, prompts.items(), models, triage_models):
+        result = run_config(corpus, batch_size, prompt, model, triage_model, stream)
+        config = {'batch_size': batch_size, 'prompt': name, 'model': model, 'triage_model': triage_model or 'none'}
+        results.append(dict(config=config, **result))
+    return results
+
+
+def format_report(results):
+    """汇总表 (每个配置一行) 加上每个配置按攻击类型的明细"""
+    header = (f"{'batch':>5} {'prompt':<10} {'model':<18} {'triage':<18} {'P':>6} {'R':>6} {'F1':>6} "
+              f"{'calls':>6} {'tokens':>9} {'errors':>6} {'wall_s':>8} {'lines/s':>9}")
+    rows = [header]
+    for r in results:
+        c, overall = r['config'], r['overall']
+        rows.append(f"{c['batch_size']:>5} {c['prompt']:<10} {c['model']:<18} {c['triage_model']:<18} "
+                    f"{overall['precision']:>6.3f} {overall['recall']:>6.3f} {overall['f1']:>6.3f} "
+                    f"{sum(r['api_calls'].values()):>6} {sum(r['tokens'].values()):>9} {r['ai_errors']:>6} "
+                    f"{r['elapsed_s']:>8.2f} {r['lines_per_sec']:>9.1f}")
+    for r in results:
+        c = r['config']
+        rows.append('')
+        rows.append(f"batch={c['batch_size']} prompt={c['prompt']} model={c['model']} triage={c['triage_model']}  "
+                    f"calls={r['api_calls']} tokens={r['tokens']}")
+        for attack_type, m in r['per_type'].items():
+            rows.append(f"  {attack_type:<18} P={m['precision']:.3f} R={m['recall']:.3f} F1={m['f1']:.3f} "
+                        f"(tp={m['tp']} fp={m['fp']} fn={m['fn']})")
+        d = r['detection']
+        rows.append(f"  {'(仅看 IP)':<16} P={d['precision']:.3f} R={d['recall']:.3f} F1={d['f1']:.3f}")
+    return '\n'.join(rows)
+
+
+def _csv(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',')]
+
+
+def _load_prompts(specs):
+    """--prompt 名称=文件, 文件内容作为 AI_PROMPT_CUSTOM; 不指定时使用当前配置"""
+    prompts = {}
+    for spec in specs:
+        name, sep, path = spec.partition('=')
+        if not sep:
+            raise ValueError(f"--prompt 需要 名称=文件: {spec}")
+        with open(path, encoding='utf-8') as f:
+            prompts[name] = build_prompt(f.read())
+    return prompts or {DEFAULT_PROMPT: build_prompt(AI_PROMPT_CUSTOM)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='在标注语料上评估检测准确率与成本')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_corpus = sub.add_parser('corpus', help='由合成日志生成标注语料')
+    p_corpus.add_argument('output', help='输出的 JSONL 文件')
+    p_corpus.add_argument('--lines', type=int, default=10000, help='行数')
+    p_corpus.add_argument('--attack-ratio', type=float, default=0.05, help='攻击流量占比')
+    p_corpus.add_argument('--attackers', type=int, default=20, help='攻击者 IP 数')
+    p_corpus.add_argument('--formats', default='nginx', help='日志格式(逗号分隔): nginx,sshd')
+    p_corpus.add_argument('--seed', type=int, default=0, help='随机种子')
+
+    p_run = sub.add_parser('run', help='在配置组合上运行评估')
+    p_run.add_argument('corpus', help='标注语料 (JSONL)')
+    p_run.add_argument('--batch-size', default=str(BATCH_SIZE), help='每批行数, 逗号分隔可测试多个值')
+    p_run.add_argument('--prompt', action='append', default=[], metavar='名称=文件',
+                       help='文件内容作为 AI_PROMPT_CUSTOM (可重复)')
+    p_run.add_argument('--model', default=AI_MODEL, help='完整分类模型, 逗号分隔可测试多个')
+    p_run.add_argument('--triage-model', default=AI_TRIAGE_MODEL,
+                       help='初筛模型, 逗号分隔可测试多个 (none 表示不初筛)')
+    source = p_run.add_mutually_exclusive_group()
+    source.add_argument('--live', action='store_true', help='调用 config 中配置的真实 API')
+    source.add_argument('--replay', metavar='FILE', help='重放录制的响应')
+    p_run.add_argument('--record', metavar='FILE', help='配合 --live 把响应追加到录制文件 (使用非流式请求)')
+    p_run.add_argument('--latency-scale', type=float, default=1.0,
+                       help='重放时按录制耗时等待的比例 (0 表示立即返回)')
+    p_run.add_argument('--ai-latency', type=float, default=0.0, help='本地桩服务的响应延迟(秒)')
+    p_run.add_argument('--log-level', default='WARNING', help='评估期间 AegisLogger 的日志级别')
+    p_run.add_argument('--json', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    if args.command == 'corpus':
+        count = write_corpus(args.output, args.lines, attack_ratio=args.attack_ratio, attackers=args.attackers,
+                             formats=tuple(args.formats.split(',')), seed=args.seed)
+        print(f"已生成 {count} 行标注语料: {args.output}")
+        return 0
+
+    if args.record and not args.live:
+        parser.error("--record 需要与 --live 一起使用")
+    set_log_level(args.log_level)
+    try:
+        corpus = load_corpus(args.corpus)
+        prompts = _load_prompts(args.prompt)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    triage_models = ['' if m == 'none' else m for m in _csv(args.triage_model or 'none')]
+
+    from openai import OpenAI
+
+    server = None
+    stream = None
+    if args.live:
+        client = aegis_log.get_ai_client()
+        if args.record:
+            client, stream = ResponseRecorder(client, args.record), False
+    else:
+        if args.replay:
+            server = ReplayAIServer(load_recordings(args.replay), latency_scale=args.latency_scale)
+        else:
+            server = MockAIServer(latency=args.ai_latency)
+        client = OpenAI(api_key='evaluate', base_url=server.start(), max_retries=0)
+    aegis_log.set_ai_client(client)
+    try:
+        results = run_grid(corpus, _csv(args.batch_size, int), prompts, _csv(args.model), triage_models, stream)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(format_report(results))
+    if isinstance(server, ReplayAIServer) and server.misses:
+        print(f"\n警告: {server.misses} 次请求没有录制的响应 (按 AI 调用失败处理)，结果不可信", file=sys.stderr)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+攻击记录和封禁 IP 的流式导出 (供 SIEM 拉取全部历史)
+按 id 分块读取 (DatabaseManager.export_rows)，逐行编码为 NDJSON 或 CSV，可选边读边 gzip 压缩，
+内存占用只与块大小有关，与导出的总行数无关。每行都带 id，中断后把最后收到的 id 作为 after_id 继续导出
+
+用法:
+    python3 exporter.py attacks --since 2024-01-01 --format csv --gzip -o attacks.csv.gz
+    python3 exporter.py blocked_ips > blocked_ips.ndjson
+    python3 exporter.py attacks --after-id 120000 >> attacks.ndjson     # 从上次中断处继续
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime, timezone
+
+from config import DB_PATH
+
+FORMATS = ('ndjson', 'csv')
+MIME_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# 编码后的文本攒到该大小再输出，避免每行一次写入
+FLUSH_BYTES = 64 * 1024
+
+
+def parse_time(value):
+    """把 unix 时间戳或 ISO 日期/时间转换为库中的时间格式 'YYYY-MM-DD HH:MM:SS'；空值返回 None
+    带时区的时间转换为 UTC (攻击记录和封禁 IP 的时间均由 SQLite 以 UTC 写入)
+    Raises:
+        ValueError: 无法解析
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _normalize(row):
+    if 'attack_types' in row:
+        row['attack_types'] = json.loads(row['attack_types']) if row['attack_types'] else []
+    for column in ('is_blocked', 'is_active'):
+        if column in row:
+            row[column] = bool(row[column])
+    return row
+
+
+def encode_rows(rows, fmt, columns, progress=None):
+    """把行编码为 NDJSON 或 CSV 文本块 (生成器)
+    progress: 可选字典，每个文本块被取走后更新 rows (已输出行数) 和 last_id (可作为 after_id 继续)
+    """
+    buffer = io.StringIO()
+    count, last_id = 0, None
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(columns)
+    for row in rows:
+        row = _normalize(row)
+        if writer is not None:
+            # 列表 (attack_types) 在 CSV 中写成 JSON 数组
+            writer.writerow(json.dumps(row[c], ensure_ascii=False) if isinstance(row[c], list) else row[c]
+                            for c in columns)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count, last_id = count + 1, row['id']
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if progress is not None:
+                progress.update(rows=count, last_id=last_id)
+    if buffer.tell():
+        yield buffer.getvalue()
+    if progress is not None:
+        progress.update(rows=count, last_id=last_id)
+
+
+def gzip_chunks(chunks, level=6):
+    """边读边压缩为 gzip 格式; 每块都同步刷新, 中断时已输出的部分仍可解压"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_stream(db, name, fmt='ndjson', compress=False, progress=None, **query):
+    """导出一张表的字节流 (生成器)
+    Args:
+        db: DatabaseManager
+        name: attacks / blocked_ips
+        progress: 可选字典，导出过程中更新 rows 和 last_id (见 encode_rows)
+        query: 传给 DatabaseManager.export_rows 的 since/until/after_id/filters
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的格式: {fmt}")
+    columns = db.EXPORT_TABLES[name][2]
+    if progress is not None:
+        progress.update(rows=0, last_id=query.get('after_id'))
+    rows = db.export_rows(name, **query)
+    chunks = (text.encode('utf-8') for text in encode_rows(rows, fmt, columns, progress))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def main():
+    from models import DatabaseManager
+
+    parser = argparse.ArgumentParser(description='流式导出攻击记录 / 封禁 IP')
+    parser.add_argument('table', choices=sorted(DatabaseManager.EXPORT_TABLES))
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='gzip 压缩输出')
+    parser.add_argument('--since', help='起始时间 (含)，unix 时间戳或 ISO 格式')
+    parser.add_argument('--until', help='结束时间 (不含)')
+    parser.add_argument('--after-id', type=int, help='只导出 id 大于它的行 (从上次中断处继续)')
+    parser.add_argument('--filter', action='append', default=[], metavar='列=值',
+                        help='按列过滤，例如 attack_type=XSS (可重复)')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite 数据库')
+    parser.add_argument('-o', '--output', help='输出文件 (默认标准输出)')
+    args = parser.parse_args()
+
+    try:
+        filters = dict(item.split('=', 1) for item in args.filter)
+        query = dict(since=parse_time(args.since), until=parse_time(args.until), after_id=args.after_id,
+                     filters=filters)
+    except ValueError as e:
+        parser.error(str(e))
+    progress = {}
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_stream(DatabaseManager(args.db), args.table, args.format, args.gzip,
+                                   progress=progress, **query):
+            out.write(chunk)
+    except KeyboardInterrupt:
+        print(f"导出中断: 已导出 {progress.get('rows', 0)} 行，继续导出: --after-id {progress.get('last_id')}",
+              file=sys.stderr)
+        return 130
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+    print(f"已导出 {progress['rows']} 行 (最后的 id: {progress['last_id']})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI 接口不可用时的降级处理
+熔断期间 (或单次调用失败时) 日志行由本地特征签名分类后立即写库封禁，同时放入复核队列，
+AI 恢复后重新提交给调度器，由 AI 给出最终判定
+"""
+
+import hashlib
+import threading
+from collections import Counter, OrderedDict, deque
+
+from circuit_breaker import STATE_CLOSED
+from config import FALLBACK_BRUTE_FORCE_MIN, REANALYSIS_QUEUE_SIZE, REANALYSIS_MAX_ATTEMPTS
+from ip_stats import get_ip_stats
+from log_parsers import LogParser
+from metrics import REGISTRY, LINES_FILTERED, QUEUE_DEPTH
+from signatures import match_signature
+
+AI_DEGRADED_BATCHES = REGISTRY.counter('aegis_ai_degraded_batches_total', 'AI 不可用时改由本地分类的批次数')
+
+
+ANALYZED_BY_SIGNATURE = 'signature'
+
+
+def brute_force_confirmed(ip):
+    """单条登录失败不足以在本地判定爆破: 要求该 IP 在统计窗口内的失败次数达到 FALLBACK_BRUTE_FORCE_MIN"""
+    return get_ip_stats().failures(ip) >= FALLBACK_BRUTE_FORCE_MIN
+
+
+def classify_locally(lines):
+    """按特征签名给出每个源 IP 的攻击类型 (取命中最多的类型)"""
+    parser = LogParser()
+    hits = {}
+    for line in lines:
+        record = parser.parse(line)
+        if record is None or record.ip is None:
+            continue
+        attack_type = match_signature(line)
+        if attack_type is not None:
+            hits.setdefault(record.ip, Counter())[attack_type] += 1
+    verdicts = []
+    for ip, counter in hits.items():
+        attack_type = counter.most_common(1)[0][0]
+        if attack_type == 'Brute Force' and not brute_force_confirmed(ip):
+            continue
+        verdicts.append({'ip': ip, 'attack_type': attack_type, 'analyzed_by': ANALYZED_BY_SIGNATURE})
+    return verdicts
+
+
+class ReanalysisQueue:
+    """等待 AI 复核的批次 (有界，满时丢弃最早的批次)
+    同一批次 (按内容识别) 最多入队 max_attempts 次: 复核时 AI 仍然失败的批次不会无限循环,
+    也不会反复写入相同的本地判定
+    """
+
+    def __init__(self, maxlen=REANALYSIS_QUEUE_SIZE, max_attempts=REANALYSIS_MAX_ATTEMPTS):
+        self._batches = deque()
+        self.maxlen = maxlen
+        self.max_attempts = max_attempts
+        # 批次摘要 -> 已入队次数 (LRU，只保留最近的批次)
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+        self._depth = QUEUE_DEPTH.labels('reanalysis')
+
+    def __len__(self):
+        return len(self._batches)
+
+    @staticmethod
+    def _digest(lines):
+        return hashlib.blake2b('\n'.join(lines).encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+    def put(self, lines):
+        """加入待复核批次; 该批次已达到最大入队次数时丢弃并返回 False"""
+        key = self._digest(lines)
+        with self._lock:
+            attempts = self._attempts.pop(key, 0) + 1
+            if attempts > self.max_attempts:
+                LINES_FILTERED.labels('reanalysis_exhausted').inc(len(lines))
+                return False
+            self._attempts[key] = attempts
+            while len(self._attempts) > self.maxlen * self.max_attempts:
+                self._attempts.popitem(last=False)
+            self._batches.append(list(lines))
+            while len(self._batches) > self.maxlen:
+                LINES_FILTERED.labels('reanalysis_overflow').inc(len(self._batches.popleft()))
+            self._depth.set(len(self._batches))
+        return True
+
+    def pending(self):
+        """等待复核的批次 (从旧到新)，供检查点保存"""
+        with self._lock:
+            return [list(batch) for batch in self._batches]
+
+    def restore(self, batches):
+        for batch in batches:
+            self.put(batch)
+
+    def drain_to(self, scheduler, breaker, limit=None):
+        """AI 已恢复 (熔断器闭合) 时把待复核批次交回调度器，返回交回的批次数"""
+        if not self._batches or breaker.state != STATE_CLOSED:
+            return 0
+        moved = 0
+        with self._lock:
+            while self._batches and (limit is None or moved < limit):
+                scheduler.submit(self._batches.popleft())
+                moved += 1
+            self._depth.set(len(self._batches))
+        return moved
+
+
+def degrade(lines, on_verdict=None):
+    """本地分类一批日志并放入复核队列，返回本地判定结果"""
+    AI_DEGRADED_BATCHES.inc()
+    verdicts = classify_locally(lines)
+    if on_verdict is not None:
+        for verdict in verdicts:
+            on_verdict(verdict)
+    get_reanalysis_queue().put(lines)
+    return verdicts
+
+
+_reanalysis = None
+_reanalysis_lock = threading.Lock()
+
+
+def get_reanalysis_queue():
+    """进程内共享的复核队列 (首次调用时创建)"""
+    global _reanalysis
+    if _reanalysis is None:
+        with _reanalysis_lock:
+            if _reanalysis is None:
+                _reanalysis = ReanalysisQueue()
+    return _reanalysis
+
+
+def set_reanalysis_queue(reanalysis):
+    """替换共享的复核队列 (测试用)"""
+    global _reanalysis
+    _reanalysis = reanalysis
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线 GeoIP/ASN 查询
+把 CSV/TSV 格式的 IP 段数据 (GeoLite2 ASN/Country CSV 合并后的结果，或 iptoasn.com 的 ip2asn TSV)
+转换为按起始地址排序的定长记录文件，运行时通过 mmap 二分查找，不需要网络请求，也不把整个库读入内存；
+每个 IP 的查询结果缓存在有界 LRU 中。封禁 IP 时据此在 blocked_ips 中记录国家和 ASN
+
+用法:
+    python3 geoip.py build ip2asn-combined.tsv --format ip2asn      # 生成 GEOIP_DB_FILE
+    python3 geoip.py build ranges.csv                               # 表头: network 或 start_ip,end_ip；country, asn, as_org
+    python3 geoip.py lookup 8.8.8.8 1.1.1.1
+    python3 geoip.py enrich                                         # 补齐已有 blocked_ips 的国家和 ASN
+
+文件格式 (整数均为大端):
+    头部 24 字节: 魔数 b'AEGEO1\\0\\0'，IPv4 记录数，IPv6 记录数，字符串区偏移 (u32 x3)，保留 4 字节
+    IPv4 记录 18 字节: 起始地址 u32，结束地址 u32，ASN u32，国家代码 2 字节，AS 名称偏移 u32
+    IPv6 记录 42 字节: 起始地址 16 字节，结束地址 16 字节，其余同上
+    字符串区: u16 长度 + UTF-8 文本 (偏移 0 为空字符串)
+"""
+
+import argparse
+import csv
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+from config import DB_PATH, GEOIP_DB_FILE, GEOIP_CACHE_SIZE
+from metrics import REGISTRY
+
+GEOIP_LOOKUPS = REGISTRY.counter('aegis_geoip_lookups_total', 'GeoIP/ASN 查询次数', ['result'])
+
+MAGIC = b'AEGEO1\0\0'
+HEADER = struct.Struct('>8sIII4x')
+RECORD_V4 = struct.Struct('>III2sI')
+RECORD_V6 = struct.Struct('>16s16sI2sI')
+
+# CSV 表头别名 (GeoLite2 CSV 的列名)
+COLUMN_ALIASES = {
+    'country': ('country', 'country_iso_code', 'country_code'),
+    'asn': ('asn', 'autonomous_system_number', 'as_number'),
+    'as_org': ('as_org', 'autonomous_system_organization', 'as_description'),
+}
+
+
+class GeoIPDatabase:
+    """mmap 打开的 IP 段库，lookup 线程安全"""
+
+    def __init__(self, path, cache_size=GEOIP_CACHE_SIZE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count, self._strings = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} 不是 GeoIP 库文件")
+        self._v6_offset = HEADER.size + self.v4_count * RECORD_V4.size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._mm.close()
+
+    def __len__(self):
+        return self.v4_count + self.v6_count
+
+    def _string(self, offset):
+        start = self._strings + offset
+        (length,) = struct.unpack_from('>H', self._mm, start)
+        return self._mm[start + 2:start + 2 + length].decode('utf-8')
+
+    def _search(self, key, record, base, count):
+        """返回起始地址 <= key 的最后一条记录，没有时返回 None"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if record.unpack_from(self._mm, base + mid * record.size)[0] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        return record.unpack_from(self._mm, base + (lo - 1) * record.size)
+
+    def _lookup(self, ip):
+        try:
+            if ':' in ip:
+                key = socket.inet_pton(socket.AF_INET6, ip)
+                found = self._search(key, RECORD_V6, self._v6_offset, self.v6_count)
+            else:
+                key = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+                found = self._search(key, RECORD_V4, HEADER.size, self.v4_count)
+        except OSError:
+            return None
+        if found is None or key > found[1]:
+            return None
+        _, _, asn, country, org = found
+        return {
+            'country': country.decode('ascii').strip() or None,
+            'asn': asn or None,
+            'as_org': self._string(org) or None,
+        }
+
+    def lookup(self, ip):
+        """返回 {'country', 'asn', 'as_org'}，地址不在库中或无法解析时返回 None"""
+        with self._lock:
+            if ip in self._cache:
+                self._cache.move_to_end(ip)
+                GEOIP_LOOKUPS.labels('cached').inc()
+                return self._cache[ip]
+        result = self._lookup(ip)
+        GEOIP_LOOKUPS.labels('hit' if result else 'miss').inc()
+        with self._lock:
+            self._cache[ip] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def asn_networks(self, asn):
+        """返回某个 ASN 的全部地址段 (CIDR 列表)，用于按 ASN 封禁"""
+        networks = []
+        for base, count, record, family in ((HEADER.size, self.v4_count, RECORD_V4, 4),
+                                             (self._v6_offset, self.v6_count, RECORD_V6, 6)):
+            for i in range(count):
+                start, end, record_asn, _, _ = record.unpack_from(self._mm, base + i * record.size)
+                if record_asn != asn:
+                    continue
+                if family == 4:
+                    first, last = ipaddress.IPv4Address(start), ipaddress.IPv4Address(end)
+                else:
+                    first, last = ipaddress.IPv6Address(start), ipaddress.IPv6Address(end)
+                networks.extend(str(n) for n in ipaddress.summarize_address_range(first, last))
+        return networks
+
+
+def _trim_overlaps(entries):
+    """按起始地址排序，重叠的地址段只保留先出现 (起始地址更小) 的部分"""
+    trimmed = []
+    last_end = -1
+    for start, end, asn, country, org in sorted(entries):
+        if end <= last_end:
+            continue
+        trimmed.append((max(start, last_end + 1), end, asn, country, org))
+        last_end = end
+    return trimmed
+
+
+def build_database(ranges, path):
+    """把 (起始 IP, 结束 IP, 国家代码, ASN, AS 名称) 写成库文件 (先写临时文件再替换), 返回地址段数"""
+    strings = {'': 0}
+    blob = bytearray(struct.pack('>H', 0))
+    v4, v6 = [], []
+    for start, end, country, asn, org in ranges:
+        start, end = ipaddress.ip_address(start), ipaddress.ip_address(end)
+        if start.version != end.version or start > end:
+            continue
+        org = (org or '')[:1000]
+        if org not in strings:
+            strings[org] = len(blob)
+            encoded = org.encode('utf-8')
+            blob += struct.pack('>H', len(encoded)) + encoded
+        country = (country or '').upper().encode('ascii', 'replace')[:2].ljust(2)
+        (v4 if start.version == 4 else v6).append((int(start), int(end), int(asn or 0), country, strings[org]))
+    v4, v6 = _trim_overlaps(v4), _trim_overlaps(v6)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.geoip-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(v4), len(v6),
+                                HEADER.size + len(v4) * RECORD_V4.size + len(v6) * RECORD_V6.size))
+            for entry in v4:
+                f.write(RECORD_V4.pack(*entry))
+            for start, end, asn, country, org in v6:
+                f.write(RECORD_V6.pack(start.to_bytes(16, 'big'), end.to_bytes(16, 'big'), asn, country, org))
+            f.write(blob)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(v4) + len(v6)
+
+
+def _column(header, field):
+    for alias in COLUMN_ALIASES[field]:
+        if alias in header:
+            return header.index(alias)
+    return None
+
+
+def read_ranges(path, fmt='csv'):
+    """读取 IP 段数据，生成 (起始 IP, 结束 IP, 国家代码, ASN, AS 名称)
+    fmt: csv 带表头 (network 或 start_ip/end_ip 列)；ip2asn 为 iptoasn.com 的无表头 TSV
+    """
+    with open(path, newline='', encoding='utf-8', errors='replace') as f:
+        if fmt == 'ip2asn':
+            for row in csv.reader(f, delimiter='\t'):
+                if len(row) >= 5:
+                    yield row[0], row[1], row[3] if row[3] != 'None' else '', row[2], \
+                        row[4] if row[4] != 'Not routed' else ''
+            return
+        reader = csv.reader(f, delimiter='\t' if path.endswith('.tsv') else ',')
+        header = [name.strip().lower() for name in next(reader)]
+        columns = {field: _column(header, field) for field in COLUMN_ALIASES}
+        network = header.index('network') if 'network' in header else None
+        for row in reader:
+            if network is not None:
+                net = ipaddress.ip_network(row[network], strict=False)
+                start, end = net.network_address, net.broadcast_address
+            else:
+                start, end = row[header.index('start_ip')], row[header.index('end_ip')]
+            values = {field: row[i] if i is not None and i < len(row) else '' for field, i in columns.items()}
+            yield start, end, values['country'], values['asn'] or 0, values['as_org']
+
+
+_geoip = None
+_geoip_mtime = None
+_geoip_lock = threading.Lock()
+_override = False
+
+
+def get_geoip(path=GEOIP_DB_FILE):
+    """进程内共享的 GeoIP 库；库文件不存在时返回 None，文件更新后重新打开"""
+    global _geoip, _geoip_mtime
+    if _override:
+        return _geoip
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if mtime != _geoip_mtime:
+        with _geoip_lock:
+            if mtime != _geoip_mtime:
+                previous = _geoip
+                _geoip = GeoIPDatabase(path)
+                _geoip_mtime = mtime
+                if previous is not None:
+                    # 释放旧库的 mmap; 仍在使用旧库的查询由 lookup_ip 改用新库重试
+                    previous.close()
+    return _geoip
+
+
+def set_geoip(database):
+    """替换共享的 GeoIP 库 (测试用)；传入 None 恢复按库文件加载"""
+    global _geoip, _geoip_mtime, _override
+    _geoip = database
+    _geoip_mtime = None
+    _override = database is not None
+
+
+def lookup_ip(ip):
+    """查询 IP 的国家和 ASN；未配置库或库中没有时返回 None"""
+    database = get_geoip()
+    if database is None:
+        return None
+    try:
+        return database.lookup(ip)
+    except ValueError:
+        # 查询期间库文件被更新，旧库已关闭
+        database = get_geoip()
+        return database.lookup(ip) if database is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线 GeoIP/ASN 查询')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help='从 CSV/TSV 生成库文件')
+    p_build.add_argument('source', help='IP 段数据文件')
+    p_build.add_argument('--format', choices=('csv', 'ip2asn'), default='csv')
+    p_build.add_argument('--output', default=GEOIP_DB_FILE, help='库文件')
+    p_lookup = sub.add_parser('lookup', help='查询 IP')
+    p_lookup.add_argument('ips', nargs='+')
+    p_lookup.add_argument('--db', default=GEOIP_DB_FILE, help='库文件')
+    p_enrich = sub.add_parser('enrich', help='补齐 blocked_ips 中缺少的国家和 ASN')
+    p_enrich.add_argument('--db', default=DB_PATH, help='SQLite 数据库')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_database(read_ranges(args.source, args.format), args.output)
+        print(f"{count} 个地址段已写入 {args.output}")
+        return 0
+    if args.command == 'lookup':
+        database = GeoIPDatabase(args.db)
+        for ip in args.ips:
+            print(f"{ip}\t{database.lookup(ip)}")
+        return 0
+
+    from models import DatabaseManager
+
+    if get_geoip() is None:
+        print(f"GeoIP 库文件不存在: {GEOIP_DB_FILE}", file=sys.stderr)
+        return 1
+    print(f"已补齐 {DatabaseManager(args.db).enrich_blocked_ips(lookup_ip)} 个封禁 IP")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
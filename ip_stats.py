@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+固定内存的按 IP 滑动窗口统计
+DDoS 期间源 IP 可能达到百万级，精确字典会耗尽内存，这里全部使用概率数据结构:
+    Count-Min Sketch  每个 IP 的窗口请求数 / 失败数 (只会高估)
+    HyperLogLog       窗口内的独立 IP 数，以及热点 IP 访问的独立路径数 / 端口数
+    Space-Saving      窗口内请求最多的 top-K IP
+
+窗口由若干个子窗口 (桶) 组成环形缓冲，过期的桶整体清零，内存占用与流量无关；
+分析阶段和 Dashboard 通过 snapshot() 查询，而不必重新扫描原始日志
+"""
+
+import hashlib
+import heapq
+import math
+import struct
+import threading
+import time
+from array import array
+
+from config import (
+    IP_STATS_WINDOW, IP_STATS_BUCKETS, IP_STATS_CMS_WIDTH, IP_STATS_CMS_DEPTH,
+    IP_STATS_TOP_K, IP_STATS_HLL_PRECISION
+)
+from log_parsers import AUTH_FAILED, AUTH_INVALID_USER
+
+# 热点 IP 条目上的 HyperLogLog 精度 (64 个寄存器，标准误差约 13%)
+ENTRY_HLL_PRECISION = 6
+
+_MASK64 = (1 << 64) - 1
+
+# dump_state 的二进制格式 (本机字节序，检查点只在本机使用)
+# 参数: 窗口、桶数、CMS 宽度/深度、top-K、HLL 精度、条目 HLL 精度、当前桶编号 (-1 表示尚无数据)
+_STATE_HEADER = struct.Struct('=dIIIIIIq')
+# 每个桶: 请求数、失败数、热点条目数
+_BUCKET_HEADER = struct.Struct('=qqI')
+# 每个热点条目: IP 长度、计数、误差上界
+_ENTRY_HEADER = struct.Struct('=Hqq')
+
+
+def hash64(value):
+    """稳定的 64 位哈希 (不受 PYTHONHASHSEED 影响，进程间一致)"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogateescape'), digest_size=8).digest(), 'big')
+
+
+class CountMinSketch:
+    """Count-Min Sketch，支持按元素相减 (用于滑动窗口扣除过期的桶)"""
+
+    __slots__ = ('width', 'depth', 'table')
+
+    def __init__(self, width=IP_STATS_CMS_WIDTH, depth=IP_STATS_CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = array('q', bytes(8 * width * depth))
+
+    def indexes(self, h):
+        """由一个 64 位哈希派生 depth 个位置 (Kirsch-Mitzenmacher 双重哈希)"""
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, h, count=1):
+        table = self.table
+        for i in self.indexes(h):
+            table[i] += count
+
+    def estimate(self, h):
+        table = self.table
+        return min(table[i] for i in self.indexes(h))
+
+    def subtract(self, other):
+        self.table = array('q', map(int.__sub__, self.table, other.table))
+
+    def clear(self):
+        self.table = array('q', bytes(8 * self.width * self.depth))
+
+    def nbytes(self):
+        return self.table.itemsize * len(self.table)
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计"""
+
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p=IP_STATS_HLL_PRECISION):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, h):
+        p = self.p
+        idx = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时改用线性计数
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def copy(self):
+        other = HyperLogLog(self.p)
+        other.registers = bytearray(self.registers)
+        return other
+
+
+class SpaceSaving:
+    """Space-Saving 热点统计: 最多跟踪 k 个键，满时替换计数最小的键
+
+    条目: [计数, 误差上界, 路径 HLL, 端口 HLL]；最小堆惰性更新 (计数只增不减)
+    """
+
+    __slots__ = ('k', 'entries', '_heap')
+
+    def __init__(self, k=IP_STATS_TOP_K):
+        self.k = k
+        self.entries = {}
+        self._heap = []
+
+    def offer(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] += 1
+            return entry
+        error = 0
+        if len(self.entries) >= self.k:
+            heap = self._heap
+            while True:
+                count, victim = heap[0]
+                actual = self.entries[victim][0]
+                if actual == count:
+                    heapq.heappop(heap)
+                    del self.entries[victim]
+                    error = count
+                    break
+                heapq.heapreplace(heap, (actual, victim))
+        entry = [error + 1, error, HyperLogLog(ENTRY_HLL_PRECISION), HyperLogLog(ENTRY_HLL_PRECISION)]
+        self.entries[key] = entry
+        heapq.heappush(self._heap, (entry[0], key))
+        return entry
+
+    def clear(self):
+        self.entries = {}
+        self._heap = []
+
+
+class _Bucket:
+    """一个子窗口内的全部统计"""
+
+    __slots__ = ('requests', 'failures', 'cms_requests', 'cms_failures', 'ips', 'heavy')
+
+    def __init__(self, width, depth, k, hll_precision):
+        self.requests = 0
+        self.failures = 0
+        self.cms_requests = CountMinSketch(width, depth)
+        self.cms_failures = CountMinSketch(width, depth)
+        self.ips = HyperLogLog(hll_precision)
+        self.heavy = SpaceSaving(k)
+
+
+class IPStats:
+    """按 IP 的滑动窗口统计 (线程安全)"""
+
+    def __init__(self, window=IP_STATS_WINDOW, buckets=IP_STATS_BUCKETS, width=IP_STATS_CMS_WIDTH,
+                 depth=IP_STATS_CMS_DEPTH, top_k=IP_STATS_TOP_K, hll_precision=IP_STATS_HLL_PRECISION):
+        self.window = window
+        self.span = window / buckets
+        self._buckets = [_Bucket(width, depth, top_k, hll_precision) for _ in range(buckets)]
+        # 全部未过期桶之和，查询时只需读一次
+        self._total_requests = CountMinSketch(width, depth)
+        self._total_failures = CountMinSketch(width, depth)
+        self._epoch = None
+        self._lock = threading.Lock()
+
+    def _advance(self, now):
+        """切换到 now 所在的桶，清零期间过期的桶"""
+        epoch = int(now // self.span)
+        if self._epoch is None:
+            self._epoch = epoch
+        elif epoch > self._epoch:
+            for step in range(1, min(epoch - self._epoch, len(self._buckets)) + 1):
+                self._expire(self._buckets[(self._epoch + step) % len(self._buckets)])
+            self._epoch = epoch
+        # 时钟回拨时继续写当前桶
+        return self._buckets[self._epoch % len(self._buckets)]
+
+    def _expire(self, bucket):
+        if bucket.requests:
+            self._total_requests.subtract(bucket.cms_requests)
+            bucket.cms_requests.clear()
+        if bucket.failures:
+            self._total_failures.subtract(bucket.cms_failures)
+            bucket.cms_failures.clear()
+        bucket.requests = bucket.failures = 0
+        bucket.ips = HyperLogLog(bucket.ips.p)
+        bucket.heavy.clear()
+
+    def add(self, record, now=None):
+        """记录一条解析后的日志 (LogRecord)，按读入时刻归入窗口"""
+        ip = record.ip
+        if ip is None:
+            return
+        failed = record.auth in (AUTH_FAILED, AUTH_INVALID_USER) or (
+            record.status is not None and record.status >= 400)
+        h = hash64(ip)
+        path_hash = hash64(record.path) if record.path else None
+        port_hash = hash64(str(record.port)) if record.port is not None else None
+        now = time.time() if now is None else now
+        with self._lock:
+            bucket = self._advance(now)
+            indexes = bucket.cms_requests.indexes(h)
+            for table in (bucket.cms_requests.table, self._total_requests.table):
+                for i in indexes:
+                    table[i] += 1
+            bucket.requests += 1
+            if failed:
+                for table in (bucket.cms_failures.table, self._total_failures.table):
+                    for i in indexes:
+                        table[i] += 1
+                bucket.failures += 1
+            bucket.ips.add(h)
+            entry = bucket.heavy.offer(ip)
+            if path_hash is not None:
+                entry[2].add(path_hash)
+            if port_hash is not None:
+                entry[3].add(port_hash)
+
+    def add_records(self, records, now=None):
+        for record in records:
+            if record is not None:
+                self.add(record, now)
+
+    def requests(self, ip, now=None):
+        """IP 在窗口内的请求数估计 (可能高估，不会低估)"""
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            return self._total_requests.estimate(hash64(ip))
+
+    def failures(self, ip, now=None):
+        """IP 在窗口内的失败请求数估计 (认证失败或 HTTP 4xx/5xx)"""
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            return self._total_failures.estimate(hash64(ip))
+
+    def _distinct(self, ip, slot):
+        merged = None
+        for bucket in self._buckets:
+            entry = bucket.heavy.entries.get(ip)
+            if entry is not None:
+                if merged is None:
+                    merged = entry[slot].copy()
+                else:
+                    merged.merge(entry[slot])
+        return merged.count() if merged is not None else None
+
+    def top(self, n=10, now=None):
+        """窗口内请求最多的 n 个 IP 及其统计"""
+        with self._lock:
+            self._advance(time.time() if now is None else now)
+            candidates = set()
+            for bucket in self._buckets:
+                candidates.update(bucket.heavy.entries)
+            rows = []
+            for ip in candidates:
+                h = hash64(ip)
+                requests = self._total_requests.estimate(h)
+                failures = min(self._total_failures.estimate(h), requests)
+                rows.append({
+                    'ip': ip,
+                    'requests': requests,
+                    'failures': failures,
+                    'failure_ratio': round(failures / requests, 4) if requests else 0.0,
+                    'distinct_paths': self._distinct(ip, 2),
+                    'distinct_ports': self._distinct(ip, 3),
+                })
+            rows.sort(key=lambda row: row['requests'], reverse=True)
+            return rows[:n]
+
+    def snapshot(self, n=20, now=None):
+        """可 JSON 序列化的统计快照"""
+        now = time.time() if now is None else now
+        top = self.top(n, now)
+        with self._lock:
+            ips = None
+            for bucket in self._buckets:
+                if ips is None:
+                    ips = bucket.ips.copy()
+                else:
+                    ips.merge(bucket.ips)
+            return {
+                'generated_at': now,
+                'window_seconds': self.window,
+                'requests': sum(b.requests for b in self._buckets),
+                'failures': sum(b.failures for b in self._buckets),
+                'distinct_ips': ips.count(),
+                'top_ips': top,
+                'memory_bytes': self.memory_bytes(),
+            }
+
+    def _params(self):
+        first = self._buckets[0]
+        return (self.window, len(self._buckets), first.cms_requests.width, first.cms_requests.depth,
+                first.heavy.k, first.ips.p, ENTRY_HLL_PRECISION)
+
+    def dump_state(self):
+        """导出窗口内的全部统计 (二进制)，供检查点保存"""
+        with self._lock:
+            parts = [_STATE_HEADER.pack(*self._params(), -1 if self._epoch is None else self._epoch),
+                     self._total_requests.table.tobytes(), self._total_failures.table.tobytes()]
+            for bucket in self._buckets:
+                parts += [_BUCKET_HEADER.pack(bucket.requests, bucket.failures, len(bucket.heavy.entries)),
+                          bucket.cms_requests.table.tobytes(), bucket.cms_failures.table.tobytes(),
+                          bytes(bucket.ips.registers)]
+                for ip, (count, error, paths, ports) in bucket.heavy.entries.items():
+                    key = ip.encode('utf-8', 'surrogateescape')
+                    parts += [_ENTRY_HEADER.pack(len(key), count, error), key,
+                              bytes(paths.registers), bytes(ports.registers)]
+            return b''.join(parts)
+
+    def load_state(self, data):
+        """恢复 dump_state 导出的统计；窗口或 sketch 参数与当前配置不同时抛出 ValueError
+        过期判断使用墙上时间，停机期间已移出窗口的桶在下次写入或查询时清零
+        """
+        view = memoryview(data)
+        pos = 0
+
+        def take(size):
+            nonlocal pos
+            chunk = view[pos:pos + size]
+            if len(chunk) != size:
+                raise ValueError('IP 统计状态不完整')
+            pos += size
+            return chunk
+
+        *params, epoch = _STATE_HEADER.unpack(take(_STATE_HEADER.size))
+        if tuple(params) != self._params():
+            raise ValueError('IP 统计参数与当前配置不一致')
+        _, buckets, width, depth, k, p, entry_p = params
+
+        def table():
+            values = array('q')
+            values.frombytes(take(8 * width * depth))
+            return values
+
+        total_requests, total_failures = table(), table()
+        restored = []
+        for _ in range(buckets):
+            requests, failures, entries = _BUCKET_HEADER.unpack(take(_BUCKET_HEADER.size))
+            bucket = _Bucket(width, depth, k, p)
+            bucket.requests, bucket.failures = requests, failures
+            bucket.cms_requests.table, bucket.cms_failures.table = table(), table()
+            bucket.ips.registers = bytearray(take(1 << p))
+            for _ in range(entries):
+                length, count, error = _ENTRY_HEADER.unpack(take(_ENTRY_HEADER.size))
+                ip = bytes(take(length)).decode('utf-8', 'surrogateescape')
+                paths, ports = HyperLogLog(entry_p), HyperLogLog(entry_p)
+                paths.registers = bytearray(take(1 << entry_p))
+                ports.registers = bytearray(take(1 << entry_p))
+                bucket.heavy.entries[ip] = [count, error, paths, ports]
+                bucket.heavy._heap.append((count, ip))
+            heapq.heapify(bucket.heavy._heap)
+            restored.append(bucket)
+        with self._lock:
+            self._buckets = restored
+            self._total_requests.table = total_requests
+            self._total_failures.table = total_failures
+            self._epoch = None if epoch < 0 else epoch
+
+    def memory_bytes(self):
+        """sketch 数据占用的字节数 (不随流量增长)"""
+        total = self._total_requests.nbytes() + self._total_failures.nbytes()
+        for bucket in self._buckets:
+            total += bucket.cms_requests.nbytes() + bucket.cms_failures.nbytes() + len(bucket.ips.registers)
+            total += bucket.heavy.k * 2 * (1 << ENTRY_HLL_PRECISION)
+        return total
+
+
+_ip_stats = None
+_ip_stats_lock = threading.Lock()
+
+
+def get_ip_stats():
+    """进程内共享的 IPStats (首次调用时创建)"""
+    global _ip_stats
+    if _ip_stats is None:
+        with _ip_stats_lock:
+            if _ip_stats is None:
+                _ip_stats = IPStats()
+    return _ip_stats
+
+
+def set_ip_stats(stats):
+    """替换共享的 IPStats (测试用)"""
+    global _ip_stats
+    _ip_stats = stats
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+结构化日志解析
+预编译的按格式提取器，把日志行解析成紧凑的 LogRecord (源 IP、时间、方法、路径、状态码、UA、认证结果等)，
+下游阶段直接使用字段而不必重复扫描文本
+
+支持格式:
+    combined   nginx / Apache combined 访问日志
+    common     Apache common (CLF) 访问日志
+    sshd       syslog 中的 sshd 认证日志
+    netfilter  syslog 中的内核 iptables 日志 (SRC= DST= PROTO= DPT= SYN)
+    syslog     其它 syslog 行 (取消息中的第一个 IPv4)
+    raw        无法识别的格式，只提取第一个 IPv4
+"""
+
+import calendar
+import re
+import time
+from datetime import datetime
+
+FORMAT_COMBINED = 'combined'
+FORMAT_COMMON = 'common'
+FORMAT_SSHD = 'sshd'
+FORMAT_NETFILTER = 'netfilter'
+FORMAT_SYSLOG = 'syslog'
+FORMAT_RAW = 'raw'
+
+AUTH_FAILED = 'failed'
+AUTH_ACCEPTED = 'accepted'
+AUTH_INVALID_USER = 'invalid_user'
+
+IPV4_RE = re.compile(r'\b(\d{1,3}(?:\.\d{1,3}){3})\b')
+
+ACCESS_RE = re.compile(
+    r'^(?P<ip>[0-9A-Fa-f:.]+) \S+ (?P<user>\S+) \[(?P<time>[^\]]+)\] '
+    r'"(?:(?P<method>[A-Z]+) (?P<path>\S+)(?: (?P<proto>[^"]*))?|[^"]*)" '
+    r'(?P<status>\d{3}) (?P<size>\d+|-)'
+    r'(?: "(?P<referer>(?:[^"\\]|\\.)*)" "(?P<agent>(?:[^"\\]|\\.)*)")?'
+)
+
+SYSLOG_RE = re.compile(
+    r'^(?P<time>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|[+-]\d\d:?\d\d)?) '
+    r'(?P<host>\S+) (?P<prog>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?: (?P<msg>.*)$'
+)
+
+SSHD_AUTH_RE = re.compile(
+    r'^(?P<result>Failed|Accepted) \S+ for (?P<invalid>invalid user )?(?P<user>\S*) '
+    r'from (?P<ip>[0-9A-Fa-f:.]+) port (?P<port>\d+)'
+)
+SSHD_INVALID_RE = re.compile(r'^Invalid user (?P<user>\S*) from (?P<ip>[0-9A-Fa-f:.]+)(?: port (?P<port>\d+))?')
+
+NETFILTER_KV_RE = re.compile(r'\b(SRC|DST|PROTO|SPT|DPT)=(\S+)')
+NETFILTER_FLAGS = frozenset(('SYN', 'ACK', 'FIN', 'RST', 'PSH', 'URG'))
+
+_MONTHS = {m: i for i, m in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
+
+class LogRecord:
+    """一行日志的结构化字段，未知字段为 None"""
+
+    __slots__ = ('fmt', 'ip', 'timestamp', 'method', 'path', 'status', 'size',
+                 'user_agent', 'auth', 'user', 'proto', 'port', 'flags', 'raw')
+
+    def __init__(self, fmt, ip, raw, timestamp=None, method=None, path=None, status=None,
+                 size=None, user_agent=None, auth=None, user=None, proto=None, port=None, flags=None):
+        self.fmt = fmt
+        self.ip = ip
+        self.raw = raw
+        self.timestamp = timestamp
+        self.method = method
+        self.path = path
+        self.status = status
+        self.size = size
+        self.user_agent = user_agent
+        self.auth = auth
+        self.user = user
+        self.proto = proto
+        self.port = port
+        self.flags = flags
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __reduce__(self):
+        # 按位置参数序列化: 比默认的 __slots__ 状态字典更紧凑，分片 worker 把解析结果发给协调者时使用
+        return (LogRecord, (self.fmt, self.ip, self.raw, self.timestamp, self.method, self.path, self.status,
+                            self.size, self.user_agent, self.auth, self.user, self.proto, self.port, self.flags))
+
+    def __repr__(self):
+        return f"LogRecord(fmt={self.fmt!r}, ip={self.ip!r}, path={self.path!r}, status={self.status!r})"
+
+
+def parse_clf_time(value):
+    """解析 10/Oct/2000:13:55:36 -0700，返回 Unix 时间戳，失败返回 None"""
+    try:
+        ts = calendar.timegm((int(value[7:11]), _MONTHS[value[3:6]], int(value[0:2]),
+                              int(value[12:14]), int(value[15:17]), int(value[18:20])))
+        tz = value[21:26]
+        if tz:
+            offset = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+            ts -= offset if tz[0] == '+' else -offset
+        return float(ts)
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+def parse_syslog_time(value, now=None):
+    """解析 'Oct 10 13:55:36' (无年份，按本地时间取最近的过去) 或 ISO 8601 时间戳"""
+    try:
+        if value[0].isdigit():
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        now = time.time() if now is None else now
+        year = time.localtime(now).tm_year
+        parts = (_MONTHS[value[0:3]], int(value[4:6]), int(value[7:9]), int(value[10:12]), int(value[13:15]))
+        ts = time.mktime((year,) + parts + (0, 0, -1))
+        if ts > now + 86400:
+            # 年末的日志在新年读取时属于上一年
+            ts = time.mktime((year - 1,) + parts + (0, 0, -1))
+        return ts
+    except (KeyError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _parse_access(line):
+    m = ACCESS_RE.match(line)
+    if m is None:
+        return None
+    status = int(m.group('status'))
+    size = m.group('size')
+    agent = m.group('agent')
+    return LogRecord(
+        FORMAT_COMBINED if agent is not None else FORMAT_COMMON, m.group('ip'), line,
+        timestamp=parse_clf_time(m.group('time')),
+        method=m.group('method'), path=m.group('path'), status=status,
+        size=int(size) if size != '-' else None, user_agent=agent,
+        # HTTP 401 视为一次认证失败，便于和 sshd 一起统计暴力破解
+        auth=AUTH_FAILED if status == 401 else None,
+        user=None if m.group('user') == '-' else m.group('user'),
+        proto=m.group('proto'),
+    )
+
+
+def _parse_sshd(msg, line, ts):
+    m = SSHD_AUTH_RE.match(msg)
+    if m is not None:
+        if m.group('invalid'):
+            auth = AUTH_INVALID_USER
+        else:
+            auth = AUTH_FAILED if m.group('result') == 'Failed' else AUTH_ACCEPTED
+        return LogRecord(FORMAT_SSHD, m.group('ip'), line, timestamp=ts, auth=auth,
+                         user=m.group('user'), proto='ssh', port=int(m.group('port')))
+    m = SSHD_INVALID_RE.match(msg)
+    if m is not None:
+        port = m.group('port')
+        return LogRecord(FORMAT_SSHD, m.group('ip'), line, timestamp=ts, auth=AUTH_INVALID_USER,
+                         user=m.group('user'), proto='ssh', port=int(port) if port else None)
+    m = IPV4_RE.search(msg)
+    return LogRecord(FORMAT_SSHD, m.group(1) if m else None, line, timestamp=ts, proto='ssh')
+
+
+def _parse_netfilter(msg, line, ts):
+    fields = dict(NETFILTER_KV_RE.findall(msg))
+    if 'SRC' not in fields:
+        return None
+    dpt = fields.get('DPT')
+    flags = [tok for tok in msg.split() if tok in NETFILTER_FLAGS]
+    return LogRecord(FORMAT_NETFILTER, fields['SRC'], line, timestamp=ts,
+                     proto=fields.get('PROTO'), port=int(dpt) if dpt and dpt.isdigit() else None,
+                     flags=' '.join(flags) or None)
+
+
+def _parse_syslog(line):
+    m = SYSLOG_RE.match(line)
+    if m is None:
+        return None
+    msg = m.group('msg')
+    ts = parse_syslog_time(m.group('time'))
+    prog = m.group('prog')
+    if prog == 'sshd':
+        return _parse_sshd(msg, line, ts)
+    if prog == 'kernel' and 'SRC=' in msg:
+        record = _parse_netfilter(msg, line, ts)
+        if record is not None:
+            return record
+    ip = IPV4_RE.search(msg)
+    return LogRecord(FORMAT_SYSLOG, ip.group(1) if ip else None, line, timestamp=ts)
+
+
+def _parse_raw(line):
+    m = IPV4_RE.search(line)
+    return LogRecord(FORMAT_RAW, m.group(1) if m else None, line)
+
+
+# 按格式族尝试的顺序；raw 总能成功，放在最后
+_FAMILIES = (_parse_access, _parse_syslog)
+
+
+def parse_line(line):
+    """自动识别格式解析一行，空行返回 None"""
+    line = line.rstrip('\r\n')
+    if not line.strip():
+        return None
+    for parse in _FAMILIES:
+        record = parse(line)
+        if record is not None:
+            return record
+    return _parse_raw(line)
+
+
+class LogParser:
+    """有状态的解析器: 记住上一次成功的格式族优先尝试。
+    同一文件内格式一致，顺序读取多个文件时相当于按文件自动识别格式
+    """
+
+    def __init__(self):
+        self._order = list(_FAMILIES)
+        self.format_counts = {}
+
+    def parse(self, line):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            return None
+        record = None
+        for i, parse in enumerate(self._order):
+            record = parse(line)
+            if record is not None:
+                if i:
+                    self._order.insert(0, self._order.pop(i))
+                break
+        if record is None:
+            record = _parse_raw(line)
+        self.format_counts[record.fmt] = self.format_counts.get(record.fmt, 0) + 1
+        return record
+
+
+def detect_format(lines):
+    """根据样本行判断格式，返回出现最多的格式名 (无有效行时返回 raw)"""
+    counts = {}
+    for line in lines:
+        record = parse_line(line)
+        if record is not None and record.ip is not None:
+            counts[record.fmt] = counts.get(record.fmt, 0) + 1
+    if not counts:
+        return FORMAT_RAW
+    return max(counts, key=counts.get)
+
+
+def detect_file_format(path, sample_lines=50):
+    """读取文件开头的若干行判断格式"""
+    lines = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            lines.append(line)
+            if len(lines) >= sample_lines:
+                break
+    return detect_format(lines)
@@ -1,23 +1,118 @@
-from config import LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_CONSOLE, LOG_RETENTION_DAYS, ANALYZE_FILES
+from config import (
+    LOG_LEVEL, LOG_FILE, LOG_FORMAT, LOG_CONSOLE, LOG_RETENTION_DAYS, ANALYZE_FILES,
+    LOG_JSON, LOG_QUEUE_SIZE, LOG_DEDUP_INTERVAL
+)
 import logging
-from logging.handlers import TimedRotatingFileHandler
 import sys
 import os
+import json
+import queue
+import time
+import threading
+import atexit
+
+# 每个 logger 名称只配置一次: {name: (QueueListener, QueueHandler)}
+_listeners = {}
+_setup_lock = threading.Lock()
+# set_log_level 设置的级别，覆盖 LOG_LEVEL
+_level_override = None
+# DroppingQueueHandler 类，首次配置日志时创建
+_dropping_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化 JSON 日志格式，每条日志一行"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RepeatFilter(logging.Filter):
+    """重复消息限流: 相同级别和内容的消息在 interval 秒内只放行一次，
+    下次放行时附带被抑制的次数"""
+
+    def __init__(self, interval, max_keys=1024):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._seen = {}  # (levelno, msg) -> [上次放行时间, 抑制次数]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry is not None else 0
+            if len(self._seen) >= self.max_keys:
+                self._evict(now)
+            self._seen[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{record.msg} (已抑制 {suppressed} 条重复消息)"
+        return True
+
+    def _evict(self, now):
+        expired = [k for k, v in self._seen.items() if now - v[0] >= self.interval]
+        for k in expired:
+            del self._seen[k]
+        if len(self._seen) >= self.max_keys:
+            self._seen.clear()
+
+
+def _dropping_queue_handler_class():
+    """返回 DroppingQueueHandler 类; logging.handlers 在首次配置日志时才导入，不计入模块导入耗时"""
+    global _dropping_queue_handler
+    if _dropping_queue_handler is None:
+        from logging.handlers import QueueHandler
+
+        class DroppingQueueHandler(QueueHandler):
+            """队列满时丢弃日志而不是阻塞调用方"""
+
+            def __init__(self, q):
+                super().__init__(q)
+                self.dropped = 0
+
+            def enqueue(self, record):
+                try:
+                    self.queue.put_nowait(record)
+                except queue.Full:
+                    self.dropped += 1
+
+        _dropping_queue_handler = DroppingQueueHandler
+    return _dropping_queue_handler
+
+
+def _configure(logger):
+    """为 logger 配置 QueueHandler + 后台 QueueListener，重复调用不会重复添加处理器"""
+    from logging.handlers import QueueListener, TimedRotatingFileHandler
+
+    with _setup_lock:
+        if logger.name in _listeners:
+            return
 
-class AegisLogger:
-    def __init__(self):
-        self.logger = logging.getLogger('AegisLogger')
-        self.logger.setLevel(LOG_LEVEL)
-        
         # 设置日志格式
-        formatter = logging.Formatter(LOG_FORMAT)
-        
+        formatter = JsonFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+        handlers = []
+
         # 控制台输出
         if LOG_CONSOLE:
             console_handler = logging.StreamHandler(sys.stdout)
             console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
-        
+            handlers.append(console_handler)
+
         # 文件输出
         file_handler = TimedRotatingFileHandler(
             LOG_FILE,
@@ -26,20 +121,73 @@ class AegisLogger:
             backupCount=LOG_RETENTION_DAYS
         )
         file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
-        
+        handlers.append(file_handler)
+
+        # 调用线程只负责入队，实际的 I/O 在监听线程中完成
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        queue_handler = _dropping_queue_handler_class()(log_queue)
+        queue_handler.addFilter(RepeatFilter(LOG_DEDUP_INTERVAL))
+        logger.addHandler(queue_handler)
+
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _listeners[logger.name] = (listener, queue_handler)
+
+
+def log_queue_depth():
+    """当前异步日志队列中等待写出的日志条数"""
+    return sum(listener.queue.qsize() for listener, _ in list(_listeners.values()))
+
+
+def shutdown_logging():
+    """停止所有监听线程并刷出队列中剩余的日志"""
+    with _setup_lock:
+        for name, (listener, queue_handler) in _listeners.items():
+            logging.getLogger(name).removeHandler(queue_handler)
+            listener.stop()
+        _listeners.clear()
+
+
+def set_log_level(level):
+    """覆盖 LOG_LEVEL (压测/评估工具的 --log-level)；传入 None 恢复 LOG_LEVEL
+    已创建的 AegisLogger 立即生效，之后创建的实例也不会恢复为 LOG_LEVEL
+    """
+    global _level_override
+    _level_override = level
+    for name in set(_listeners) | {'AegisLogger'}:
+        logging.getLogger(name).setLevel(level or LOG_LEVEL)
+
+
+class AegisLogger:
+    def __init__(self, name='AegisLogger'):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(_level_override or LOG_LEVEL)
+
+    def _log(self, level, msg):
+        # 处理器在第一次写日志时才创建，导入模块不会打开日志文件
+        if self.logger.name not in _listeners:
+            _configure(self.logger)
+        self.logger.log(level, msg)
+
     def debug(self, msg):
-        self.logger.debug(msg)
-        
+        self._log(logging.DEBUG, msg)
+
     def info(self, msg):
-        self.logger.info(msg)
-        
+        self._log(logging.INFO, msg)
+
     def warning(self, msg):
-        self.logger.warning(msg)
-        
+        self._log(logging.WARNING, msg)
+
     def error(self, msg):
-        self.logger.error(msg)
-        
+        self._log(logging.ERROR, msg)
+
     def critical(self, msg):
-        self.logger.critical(msg)
-        
\ No newline at end of file
+        self._log(logging.CRITICAL, msg)
+
+
+def __getattr__(name):
+    # `from logger import DroppingQueueHandler` 时才创建
+    if name == 'DroppingQueueHandler':
+        return _dropping_queue_handler_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
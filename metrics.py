@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+运行时指标 - Prometheus 文本格式
+提供计数器/仪表/直方图三类指标，热路径上只做一次加锁的加法；
+指标通过 Flask 的 /metrics 或独立 HTTP 端口 (start_http_server) 导出
+"""
+
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认延迟分桶(秒)，覆盖 SQLite 写入的毫秒级到 AI 请求的数十秒
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """指标基类: 无标签时直接操作自身，有标签时通过 labels() 获取子指标"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> '_Metric':
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def children(self) -> Dict[Tuple[str, ...], '_Metric']:
+        """返回 {标签值: 子指标} 的副本"""
+        with self._lock:
+            return dict(self._children)
+
+    def _new_child(self) -> '_Metric':
+        raise NotImplementedError
+
+    def _samples(self, names: Tuple[str, ...], values: Tuple[str, ...]):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        if self.labelnames:
+            children = sorted(self._children.items())
+        else:
+            children = [((), self)]
+        for label_values, child in children:
+            lines.extend(child._samples(self.labelnames, label_values))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _samples(self, names, values):
+        return [f'{self.name}{_format_labels(names, values)} {_format_value(self._value)}']
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值，也可以绑定一个回调在导出时取值"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, fn: Callable[[], float]):
+        self._function = fn
+
+    @property
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return float('nan')
+        return self._value
+
+    def _samples(self, names, values):
+        return [f'{self.name}{_format_labels(names, values)} {_format_value(self.value)}']
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(_Metric):
+    """固定分桶直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self._sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> _Timer:
+        """with HISTOGRAM.time(): ... 记录代码块耗时"""
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _samples(self, names, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f'{self.name}_bucket{_format_labels(names, values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_format_labels(names, values)} {_format_value(total)}')
+        lines.append(f'{self.name}_count{_format_labels(names, values)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+# ================= 分析流水线指标 =================
+LINES_READ = REGISTRY.counter('aegis_lines_read_total', '从日志文件读取的行数')
+LINES_FILTERED = REGISTRY.counter('aegis_lines_filtered_total', '发送给 AI 之前被过滤的行数', ['reason'])
+BATCHES_SENT = REGISTRY.counter('aegis_batches_sent_total', '发送给 AI 分析的批次数')
+AI_LATENCY = REGISTRY.histogram('aegis_ai_request_seconds', 'AI 接口请求耗时')
+AI_TOKENS = REGISTRY.counter('aegis_ai_tokens_total', 'AI 接口消耗的 token 数', ['kind'])
+AI_ERRORS = REGISTRY.counter('aegis_ai_errors_total', 'AI 接口调用失败次数')
+AI_PARSE_FAILURES = REGISTRY.counter('aegis_ai_parse_failures_total', 'AI 响应 JSON 解析失败次数')
+AI_FIRST_VERDICT_LATENCY = REGISTRY.histogram('aegis_ai_first_verdict_seconds', '流式模式下发出请求到解析出第一个攻击对象的耗时')
+ATTACKS_DETECTED = REGISTRY.counter('aegis_attacks_detected_total', '检测到的攻击次数', ['attack_type'])
+DB_WRITE_LATENCY = REGISTRY.histogram('aegis_db_write_seconds', '攻击记录写入数据库耗时')
+FIREWALL_LATENCY = REGISTRY.histogram('aegis_firewall_command_seconds', 'iptables 命令执行耗时')
+QUEUE_DEPTH = REGISTRY.gauge('aegis_queue_depth', '各内部队列的当前长度', ['queue'])
+
+
+def start_http_server(port: int, host: str = '127.0.0.1', registry: Registry = REGISTRY):
+    """在后台线程中启动独立的 /metrics HTTP 服务"""
+    # http.server 导入较慢，只在真正启动指标服务时导入
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 抓取请求不写访问日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    return server
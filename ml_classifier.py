@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+从 attack_records 历史训练的本地轻量分类器
+特征为哈希后的字符 n-gram (数字统一替换为 0)，模型为 NumPy 多项式朴素贝叶斯，类别为 Benign + ATTACK_TYPES_EN
+
+    - 训练数据: AI 判定的攻击记录 (analyzed_by='AI')；log_content 是当时发给 AI 的整批日志，
+      其中被判定 IP 的行标为对应攻击类型，同批其余 IP 的行视为 AI 看过但未判定的正常流量
+    - 推理: 在调用 AI 之前逐行打分，置信度达到 ML_CONFIDENCE 的攻击行在本地判定，正常行直接丢弃，
+      只有低置信度的行交给 AI
+    - 模型文件不存在时不启用；文件更新后自动重新加载
+
+用法:
+    python3 ml_classifier.py train [--db aegis_log.db] [--benign clean.log ...]
+    tail -n 100 access.log | python3 ml_classifier.py predict
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from config import (
+    ATTACK_TYPES_EN, DB_PATH, ML_MODEL_FILE, ML_CONFIDENCE, ML_HASH_DIM, ML_NGRAM_MIN, ML_NGRAM_MAX
+)
+from log_parsers import LogParser
+from metrics import REGISTRY, LINES_FILTERED
+
+ML_LINES = REGISTRY.counter('aegis_ml_lines_total', '本地分类器处理的日志行数', ['outcome'])
+ML_LATENCY = REGISTRY.histogram('aegis_ml_classify_seconds', '本地分类器每批推理耗时')
+
+LABEL_BENIGN = 'Benign'
+ANALYZED_BY_ML = 'ML'
+
+# 每行只取前 MAX_LINE_BYTES 字节提特征
+MAX_LINE_BYTES = 1024
+# 数字统一替换为 0: IP、时间戳、端口等不参与区分
+_DIGITS = bytes.maketrans(b'0123456789', b'0000000000')
+_PRIME = np.uint64(1099511628211)
+
+
+def _mix(h):
+    """splitmix64 末端混合，让低位分布均匀"""
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def ngram_features(lines, dim=ML_HASH_DIM, ngram_min=ML_NGRAM_MIN, ngram_max=ML_NGRAM_MAX):
+    """整批向量化提取哈希 n-gram
+    Returns:
+        (features, line_ids): 两个等长数组，第 i 个 n-gram 的哈希桶与所属行号
+    """
+    encoded = [line.encode('utf-8', 'surrogateescape')[:MAX_LINE_BYTES].translate(_DIGITS) for line in lines]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    buf = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    line_of = np.repeat(np.arange(len(encoded)), lengths)
+    ends = np.cumsum(lengths)[line_of]  # 每个字节所在行的结束位置
+    positions = np.arange(len(buf))
+    features = []
+    line_ids = []
+    with np.errstate(over='ignore'):
+        for n in range(ngram_min, ngram_max + 1):
+            count = len(buf) - n + 1
+            if count <= 0:
+                break
+            h = np.full(count, n, dtype=np.uint64)
+            for j in range(n):
+                h = h * _PRIME + buf[j:j + count]
+            # 跨行的 n-gram 丢弃
+            valid = positions[:count] + n <= ends[:count]
+            features.append(_mix(h[valid]) % np.uint64(dim))
+            line_ids.append(line_of[:count][valid])
+    return np.concatenate(features).astype(np.int64), np.concatenate(line_ids)
+
+
+class NGramClassifier:
+    """哈希 n-gram 多项式朴素贝叶斯"""
+
+    def __init__(self, classes, log_prior, log_prob, dim=ML_HASH_DIM, ngram_min=ML_NGRAM_MIN,
+                 ngram_max=ML_NGRAM_MAX, confidence=ML_CONFIDENCE):
+        self.classes = list(classes)
+        self.log_prior = log_prior
+        self.log_prob = log_prob    # (dim, 类别数) float32
+        self.dim = dim
+        self.ngram_min = ngram_min
+        self.ngram_max = ngram_max
+        self.confidence = confidence
+
+    @classmethod
+    def train(cls, lines, labels, dim=ML_HASH_DIM, ngram_min=ML_NGRAM_MIN, ngram_max=ML_NGRAM_MAX,
+              alpha=0.1, chunk=5000):
+        """按 (日志行, 类别) 训练；类别固定为 Benign + ATTACK_TYPES_EN，未知类别归入 Unknown"""
+        classes = [LABEL_BENIGN] + list(ATTACK_TYPES_EN)
+        index = {c: i for i, c in enumerate(classes)}
+        y = np.array([index.get(label, index['Unknown']) for label in labels], dtype=np.int64)
+        counts = np.zeros((dim, len(classes)), dtype=np.float64)
+        for start in range(0, len(lines), chunk):
+            features, line_ids = ngram_features(lines[start:start + chunk], dim, ngram_min, ngram_max)
+            np.add.at(counts, (features, y[start:start + chunk][line_ids]), 1.0)
+        class_counts = np.bincount(y, minlength=len(classes)).astype(np.float64)
+        log_prior = np.log((class_counts + 1.0) / (class_counts.sum() + len(classes)))
+        log_prob = np.log((counts + alpha) / (counts.sum(axis=0) + alpha * dim))
+        return cls(classes, log_prior, log_prob.astype(np.float32), dim, ngram_min, ngram_max)
+
+    def predict_proba(self, lines):
+        """返回 (行数, 类别数) 的后验概率"""
+        features, line_ids = ngram_features(lines, self.dim, self.ngram_min, self.ngram_max)
+        weights = self.log_prob[features]
+        scores = np.empty((len(lines), len(self.classes)))
+        for c in range(len(self.classes)):
+            scores[:, c] = np.bincount(line_ids, weights=weights[:, c], minlength=len(lines))
+        scores += self.log_prior
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def predict(self, lines):
+        """返回 [(类别, 置信度)]"""
+        if not lines:
+            return []
+        proba = self.predict_proba(lines)
+        best = proba.argmax(axis=1)
+        return [(self.classes[c], float(proba[i, c])) for i, c in enumerate(best)]
+
+    def triage(self, lines):
+        """在调用 AI 之前分流一批日志
+        Returns:
+            (verdicts, escalate): 本地判定的攻击 [{"ip", "attack_type", "analyzed_by"}] 和需要交给 AI 的行
+        """
+        from fallback import brute_force_confirmed
+
+        with ML_LATENCY.time():
+            predictions = self.predict(lines)
+        parser = LogParser()
+        ips = [None] * len(lines)
+        attack_labels = {}
+        for i, (line, (label, confidence)) in enumerate(zip(lines, predictions)):
+            record = parser.parse(line)
+            ips[i] = record.ip if record is not None else None
+            if ips[i] is not None and label != LABEL_BENIGN and confidence >= self.confidence:
+                attack_labels.setdefault(ips[i], Counter())[label] += 1
+
+        verdicts = {}
+        for ip, labels in attack_labels.items():
+            attack_type = labels.most_common(1)[0][0]
+            # 单条登录失败不足以判定爆破，交给 AI 结合上下文判断
+            if attack_type == 'Brute Force' and not brute_force_confirmed(ip):
+                continue
+            verdicts[ip] = {'ip': ip, 'attack_type': attack_type, 'analyzed_by': ANALYZED_BY_ML}
+
+        escalate = []
+        benign = 0
+        for line, ip, (label, confidence) in zip(lines, ips, predictions):
+            if ip in verdicts:
+                continue
+            if label == LABEL_BENIGN and confidence >= self.confidence:
+                benign += 1
+            else:
+                escalate.append(line)
+        ML_LINES.labels('attack').inc(len(lines) - benign - len(escalate))
+        ML_LINES.labels('escalated').inc(len(escalate))
+        if benign:
+            ML_LINES.labels('benign').inc(benign)
+            LINES_FILTERED.labels('ml_benign').inc(benign)
+        return list(verdicts.values()), escalate
+
+    def save(self, path):
+        """写入临时文件后原子替换"""
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, classes=np.array(self.classes), log_prior=self.log_prior,
+                            log_prob=self.log_prob,
+                            params=np.array([self.dim, self.ngram_min, self.ngram_max], dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, confidence=ML_CONFIDENCE):
+        with np.load(path) as data:
+            dim, ngram_min, ngram_max = (int(v) for v in data['params'])
+            return cls([str(c) for c in data['classes']], data['log_prior'], data['log_prob'],
+                       dim, ngram_min, ngram_max, confidence)
+
+
+def training_examples(db, benign_files=()):
+    """从攻击记录 (只取 AI 判定的) 和已知正常的日志文件生成 (日志行, 类别) 训练样本"""
+    batches = {}
+    for source_ip, attack_type, log_content in db.get_training_records():
+        batches.setdefault(log_content or '', {})[source_ip] = attack_type
+    lines = []
+    labels = []
+    parser = LogParser()
+    for log_content, ip_labels in batches.items():
+        for line in log_content.split('\n'):
+            record = parser.parse(line)
+            if record is None or record.ip is None:
+                continue
+            lines.append(line)
+            labels.append(ip_labels.get(record.ip, LABEL_BENIGN))
+    for path in benign_files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.strip():
+                    lines.append(line)
+                    labels.append(LABEL_BENIGN)
+    return lines, labels
+
+
+_classifier = None
+_classifier_mtime = None
+_override = False
+_classifier_lock = threading.Lock()
+
+
+def get_ml_classifier(path=ML_MODEL_FILE):
+    """进程内共享的分类器；模型文件不存在时返回 None，文件更新后重新加载"""
+    global _classifier, _classifier_mtime
+    if _override:
+        return _classifier
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if mtime != _classifier_mtime:
+        with _classifier_lock:
+            if mtime != _classifier_mtime:
+                _classifier = NGramClassifier.load(path)
+                _classifier_mtime = mtime
+    return _classifier
+
+
+def set_ml_classifier(classifier):
+    """替换共享的分类器 (测试用)；传入 None 恢复按模型文件加载"""
+    global _classifier, _classifier_mtime, _override
+    _classifier = classifier
+    _classifier_mtime = None
+    _override = classifier is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地日志分类器')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_train = sub.add_parser('train', help='从 attack_records 历史训练模型')
+    p_train.add_argument('--db', default=DB_PATH, help='SQLite 数据库')
+    p_train.add_argument('--benign', nargs='*', default=[], help='已知正常的日志文件，补充正常样本')
+    p_train.add_argument('--output', default=ML_MODEL_FILE, help='模型文件')
+    p_predict = sub.add_parser('predict', help='从标准输入读取日志行并输出类别和置信度')
+    p_predict.add_argument('--model', default=ML_MODEL_FILE, help='模型文件')
+    args = parser.parse_args()
+
+    if args.command == 'train':
+        from models import DatabaseManager
+
+        lines, labels = training_examples(DatabaseManager(args.db), args.benign)
+        if not lines:
+            print("没有可用的训练样本", file=sys.stderr)
+            return 1
+        started = time.perf_counter()
+        model = NGramClassifier.train(lines, labels)
+        model.save(args.output)
+        for label, count in sorted(Counter(labels).items(), key=lambda item: -item[1]):
+            print(f"{label}: {count}")
+        print(f"{len(lines)} 行样本，训练耗时 {time.perf_counter() - started:.2f}s，模型已写入 {args.output}")
+        return 0
+
+    model = NGramClassifier.load(args.model)
+    lines = [line.rstrip('\n') for line in sys.stdin if line.strip()]
+    for line, (label, confidence) in zip(lines, model.predict(lines)):
+        print(f"{label}\t{confidence:.4f}\t{line}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地 OpenAI 兼容桩服务 - 离线压测/测试用，无需真实 API Key
+实现 POST /v1/chat/completions (含 stream=True 的 SSE 流式响应)，按规则判定日志行并返回
+{"attack_ips": [...]} (初筛提示词返回 {"attack": "yes"|"no", "ips": [...]})，
+可配置响应延迟、抖动、失败率、判定模式和流式输出速度
+
+用法:
+    python3 mock_ai_server.py --port 8089 --latency 0.2 --jitter 0.05
+    (启动后打印 "MOCK_AI_URL=http://127.0.0.1:8089/v1")
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IP_RE = re.compile(r'\b(\d{1,3}(?:\.\d{1,3}){3})\b')
+
+# 判定规则: 与 synthetic_logs 中的攻击模板对应
+VERDICT_RULES = [
+    (re.compile(r"(?i)union(\s|%20)+select|'(\s|%20)*or(\s|%20)+1=1"), 'SQL Injection'),
+    (re.compile(r'(?i)<script|%3Cscript|javascript:'), 'XSS'),
+    (re.compile(r'(?i)wp-admin|phpmyadmin|/\.env|/\.git/'), 'Scanning'),
+    (re.compile(r'(?i)"POST /login[^"]*" 401|Failed password'), 'Brute Force'),
+    (re.compile(r'(?i)sqlmap|nikto|masscan'), 'Malicious Crawler'),
+]
+
+
+def judge_lines(text, mode='rules'):
+    """按判定模式返回 [{"ip", "attack_type"}]
+    mode: rules 按规则判定; none 全部判为正常; all 每个出现的 IP 都判为攻击
+    """
+    verdicts = {}
+    for line in text.splitlines():
+        m = IP_RE.search(line)
+        if not m:
+            continue
+        ip = m.group(1)
+        if mode == 'all':
+            verdicts.setdefault(ip, 'Unknown')
+        elif mode == 'rules':
+            for pattern, attack_type in VERDICT_RULES:
+                if pattern.search(line):
+                    verdicts.setdefault(ip, attack_type)
+                    break
+    return [{'ip': ip, 'attack_type': t} for ip, t in verdicts.items()]
+
+
+class MockAIServer:
+    """可在测试进程内启动的桩服务"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 fail_rate=0.0, mode='rules', seed=0, chunk_chars=16, chunk_delay=0.0, content=None):
+        self.latency = latency
+        self.content = content           # 固定返回的响应内容 (测试异常响应用)，None 时按 mode 判定
+        self.chunk_chars = chunk_chars   # 流式响应每个增量的字符数
+        self.chunk_delay = chunk_delay   # 流式响应每个增量之间的间隔(秒)，模拟生成速度
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.mode = mode
+        self.requests = 0
+        self.requests_by_model = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 头部和正文分两次写出，不关闭 Nagle 会叠加客户端的延迟 ACK (约 40ms)
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    self._send(404, {'error': {'message': 'not found'}})
+                    return
+                status, payload = server.complete(body)
+                if status == 200 and body.get('stream'):
+                    self._send_stream(server.stream_events(body, payload))
+                    return
+                if status == 200 and server.chunk_delay:
+                    # 非流式响应同样要等全部内容生成完毕
+                    content = payload['choices'][0]['message']['content']
+                    time.sleep(server.chunk_delay * -(-len(content) // server.chunk_chars))
+                self._send(status, payload)
+
+            def _send_stream(self, events):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for event, delay in events:
+                    if delay:
+                        time.sleep(delay)
+                    data = f"data: {event}\n\n".encode('utf-8')
+                    self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _send(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def complete(self, body):
+        """处理一次 chat.completions 请求，返回 (状态码, 响应体)"""
+        with self._lock:
+            self.requests += 1
+            model = body.get('model', 'mock')
+            self.requests_by_model[model] = self.requests_by_model.get(model, 0) + 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            fail = self._rng.random() < self.fail_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return 503, {'error': {'message': 'mock overloaded', 'type': 'server_error'}}
+
+        messages = body.get('messages', [])
+        user_text = '\n'.join(m.get('content', '') for m in messages if m.get('role') == 'user')
+        prompt_text = '\n'.join(m.get('content', '') for m in messages)
+        verdicts = judge_lines(user_text, self.mode)
+        if self.content is not None:
+            content = self.content
+        elif '"attack":' in prompt_text:
+            # 初筛提示词: 只回答是否存在攻击和可疑 IP
+            content = json.dumps({'attack': 'yes' if verdicts else 'no', 'ips': [v['ip'] for v in verdicts]})
+        else:
+            content = json.dumps({'attack_ips': verdicts}, ensure_ascii=False)
+
+        # 粗略按 4 字符 1 token 估算
+        prompt_tokens = len(prompt_text) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return 200, self.response_payload(body, content, prompt_tokens, completion_tokens)
+
+    def response_payload(self, body, content, prompt_tokens, completion_tokens):
+        """按 chat.completion 格式包装响应内容，并累计 token 数"""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        return {
+            'id': f'chatcmpl-mock-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }
+
+    def stream_events(self, body, payload):
+        """把完整响应拆成 chat.completion.chunk 事件，生成 (事件 JSON, 发送前等待秒数)"""
+        content = payload['choices'][0]['message']['content']
+        base = {'id': payload['id'], 'object': 'chat.completion.chunk',
+                'created': payload['created'], 'model': payload['model']}
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps(dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]),
+                              ensure_ascii=False)
+
+        yield chunk({'role': 'assistant', 'content': ''}), 0.0
+        for i in range(0, len(content), self.chunk_chars):
+            yield chunk({'content': content[i:i + self.chunk_chars]}), self.chunk_delay
+        yield chunk({}, 'stop'), 0.0
+        if (body.get('stream_options') or {}).get('include_usage'):
+            yield json.dumps(dict(base, choices=[], usage=payload['usage'])), 0.0
+        yield '[DONE]', 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-ai', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089, help='监听端口 (0 表示随机端口)')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次响应的固定延迟(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟的随机抖动(秒)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='返回 503 的比例')
+    parser.add_argument('--mode', choices=['rules', 'none', 'all'], default='rules', help='判定模式')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='流式响应每个增量之间的间隔(秒)')
+    args = parser.parse_args()
+
+    server = MockAIServer(args.host, args.port, args.latency, args.jitter, args.fail_rate, args.mode,
+                          chunk_delay=args.chunk_delay)
+    server.start()
+    print(f"MOCK_AI_URL={server.base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
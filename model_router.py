@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI 模型分级路由
+每批日志先交给廉价快速的初筛模型 (AI_TRIAGE_MODEL，短输出提示词只回答是否存在攻击)，
+只有阳性或不确定的批次才交给完整模型 (AI_MODEL) 分类攻击类型；
+大部分正常流量只消耗初筛的少量输出 token
+
+每一级的请求数/结果、耗时和 token 分别计入 aegis_ai_tier_* 指标，用于对比初筛节省的成本
+"""
+
+import json
+import re
+
+from config import AI_TRIAGE_MODEL, AI_TRIAGE_MAX_TOKENS, AI_TRIAGE_PROMPT
+from logger import AegisLogger
+from metrics import REGISTRY, LINES_FILTERED
+
+logger = AegisLogger()
+
+TIER_TRIAGE = 'triage'
+TIER_FULL = 'full'
+
+# 初筛结果
+TRIAGE_POSITIVE = 'positive'
+TRIAGE_NEGATIVE = 'negative'
+TRIAGE_UNCERTAIN = 'uncertain'
+TRIAGE_ERROR = 'error'
+
+TIER_REQUESTS = REGISTRY.counter('aegis_ai_tier_requests_total', '各级模型的请求数 (按结果)', ['tier', 'outcome'])
+TIER_LATENCY = REGISTRY.histogram('aegis_ai_tier_seconds', '各级模型的请求耗时', ['tier'])
+TIER_TOKENS = REGISTRY.counter('aegis_ai_tier_tokens_total', '各级模型消耗的 token 数', ['tier', 'kind'])
+
+_ANSWERS = {
+    'yes': TRIAGE_POSITIVE, 'true': TRIAGE_POSITIVE,
+    'no': TRIAGE_NEGATIVE, 'false': TRIAGE_NEGATIVE,
+}
+
+
+def record_tier_usage(tier, usage):
+    if usage is not None:
+        TIER_TOKENS.labels(tier, 'prompt').inc(usage.prompt_tokens or 0)
+        TIER_TOKENS.labels(tier, 'completion').inc(usage.completion_tokens or 0)
+
+
+def parse_triage_response(content):
+    """解析初筛响应 {"attack": "yes"|"no"|"unsure", "ips": [...]}
+    Returns:
+        (str, list): 初筛结果和可疑 IP; 无法解析时视为不确定
+    """
+    match = re.search(r'\{.*\}', content or '', re.DOTALL)
+    try:
+        result = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        result = None
+    if not isinstance(result, dict):
+        return TRIAGE_UNCERTAIN, []
+    answer = str(result.get('attack', '')).strip().lower()
+    ips = [ip for ip in result.get('ips') or [] if isinstance(ip, str)]
+    outcome = _ANSWERS.get(answer, TRIAGE_UNCERTAIN)
+    if outcome == TRIAGE_NEGATIVE and ips:
+        # 回答没有攻击却列出了可疑 IP，按不确定处理
+        outcome = TRIAGE_UNCERTAIN
+    return outcome, ips
+
+
+def triage(client, lines, model=None, max_tokens=AI_TRIAGE_MAX_TOKENS):
+    """用初筛模型判断一批日志是否存在攻击, 返回 (初筛结果, 可疑 IP)
+    调用失败时返回 TRIAGE_ERROR, 由调用方交给完整模型 (失败不计入熔断器)
+    """
+    try:
+        with TIER_LATENCY.labels(TIER_TRIAGE).time():
+            response = client.chat.completions.create(
+                model=model or AI_TRIAGE_MODEL,
+                messages=[
+                    {"role": "system", "content": AI_TRIAGE_PROMPT},
+                    {"role": "user", "content": "\n".join(lines)}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0,
+                max_tokens=max_tokens
+            )
+    except Exception as e:
+        logger.warning(f"初筛模型调用失败, 直接交给完整模型: {e}")
+        TIER_REQUESTS.labels(TIER_TRIAGE, TRIAGE_ERROR).inc()
+        return TRIAGE_ERROR, []
+    record_tier_usage(TIER_TRIAGE, getattr(response, 'usage', None))
+    outcome, ips = parse_triage_response(response.choices[0].message.content)
+    TIER_REQUESTS.labels(TIER_TRIAGE, outcome).inc()
+    return outcome, ips
+
+
+def needs_full_model(client, lines):
+    """初筛开启时判断这批日志是否需要完整模型分类; 初筛为阴性的批次直接判为正常"""
+    if not AI_TRIAGE_MODEL:
+        return True
+    outcome, _ = triage(client, lines)
+    if outcome == TRIAGE_NEGATIVE:
+        LINES_FILTERED.labels('triage_negative').inc(len(lines))
+        return False
+    return True
@@ -1,8 +1,26 @@
+import os
 import sqlite3
 import json
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Any
-from config import DB_PATH
+from config import DB_PATH, EXPORT_CHUNK_SIZE
+
+def _snippet(content: str, query: str, context: int = 80) -> str:
+    """截取 content 中第一处命中 query 的位置附近的文字，命中部分用 «» 标出"""
+    pos = content.lower().find(query.lower())
+    if pos < 0:
+        return content[:2 * context]
+    start, end = max(0, pos - context), pos + len(query)
+    return ('…' if start else '') + content[start:pos] + '«' + content[pos:end] + '»' + \
+        content[end:end + context] + ('…' if end + context < len(content) else '')
+
+def _lookup_geo(ip: str):
+    """查询离线 GeoIP 库 (延迟导入，未生成库文件时返回 None)"""
+    from geoip import lookup_ip
+    return lookup_ip(ip)
 
 class DatabaseManager:
     def __init__(self, db_path: str = DB_PATH):
@@ -24,18 +42,20 @@ class DatabaseManager:
                     log_content TEXT,
                     severity INTEGER DEFAULT 1,
                     is_blocked BOOLEAN DEFAULT FALSE,
-                    block_timestamp DATETIME,
+                    block_timestamp DATETIME,  -- UTC
                     analyzed_by TEXT DEFAULT 'AI'
                 )
             ''')
+            # 状态采样每次统计最近 1 小时的攻击数，按时间过滤不能全表扫描
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_attack_records_timestamp ON attack_records (timestamp)')
             
             # 创建封禁IP表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS blocked_ips (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     ip_address TEXT UNIQUE NOT NULL,
-                    first_detected DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    last_detected DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    first_detected DATETIME DEFAULT CURRENT_TIMESTAMP,  -- UTC
+                    last_detected DATETIME DEFAULT CURRENT_TIMESTAMP,   -- UTC，导出按该列过滤时间
                     attack_count INTEGER DEFAULT 1,
                     attack_types TEXT,  -- JSON数组存储攻击类型
                     is_active BOOLEAN DEFAULT TRUE,
@@ -66,75 +86,168 @@ class DatabaseManager:
                     cpu_usage REAL
                 )
             ''')
-            
+            self._migrate_blocked_ips(cursor)
+            self._migrate_system_status(cursor)
+            self.fts_enabled = self._init_search_index(cursor)
+
             conn.commit()
+
+    def _init_search_index(self, cursor) -> bool:
+        """创建 log_content 的 FTS5 全文索引 (外部内容表，由触发器与 attack_records 同步)
+        trigram 分词支持任意子串匹配 (路径、User-Agent、payload)；旧数据库首次创建索引时回填已有记录。
+        SQLite 不支持 FTS5/trigram (3.34 之前) 时返回 False，搜索退化为 LIKE 扫描
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attack_records_fts'")
+        if cursor.fetchone():
+            return True
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE attack_records_fts USING fts5(
+                    log_content, content='attack_records', content_rowid='id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+        cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS attack_records_fts_insert AFTER INSERT ON attack_records BEGIN
+                INSERT INTO attack_records_fts (rowid, log_content) VALUES (new.id, new.log_content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS attack_records_fts_delete AFTER DELETE ON attack_records BEGIN
+                INSERT INTO attack_records_fts (attack_records_fts, rowid, log_content)
+                VALUES ('delete', old.id, old.log_content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS attack_records_fts_update AFTER UPDATE OF log_content ON attack_records BEGIN
+                INSERT INTO attack_records_fts (attack_records_fts, rowid, log_content)
+                VALUES ('delete', old.id, old.log_content);
+                INSERT INTO attack_records_fts (rowid, log_content) VALUES (new.id, new.log_content);
+            END;
+        ''')
+        # 回填索引创建之前写入的记录
+        cursor.execute("INSERT INTO attack_records_fts (attack_records_fts) VALUES ('rebuild')")
+        return True
+
+    # system_status 后来增加的列: 旧数据库启动时补齐
+    SYSTEM_STATUS_COLUMNS = {
+        'resolution': "TEXT DEFAULT 'raw'",   # raw / minute / hour
+        'lines_per_sec': 'REAL',
+        'queue_depths': 'TEXT',               # JSON: {队列名: 长度}
+        'started_at': 'REAL',                 # 分析进程启动时间 (unix 时间戳)
+    }
+
+    # blocked_ips 后来增加的列 (geoip.py 离线查询)
+    BLOCKED_IPS_COLUMNS = {
+        'country': 'TEXT',                    # ISO 国家代码
+        'asn': 'INTEGER',
+        'as_org': 'TEXT',
+    }
+
+    @staticmethod
+    def _add_columns(cursor, table: str, columns: Dict[str, str]):
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, definition in columns.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    def _migrate_blocked_ips(self, cursor):
+        self._add_columns(cursor, 'blocked_ips', self.BLOCKED_IPS_COLUMNS)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_blocked_ips_asn ON blocked_ips (asn)')
+
+    def _migrate_system_status(self, cursor):
+        self._add_columns(cursor, 'system_status', self.SYSTEM_STATUS_COLUMNS)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_system_status_resolution
+            ON system_status (resolution, timestamp)
+        ''')
     
     def add_attack_record(self, source_ip: str, attack_type: str, log_content: str, 
-                         severity: int = 1, is_blocked: bool = False) -> int:
-        """添加攻击记录"""
+                         severity: int = 1, is_blocked: bool = False, analyzed_by: str = 'AI') -> int:
+        """添加攻击记录
+        analyzed_by: 判定来源 AI / anomaly (速率异常检测) / signature (降级特征签名) / ML (本地分类器)
+        """
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO attack_records 
-                (source_ip, attack_type, log_content, severity, is_blocked, block_timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (source_ip, attack_type, log_content, severity, is_blocked, 
-                  datetime.now() if is_blocked else None))
+                (source_ip, attack_type, log_content, severity, is_blocked, block_timestamp, analyzed_by)
+                VALUES (?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END, ?)
+            ''', (source_ip, attack_type, log_content, severity, is_blocked, is_blocked, analyzed_by))
             
             record_id = cursor.lastrowid
             
-            # 更新攻击类型统计
-            self._update_attack_statistics(attack_type)
+            # 更新攻击类型统计 (与插入共用同一事务，避免嵌套连接互相等待写锁)
+            self._update_attack_statistics(cursor, attack_type)
             
             # 更新封禁IP信息
             if is_blocked:
-                self._update_blocked_ip(source_ip, attack_type)
+                self._update_blocked_ip(cursor, source_ip, attack_type)
             
             conn.commit()
             return record_id
     
-    def _update_attack_statistics(self, attack_type: str):
+    def _update_attack_statistics(self, cursor, attack_type: str):
         """更新攻击类型统计"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            today = datetime.now().date().isoformat()
+        today = datetime.now().date().isoformat()
+        
+        cursor.execute('''
+            INSERT INTO attack_statistics (date, attack_type, count)
+            VALUES (?, ?, 1)
+            ON CONFLICT(date, attack_type) 
+            DO UPDATE SET count = count + 1
+        ''', (today, attack_type))
+    
+    def _update_blocked_ip(self, cursor, ip_address: str, attack_type: str):
+        """更新封禁IP信息 (新 IP 或尚未记录 ASN 时查询离线 GeoIP 库)"""
+        # 检查IP是否已存在
+        cursor.execute('SELECT attack_types, asn FROM blocked_ips WHERE ip_address = ?', (ip_address,))
+        existing = cursor.fetchone()
+        geo = _lookup_geo(ip_address) if existing is None or existing[1] is None else None
+
+        if existing:
+            # 更新现有记录 (与新记录的默认值一致, last_detected 使用 UTC 的 CURRENT_TIMESTAMP)
+            attack_types = json.loads(existing[0] or '[]')
+            if attack_type not in attack_types:
+                attack_types.append(attack_type)
             
             cursor.execute('''
-                INSERT INTO attack_statistics (date, attack_type, count)
-                VALUES (?, ?, 1)
-                ON CONFLICT(date, attack_type) 
-                DO UPDATE SET count = count + 1
-            ''', (today, attack_type))
-    
-    def _update_blocked_ip(self, ip_address: str, attack_type: str):
-        """更新封禁IP信息"""
+                UPDATE blocked_ips 
+                SET last_detected = CURRENT_TIMESTAMP, attack_count = attack_count + 1, 
+                    attack_types = ?, is_active = TRUE
+                WHERE ip_address = ?
+            ''', (json.dumps(attack_types), ip_address))
+        else:
+            # 插入新记录
+            cursor.execute('''
+                INSERT INTO blocked_ips 
+                (ip_address, attack_types, block_reason)
+                VALUES (?, ?, ?)
+            ''', (ip_address, json.dumps([attack_type]), f'Detected {attack_type} attack'))
+        if geo:
+            self._set_geo(cursor, ip_address, geo)
+
+    @staticmethod
+    def _set_geo(cursor, ip_address: str, geo: Dict[str, Any]):
+        cursor.execute('''
+            UPDATE blocked_ips SET country = ?, asn = ?, as_org = ? WHERE ip_address = ?
+        ''', (geo.get('country'), geo.get('asn'), geo.get('as_org'), ip_address))
+
+    def enrich_blocked_ips(self, lookup=None) -> int:
+        """为尚未记录国家/ASN 的封禁 IP 补齐信息 (例如 GeoIP 库文件生成之前封禁的)，返回补齐的条数
+        lookup: ip -> {'country', 'asn', 'as_org'} 或 None，默认使用 geoip.lookup_ip
+        """
+        lookup = lookup or _lookup_geo
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            
-            # 检查IP是否已存在
-            cursor.execute('SELECT * FROM blocked_ips WHERE ip_address = ?', (ip_address,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # 更新现有记录
-                attack_types = json.loads(existing[5] or '[]')
-                if attack_type not in attack_types:
-                    attack_types.append(attack_type)
-                
-                cursor.execute('''
-                    UPDATE blocked_ips 
-                    SET last_detected = ?, attack_count = attack_count + 1, 
-                        attack_types = ?, is_active = TRUE
-                    WHERE ip_address = ?
-                ''', (datetime.now(), json.dumps(attack_types), ip_address))
-            else:
-                # 插入新记录
-                cursor.execute('''
-                    INSERT INTO blocked_ips 
-                    (ip_address, attack_types, block_reason)
-                    VALUES (?, ?, ?)
-                ''', (ip_address, json.dumps([attack_type]), f'Detected {attack_type} attack'))
-    
+            cursor.execute('SELECT ip_address FROM blocked_ips WHERE asn IS NULL AND country IS NULL')
+            enriched = 0
+            for (ip_address,) in cursor.fetchall():
+                geo = lookup(ip_address)
+                if geo:
+                    self._set_geo(cursor, ip_address, geo)
+                    enriched += 1
+            conn.commit()
+            return enriched
+
     def get_attack_statistics(self, days: int = 7) -> Dict:
         """获取攻击统计数据"""
         with sqlite3.connect(self.db_path) as conn:
@@ -208,8 +321,13 @@ class DatabaseManager:
             
             return result
     
-    def update_system_status(self, memory_usage: float = None, cpu_usage: float = None):
-        """更新系统状态"""
+    def update_system_status(self, memory_usage: float = None, cpu_usage: float = None,
+                             lines_per_sec: float = None, queue_depths: Dict[str, float] = None,
+                             started_at: float = None, timestamp: float = None):
+        """更新系统状态 (写入一条原始样本)
+        memory_usage: 分析进程 RSS (MB); cpu_usage: CPU 占用 (%, 单核满载为 100)
+        timestamp: 样本时间 (unix 时间戳)，默认为当前时间
+        """
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             
@@ -227,13 +345,184 @@ class DatabaseManager:
             active_attacks = cursor.fetchone()[0]
             
             cursor.execute('''
-                INSERT INTO system_status 
-                (total_attacks, blocked_ips_count, active_attacks, memory_usage, cpu_usage)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (total_attacks, blocked_ips_count, active_attacks, memory_usage, cpu_usage))
-            
+                INSERT INTO system_status
+                (timestamp, total_attacks, blocked_ips_count, active_attacks, memory_usage, cpu_usage,
+                 resolution, lines_per_sec, queue_depths, started_at)
+                VALUES (COALESCE(datetime(?, 'unixepoch'), CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, 'raw', ?, ?, ?)
+            ''', (timestamp, total_attacks, blocked_ips_count, active_attacks, memory_usage, cpu_usage,
+                  lines_per_sec, json.dumps(queue_depths) if queue_depths is not None else None, started_at))
+
+            conn.commit()
+
+    def downsample_system_status(self, source: str, target: str, bucket_format: str, older_than: float) -> int:
+        """把早于 older_than (unix 时间戳) 的 source 样本按时间桶合并为 target 样本
+        bucket_format: strftime 格式，如 '%Y-%m-%d %H:%M:00' 按分钟合并；
+        只合并完整的时间桶，数值取平均，累计值和队列长度取最大值。返回合并出的样本数
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT strftime(?, datetime(?, 'unixepoch'))", (bucket_format, older_than))
+            cutoff = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT strftime(?, timestamp), total_attacks, blocked_ips_count, active_attacks,
+                       memory_usage, cpu_usage, lines_per_sec, queue_depths, started_at
+                FROM system_status
+                WHERE resolution = ? AND timestamp < ?
+                ORDER BY timestamp
+            ''', (bucket_format, source, cutoff))
+            buckets = {}
+            for row in cursor.fetchall():
+                buckets.setdefault(row[0], []).append(row[1:])
+            if not buckets:
+                return 0
+
+            def mean(values):
+                values = [v for v in values if v is not None]
+                return sum(values) / len(values) if values else None
+
+            def peak(values):
+                values = [v for v in values if v is not None]
+                return max(values) if values else None
+
+            merged = []
+            for bucket, rows in buckets.items():
+                columns = list(zip(*rows))
+                depths = {}
+                for raw in columns[6]:
+                    for name, depth in json.loads(raw or '{}').items():
+                        depths[name] = max(depths.get(name, 0), depth)
+                merged.append((
+                    bucket, peak(columns[0]), peak(columns[1]), peak(columns[2]),
+                    mean(columns[3]), mean(columns[4]), mean(columns[5]),
+                    json.dumps(depths) if depths else None, peak(columns[7]), target
+                ))
+            cursor.executemany('''
+                INSERT INTO system_status
+                (timestamp, total_attacks, blocked_ips_count, active_attacks, memory_usage, cpu_usage,
+                 lines_per_sec, queue_depths, started_at, resolution)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', merged)
+            cursor.execute('DELETE FROM system_status WHERE resolution = ? AND timestamp < ?', (source, cutoff))
             conn.commit()
+            return len(merged)
+
+    def purge_system_status(self, resolution: str, older_than: float) -> int:
+        """删除早于 older_than (unix 时间戳) 的某一精度样本, 返回删除数"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM system_status WHERE resolution = ? AND timestamp < datetime(?, 'unixepoch')
+            ''', (resolution, older_than))
+            conn.commit()
+            return cursor.rowcount
+
+    def get_system_trends(self, seconds: float, now: float = None) -> List[Dict[str, Any]]:
+        """返回最近 seconds 秒内的资源样本, 按时间升序
+        降采样后各精度的样本覆盖互不重叠的时间段, 越早的样本越稀疏
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT timestamp, resolution, memory_usage, cpu_usage, lines_per_sec, queue_depths,
+                       total_attacks, blocked_ips_count, active_attacks
+                FROM system_status
+                WHERE timestamp >= datetime(COALESCE(?, strftime('%s', 'now')) - ?, 'unixepoch')
+                ORDER BY timestamp
+            ''', (now, seconds))
+            samples = []
+            for row in cursor.fetchall():
+                sample = dict(row)
+                sample['queue_depths'] = json.loads(sample['queue_depths'] or '{}')
+                samples.append(sample)
+            return samples
+
+    def get_latest_system_status(self) -> Dict[str, Any]:
+        """返回最新的一条原始样本, 没有样本时返回空字典"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT timestamp, memory_usage, cpu_usage, lines_per_sec, started_at
+                FROM system_status WHERE resolution = 'raw'
+                ORDER BY timestamp DESC, id DESC LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            return dict(row) if row else {}
     
+    def search_attack_records(self, query: str, limit: int = 20, offset: int = 0, sort: str = 'rank',
+                              before_id: int = None, attack_type: str = None,
+                              source_ip: str = None) -> List[Dict[str, Any]]:
+        """在攻击记录的 log_content 中搜索包含 query 子串的记录 (不区分大小写)
+        sort: rank 按 bm25 相关度排序 (offset 分页)；recent 按记录从新到旧 (before_id 键集分页，也可用 offset)。
+        bm25 需要对全部命中记录打分，非常常见的子串在大库上较慢；recent 只读取一页，耗时与库大小无关。
+        少于 3 个字符的查询或不支持 FTS5 时退化为 LIKE 扫描，按从新到旧返回
+        """
+        filters, params = '', []
+        if attack_type:
+            filters += ' AND r.attack_type = ?'
+            params.append(attack_type)
+        if source_ip:
+            filters += ' AND r.source_ip = ?'
+            params.append(source_ip)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            if self.fts_enabled and len(query) >= 3:
+                if before_id is not None:
+                    # 约束写在 FTS 表的 rowid 上, FTS5 可以直接从该位置开始扫描
+                    filters += ' AND attack_records_fts.rowid < ?'
+                    params.append(before_id)
+                # 整个查询作为一个短语，即按字面子串匹配
+                phrase = '"' + query.replace('"', '""') + '"'
+                if sort == 'recent':
+                    order, score = 'attack_records_fts.rowid DESC', 'NULL'
+                else:
+                    order, score = 'score', 'bm25(attack_records_fts)'
+                cursor.execute(f'''
+                    SELECT attack_records_fts.rowid, {score} AS score
+                    FROM attack_records_fts
+                    JOIN attack_records r ON r.id = attack_records_fts.rowid
+                    WHERE attack_records_fts MATCH ?{filters}
+                    ORDER BY {order}
+                    LIMIT ? OFFSET ?
+                ''', [phrase] + params + [limit, offset])
+            else:
+                if before_id is not None:
+                    filters += ' AND r.id < ?'
+                    params.append(before_id)
+                pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                cursor.execute(f'''
+                    SELECT r.id, NULL AS score
+                    FROM attack_records r
+                    WHERE r.log_content LIKE ? ESCAPE '\\'{filters}
+                    ORDER BY r.id DESC
+                    LIMIT ? OFFSET ?
+                ''', [pattern] + params + [limit, offset])
+            hits = cursor.fetchall()
+            if not hits:
+                return []
+
+            # 只为当前页读取记录内容并截取片段 (在 SQL 中排序前调用 snippet() 会对全部命中记录计算)
+            cursor.execute(f'''
+                SELECT id, timestamp, source_ip, attack_type, severity, analyzed_by, log_content
+                FROM attack_records WHERE id IN ({','.join('?' * len(hits))})
+            ''', [record_id for record_id, _ in hits])
+            rows = {row[0]: row for row in cursor.fetchall()}
+            results = []
+            for record_id, score in hits:
+                row = rows[record_id]
+                results.append({
+                    'id': row[0],
+                    'timestamp': row[1],
+                    'source_ip': row[2],
+                    'attack_type': row[3],
+                    'severity': row[4],
+                    'analyzed_by': row[5],
+                    'snippet': _snippet(row[6] or '', query),
+                    'score': score
+                })
+            return results
+
     def get_attack_type_statistics(self) -> Dict[str, int]:
         """获取攻击类型统计"""
         with sqlite3.connect(self.db_path) as conn:
@@ -279,13 +568,13 @@ class DatabaseManager:
             
             cursor.execute('''
                 SELECT ip_address, first_detected, last_detected,
-                       attack_count, attack_types, block_reason
+                       attack_count, attack_types, block_reason, country, asn, as_org
                 FROM blocked_ips
                 WHERE is_active = TRUE
                 ORDER BY last_detected DESC
                 LIMIT ?
             ''', (limit,))
-            
+
             return [
                 {
                     'ip_address': row[0],
@@ -293,10 +582,111 @@ class DatabaseManager:
                     'last_detected': row[2],
                     'attack_count': row[3],
                     'attack_types': json.loads(row[4]) if row[4] else [],
-                    'block_reason': row[5]
+                    'block_reason': row[5],
+                    'country': row[6],
+                    'asn': row[7],
+                    'as_org': row[8]
+                }
+                for row in cursor.fetchall()
+            ]
+
+    def get_active_blocked_ips(self) -> Dict[str, str]:
+        """全部处于封禁状态的 IP -> 最近一次记录的攻击类型 (collector 启动时恢复黑名单用)"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT ip_address, attack_types FROM blocked_ips WHERE is_active = TRUE')
+            return {
+                ip: (json.loads(types or '[]') or ['Unknown'])[-1]
+                for ip, types in cursor.fetchall()
+            }
+
+    def get_asn_statistics(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """按 ASN 汇总处于封禁状态的 IP (IP 数、攻击次数、涉及国家)，按 IP 数降序"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT asn, MAX(as_org), COUNT(*) AS ip_count, SUM(attack_count),
+                       GROUP_CONCAT(DISTINCT country)
+                FROM blocked_ips
+                WHERE is_active = TRUE AND asn IS NOT NULL
+                GROUP BY asn
+                ORDER BY ip_count DESC, asn
+                LIMIT ?
+            ''', (limit,))
+            return [
+                {
+                    'asn': row[0],
+                    'as_org': row[1],
+                    'ip_count': row[2],
+                    'attack_count': row[3] or 0,
+                    'countries': sorted(row[4].split(',')) if row[4] else []
                 }
                 for row in cursor.fetchall()
             ]
+
+    # 可导出的表: 名称 -> (表名, 时间过滤使用的列, 导出的列, 允许过滤的列)
+    EXPORT_TABLES = {
+        'attacks': ('attack_records', 'timestamp',
+                    ('id', 'timestamp', 'source_ip', 'attack_type', 'severity', 'is_blocked',
+                     'block_timestamp', 'analyzed_by', 'log_content'),
+                    ('attack_type', 'source_ip', 'analyzed_by')),
+        'blocked_ips': ('blocked_ips', 'last_detected',
+                        ('id', 'ip_address', 'first_detected', 'last_detected', 'attack_count', 'attack_types',
+                         'is_active', 'block_reason', 'country', 'asn', 'as_org'),
+                        ('ip_address', 'country', 'asn')),
+    }
+
+    def export_rows(self, name: str, since: str = None, until: str = None, after_id: int = None,
+                    filters: Dict[str, Any] = None, chunk_size: int = EXPORT_CHUNK_SIZE):
+        """按 id 升序逐块读取一张表的全部行 (生成器，每行一个字典)
+        每块是一个独立的短查询 (id > 上一块最后的 id)，不会长时间持有读锁阻塞分析进程写入，
+        内存占用只与 chunk_size 有关
+        since/until: 与库中存储的时间字符串比较 ('YYYY-MM-DD HH:MM:SS')，包含 since，不包含 until
+        after_id: 只导出 id 大于它的行 (从上次中断处继续)
+        """
+        table, time_column, columns, filterable = self.EXPORT_TABLES[name]
+        where, params = ['id > ?'], []
+        if since:
+            where.append(f'{time_column} >= ?')
+            params.append(since)
+        if until:
+            where.append(f'{time_column} < ?')
+            params.append(until)
+        for column, value in (filters or {}).items():
+            if column not in filterable:
+                raise ValueError(f"{name} 不支持按 {column} 过滤")
+            where.append(f'{column} = ?')
+            params.append(value)
+        sql = f'''
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE {' AND '.join(where)}
+            ORDER BY id
+            LIMIT ?
+        '''
+        last_id = after_id or 0
+        while True:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute(sql, [last_id] + params + [chunk_size]).fetchall()
+            finally:
+                conn.close()
+            for row in rows:
+                yield dict(zip(columns, row))
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    def get_training_records(self, analyzed_by: str = 'AI') -> List[tuple]:
+        """获取某一判定来源的全部攻击记录 (source_ip, attack_type, log_content)，供本地分类器训练"""
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT source_ip, attack_type, log_content
+                FROM attack_records
+                WHERE analyzed_by = ?
+                ORDER BY id
+            ''', (analyzed_by,))
+            return cursor.fetchall()
     
     def get_total_attacks(self) -> int:
         """获取总攻击次数"""
@@ -322,5 +712,42 @@ class DatabaseManager:
             cursor.execute('SELECT COUNT(*) FROM blocked_ips WHERE is_active = TRUE')
             return cursor.fetchone()[0]
 
-# 单例模式
-db_manager = DatabaseManager()
\ No newline at end of file
+# 单例模式: 首次使用时才创建，导入 models 不会触碰数据库文件
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+def get_db_manager() -> DatabaseManager:
+    """获取全局 DatabaseManager 单例"""
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager()
+    return _db_manager
+
+def set_db_manager(manager: DatabaseManager):
+    """替换全局 DatabaseManager (测试/压测时指向临时数据库)"""
+    global _db_manager
+    _db_manager = manager
+
+@contextmanager
+def temporary_db_manager(db_path: str = None):
+    """临时把全局 DatabaseManager 换成 db_path 上的新实例 (测试/压测/评估用)，退出时恢复原实例
+    直接保存 _db_manager 而不调用 get_db_manager()，不会因此创建并迁移默认的 DB_PATH
+    Args:
+        db_path: 数据库文件；默认在临时目录中新建，退出时删除
+    """
+    global _db_manager
+    previous = _db_manager
+    with tempfile.TemporaryDirectory() as tmp:
+        _db_manager = DatabaseManager(db_path or os.path.join(tmp, 'test.db'))
+        try:
+            yield _db_manager
+        finally:
+            _db_manager = previous
+
+def __getattr__(name):
+    # 兼容旧代码中的 `from models import db_manager`
+    if name == 'db_manager':
+        return get_db_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
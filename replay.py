@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+历史日志回放 / 回填
+事后分析已轮转的日志: 以最快速度把普通文本 (mmap)、.gz、.bz2 文件送入与实时监控相同的流水线
+(解析 -> IP 统计/异常检测 -> AI -> 写库 -> 封禁)，多个文件由多个进程并行读取
+
+    - 进度与吞吐定期输出
+    - 已处理完成 (AI 分析并落库) 的位置写入检查点，中断后重新运行会从检查点继续
+
+用法:
+    python3 replay.py /var/log/nginx/access.log.1 /var/log/nginx/access.log.*.gz --dry-run-firewall
+    python3 replay.py --reset ...     # 忽略已有检查点从头回放
+"""
+
+import argparse
+import bz2
+import glob
+import gzip
+import json
+import mmap
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import (
+    BATCH_SIZE, AI_CONCURRENCY, SHARD_QUEUE_SIZE, ANOMALY_GATE_AI,
+    REPLAY_CHECKPOINT_FILE, REPLAY_CHECKPOINT_INTERVAL, REPLAY_PROGRESS_INTERVAL
+)
+from log_parsers import LogParser
+from logger import AegisLogger
+from metrics import LINES_READ, LINES_FILTERED
+
+logger = AegisLogger()
+
+
+class _RawPosition:
+    """记录压缩文件底层读取位置，用于估算进度"""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def tell(self):
+        try:
+            return self.raw.tell()
+        except (OSError, ValueError):
+            return 0
+
+
+def iter_file_lines(path, start_offset=0):
+    """从 start_offset 开始逐行读取 (普通文件用 mmap，.gz/.bz2 流式解压)
+    偏移量是解压后内容中的字节位置，可直接作为检查点
+    Yields:
+        (下一行的起始偏移, 去掉换行符的行, 已读取的磁盘字节数)
+    """
+    if path.endswith(('.gz', '.bz2')):
+        with open(path, 'rb') as raw:
+            position = _RawPosition(raw)
+            if path.endswith('.gz'):
+                stream = gzip.GzipFile(fileobj=raw, mode='rb')
+            else:
+                stream = bz2.BZ2File(raw, 'rb')
+            with stream as f:
+                if start_offset:
+                    # 压缩流不支持随机访问，seek 会解压并跳过前面的内容
+                    f.seek(start_offset)
+                offset = start_offset
+                for data in f:
+                    offset += len(data)
+                    yield offset, data.rstrip(b'\r\n').decode('utf-8', 'ignore'), position.tell()
+        return
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start_offset:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            pos = start_offset
+            find = mm.find
+            while pos < size:
+                end = find(b'\n', pos)
+                nxt = size if end == -1 else end + 1
+                yield nxt, mm[pos:nxt].rstrip(b'\r\n').decode('utf-8', 'ignore'), nxt
+                pos = nxt
+
+
+def file_identity(path):
+    st = os.stat(path)
+    return {'inode': st.st_ino, 'size': st.st_size}
+
+
+def replay_worker(tasks, batch_size, out_queue):
+    """worker 进程: 从任务队列取 (文件, 起始偏移)，预过滤后分批发回协调者"""
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        path, start = task
+        parser = LogParser()
+        batch = []
+        read = empty = no_ip = 0
+        offset, disk = start, 0
+        try:
+            for offset, line, disk in iter_file_lines(path, start):
+                read += 1
+                record = parser.parse(line)
+                # 预过滤与实时流水线一致: 空行和不含源 IP 的行不发送给 AI
+                if record is None:
+                    empty += 1
+                    continue
+                if record.ip is None:
+                    no_ip += 1
+                    continue
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    out_queue.put(('batch', path, batch, offset, disk, (read, empty, no_ip)))
+                    batch = []
+                    read = empty = no_ip = 0
+            out_queue.put(('batch', path, batch, offset, disk, (read, empty, no_ip)))
+            out_queue.put(('done', path, None, offset, disk, (0, 0, 0)))
+        except (OSError, EOFError, ValueError) as e:
+            # 损坏的压缩文件: 已读部分照常处理，检查点停在最后一个完整批次
+            out_queue.put(('batch', path, batch, offset, disk, (read, empty, no_ip)))
+            out_queue.put(('error', path, str(e), offset, disk, (0, 0, 0)))
+
+
+class Replayer:
+    """回放协调者: 调度 worker、并发调用 AI，写库/封禁/检查点只在本线程执行"""
+
+    def __init__(self, paths, fw, workers=None, batch_size=BATCH_SIZE, ai_concurrency=AI_CONCURRENCY,
+                 checkpoint_path=REPLAY_CHECKPOINT_FILE, checkpoint_interval=REPLAY_CHECKPOINT_INTERVAL,
+                 progress_interval=REPLAY_PROGRESS_INTERVAL, reset=False, progress_stream=sys.stderr):
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.fw = fw
+        self.workers = max(1, min(workers or multiprocessing.cpu_count(), len(self.paths) or 1))
+        self.batch_size = batch_size
+        self.ai_concurrency = max(1, ai_concurrency)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.progress_stream = progress_stream
+        self.state = {} if reset else self._load_checkpoint()
+        self.lines = 0
+        self.analyzed = 0
+        self.blocked = set()
+        self.errors = {}
+        self._disk = {}
+        self._verdicts = queue.SimpleQueue()
+
+    # ---------- 检查点 ----------
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('files', {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取回放检查点失败，从头开始: {e}")
+            return {}
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        from cache_snapshot import write_snapshot
+        write_snapshot(self.checkpoint_path, {'version': 1, 'updated_at': time.time(), 'files': self.state})
+
+    def _start_offset(self, path):
+        """检查点中记录的偏移；文件被替换或截断时从头开始，已完成的文件返回 None"""
+        saved = self.state.get(path)
+        identity = file_identity(path)
+        if saved and saved.get('inode') == identity['inode'] and identity['size'] >= saved.get('size', 0):
+            if saved.get('done') and identity['size'] == saved.get('size'):
+                return None
+            return saved.get('offset', 0)
+        self.state[path] = dict(identity, offset=0, done=False)
+        return 0
+
+    def _advance(self, path, offset, done=False):
+        entry = self.state.setdefault(path, dict(file_identity(path), offset=0, done=False))
+        entry['offset'] = offset
+        if done:
+            entry.update(file_identity(path), done=True)
+
+    # ---------- 进度 ----------
+    def _progress(self, started):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        total = sum(self._sizes.values()) or 1
+        done = sum(1 for p in self._sizes if self.state.get(p, {}).get('done'))
+        disk = sum(self._disk.values())
+        print(f"[replay] 文件 {done}/{len(self._sizes)}  行 {self.lines}  "
+              f"{self.lines / elapsed:,.0f} 行/秒  进度 {min(disk / total, 1.0) * 100:.1f}%  "
+              f"已封禁 {len(self.blocked)}", file=self.progress_stream, flush=True)
+
+    # ---------- 主流程 ----------
+    def _on_verdict(self, batch, verdict):
+        """AI 线程中的回调: 判定结果交回协调者线程处理"""
+        self._verdicts.put((batch, verdict))
+
+    def _drain_verdicts(self):
+        from aegis_log import record_attacks, verdict_ip
+        while True:
+            try:
+                batch, verdict = self._verdicts.get_nowait()
+            except queue.Empty:
+                return
+            ip = verdict_ip(verdict)
+            if ip is None or ip in self.fw.blocked:
+                # 没有可用 IP 的判定跳过; 已封禁 IP 的重复判定不再写库
+                continue
+            result = record_attacks(batch, [verdict])
+            for ip in result["attack_ips"]:
+                if ip not in self.blocked:
+                    self.fw.add_ip(ip)
+                    self.blocked.add(ip)
+
+    def _finish(self, path, batch, offset, future):
+        if future is not None:
+            future.result()
+            self._drain_verdicts()
+        if offset is not None:
+            self._advance(path, offset)
+
+    def run(self):
+        """回放全部文件，返回汇总信息"""
+        from aegis_log import request_ai_verdicts, observe_lines, record_local_verdicts
+
+        tasks = []
+        self._sizes = {}
+        for path in self.paths:
+            start = self._start_offset(path)
+            if start is None:
+                logger.info(f"已回放过，跳过: {path}")
+                continue
+            self._sizes[path] = os.path.getsize(path)
+            tasks.append((path, start))
+        started = time.monotonic()
+        if not tasks:
+            return self.summary(started)
+
+        ctx = multiprocessing.get_context('spawn')
+        task_queue = ctx.Queue()
+        out_queue = ctx.Queue(SHARD_QUEUE_SIZE)
+        for task in tasks:
+            task_queue.put(task)
+        workers = min(self.workers, len(tasks))
+        for _ in range(workers):
+            task_queue.put(None)
+        processes = [ctx.Process(target=replay_worker, args=(task_queue, self.batch_size, out_queue),
+                                 name=f'aegis-replay-{i}', daemon=True) for i in range(workers)]
+        for p in processes:
+            p.start()
+
+        remaining = len(tasks)
+        in_flight = deque()
+        next_progress = next_checkpoint = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.ai_concurrency, thread_name_prefix='aegis-replay-ai') as pool:
+                while remaining > 0 or in_flight:
+                    self._drain_verdicts()
+                    while in_flight and (in_flight[0][3] is None or in_flight[0][3].done()):
+                        self._finish(*in_flight.popleft())
+                    now = time.monotonic()
+                    if self.progress_interval and now >= next_progress:
+                        self._progress(started)
+                        next_progress = now + self.progress_interval
+                    if now >= next_checkpoint:
+                        self.save_checkpoint()
+                        next_checkpoint = now + self.checkpoint_interval
+                    if remaining == 0:
+                        if in_flight:
+                            self._finish(*in_flight.popleft())
+                        continue
+                    try:
+                        kind, path, batch, offset, disk, stats = out_queue.get(timeout=0.01 if in_flight else 0.5)
+                    except queue.Empty:
+                        continue
+                    self._disk[path] = disk
+                    read, empty, no_ip = stats
+                    LINES_READ.inc(read)
+                    if empty:
+                        LINES_FILTERED.labels('empty').inc(empty)
+                    if no_ip:
+                        LINES_FILTERED.labels('no_ip').inc(no_ip)
+                    self.lines += read
+
+                    if kind == 'done':
+                        remaining -= 1
+                        in_flight.append((path, None, offset, None))
+                        continue
+                    if kind == 'error':
+                        remaining -= 1
+                        self.errors[path] = batch
+                        logger.error(f"回放文件读取失败 {path}: {batch}")
+                        continue
+                    if not batch:
+                        in_flight.append((path, None, offset, None))
+                        continue
+
+                    # 与实时流水线相同: IP 统计/异常检测 (按日志时间划分窗口) -> AI
+                    report = observe_lines(batch, use_log_time=True, blocked=self.fw.blocked)
+                    if report is not None:
+                        for ip in record_local_verdicts(report):
+                            if ip not in self.blocked:
+                                self.fw.add_ip(ip)
+                                self.blocked.add(ip)
+                    if ANOMALY_GATE_AI:
+                        # 转交 AI 的异常实体日志行 (容量型攻击候选在前) 按 batch_size 切分
+                        lines = report.urgent_lines + report.forward_lines if report is not None else []
+                        chunks = [lines[i:i + self.batch_size] for i in range(0, len(lines), self.batch_size)]
+                    else:
+                        # 已封禁来源的日志行不再交给 AI
+                        batch = self.fw.blocked.drop_blocked(batch)
+                        chunks = [batch] if batch else []
+                    if not chunks:
+                        in_flight.append((path, None, offset, None))
+                        continue
+                    for n, chunk in enumerate(chunks, 1):
+                        while len(in_flight) >= self.ai_concurrency * 2:
+                            self._finish(*in_flight.popleft())
+                        self.analyzed += len(chunk)
+                        future = pool.submit(request_ai_verdicts, chunk, partial(self._on_verdict, chunk))
+                        # 读取位置在最后一个分块完成后才推进
+                        in_flight.append((path, chunk, offset if n == len(chunks) else None, future))
+            # 全部批次完成后才标记文件完成
+            for path in self._sizes:
+                if path not in self.errors:
+                    self._advance(path, self.state[path]['offset'], done=True)
+        finally:
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()
+                p.join(timeout=5)
+            self.save_checkpoint()
+        if self.progress_interval:
+            self._progress(started)
+        return self.summary(started)
+
+    def summary(self, started):
+        elapsed = time.monotonic() - started
+        return {
+            'files': len(self._sizes),
+            'lines': self.lines,
+            'analyzed_lines': self.analyzed,
+            'elapsed_s': round(elapsed, 3),
+            'lines_per_sec': round(self.lines / elapsed, 1) if elapsed > 0 else 0.0,
+            'blocked': sorted(self.blocked),
+            'errors': self.errors,
+        }
+
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(p for p in matches if os.path.isfile(p))
+    return paths
+
+
+def main():
+    from aegis_log import FirewallAI
+
+    parser = argparse.ArgumentParser(description='回放历史日志 (支持 .gz/.bz2)')
+    parser.add_argument('paths', nargs='+', help='日志文件或通配符')
+    parser.add_argument('--workers', type=int, default=0, help='并行读取的进程数 (默认 CPU 核数)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='每次 AI 请求的行数')
+    parser.add_argument('--ai-concurrency', type=int, default=AI_CONCURRENCY, help='并发 AI 请求数')
+    parser.add_argument('--dry-run-firewall', action='store_true', help='只模拟 iptables 命令')
+    parser.add_argument('--checkpoint', default=REPLAY_CHECKPOINT_FILE, help='检查点文件 (空字符串表示不保存)')
+    parser.add_argument('--reset', action='store_true', help='忽略已有检查点，从头回放')
+    parser.add_argument('--progress-interval', type=float, default=REPLAY_PROGRESS_INTERVAL,
+                        help='进度输出间隔(秒)，0 表示不输出')
+    parser.add_argument('--json', help='把汇总结果写入 JSON 文件')
+    args = parser.parse_args()
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        parser.error('没有找到日志文件')
+
+    replayer = Replayer(paths, FirewallAI(dry_run=args.dry_run_firewall), workers=args.workers or None,
+                        batch_size=args.batch_size, ai_concurrency=args.ai_concurrency,
+                        checkpoint_path=args.checkpoint or None, reset=args.reset,
+                        progress_interval=args.progress_interval)
+    try:
+        summary = replayer.run()
+    except KeyboardInterrupt:
+        print("回放中断，已保存检查点，重新运行即可继续", file=sys.stderr)
+        return 1
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0 if not summary['errors'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+分析进程资源采样
+后台线程每 RESOURCE_SAMPLE_INTERVAL 秒记录一次分析进程的 RSS、CPU 占用、内部队列长度和每秒读取行数，
+写入 system_status 表；旧样本逐级降采样 (原始 → 每分钟 → 每小时) 后删除，表的大小保持稳定。
+Dashboard 据此显示真实的运行时间和资源趋势 (/api/system-trends)
+"""
+
+import os
+import threading
+import time
+
+from config import (
+    RESOURCE_SAMPLE_INTERVAL, RESOURCE_RAW_RETENTION, RESOURCE_MINUTE_RETENTION, RESOURCE_HOUR_RETENTION
+)
+from logger import AegisLogger
+from metrics import LINES_READ, QUEUE_DEPTH
+from models import get_db_manager
+
+logger = AegisLogger()
+
+MINUTE_FORMAT = '%Y-%m-%d %H:%M:00'
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+DOWNSAMPLE_INTERVAL = 60  # 降采样检查间隔(秒)
+
+
+def read_rss_bytes():
+    """当前进程的常驻内存 (字节)，读取 /proc/self/statm; 不支持时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def cpu_seconds():
+    """当前进程累计占用的 CPU 时间 (用户态 + 内核态)"""
+    times = os.times()
+    return times.user + times.system
+
+
+def queue_depths():
+    """各内部队列的当前长度 (aegis_queue_depth 指标)"""
+    return {labels[0]: child.value for labels, child in QUEUE_DEPTH.children().items()}
+
+
+class ResourceSampler:
+    """定期采样分析进程资源并写入 system_status"""
+
+    def __init__(self, db=None, interval=RESOURCE_SAMPLE_INTERVAL, clock=time.time):
+        self.db = db
+        self.interval = interval
+        self.clock = clock
+        self.started_at = clock()
+        self._last = (self.started_at, cpu_seconds(), LINES_READ.value)
+        self._last_downsample = self.started_at
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """采集一次样本; CPU 占用和每秒行数按距上次采样的增量计算"""
+        now = self.clock()
+        cpu = cpu_seconds()
+        lines = LINES_READ.value
+        last_time, last_cpu, last_lines = self._last
+        self._last = (now, cpu, lines)
+        elapsed = now - last_time
+        rss = read_rss_bytes()
+        return {
+            'timestamp': now,
+            'memory_usage': rss / (1024 * 1024) if rss is not None else None,
+            'cpu_usage': (cpu - last_cpu) / elapsed * 100 if elapsed > 0 else None,
+            'lines_per_sec': (lines - last_lines) / elapsed if elapsed > 0 else None,
+            'queue_depths': queue_depths(),
+        }
+
+    def record(self):
+        """采样并写库, 到期时执行降采样"""
+        db = self.db or get_db_manager()
+        sample = self.sample()
+        db.update_system_status(started_at=self.started_at, **sample)
+        if sample['timestamp'] - self._last_downsample >= DOWNSAMPLE_INTERVAL:
+            self.downsample(sample['timestamp'])
+        return sample
+
+    def downsample(self, now=None):
+        """原始样本超过保留时间合并为每分钟一条, 每分钟样本再合并为每小时一条, 过期的每小时样本删除"""
+        db = self.db or get_db_manager()
+        now = self.clock() if now is None else now
+        self._last_downsample = now
+        db.downsample_system_status('raw', 'minute', MINUTE_FORMAT, now - RESOURCE_RAW_RETENTION)
+        db.downsample_system_status('minute', 'hour', HOUR_FORMAT, now - RESOURCE_MINUTE_RETENTION)
+        db.purge_system_status('hour', now - RESOURCE_HOUR_RETENTION)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.record()
+            except Exception as e:
+                logger.error(f"资源采样失败: {e}")
+
+    def start(self):
+        if self.interval <= 0:
+            return self
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+AI 批次的可疑度优先调度
+AI 接口变慢或限流时，按文件顺序分析会让后面文件里的真实攻击排在大量正常流量之后
+
+    - 入队时廉价评分: 特征签名命中率、错误状态/认证失败比例、新出现的源 IP 比例
+    - 出队时总是取最可疑的批次，并受令牌桶 (每分钟请求数) 和每分钟 token 成本预算限制；
+      AI 熔断期间批次由本地降级处理，不消耗预算，按最快速度出队
+    - 过载时丢弃低优先级批次: 队列满时丢弃分数最低的批次，低分批次排队超过 SCHEDULER_MAX_AGE 秒也会丢弃
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from circuit_breaker import get_ai_breaker
+from config import (
+    AI_PROMPT_TEMPLATE, AI_RATE_PER_MINUTE, AI_TOKEN_BUDGET_PER_MINUTE,
+    SCHEDULER_MAX_PENDING, SCHEDULER_MAX_AGE, SCHEDULER_SHED_SCORE, SCHEDULER_SEEN_IPS
+)
+from log_parsers import LogParser, AUTH_FAILED, AUTH_INVALID_USER
+from metrics import REGISTRY, LINES_FILTERED, QUEUE_DEPTH
+from signatures import match_signature
+
+BATCHES_SHED = REGISTRY.counter('aegis_batches_shed_total', '调度器丢弃的低优先级批次数', ['reason'])
+SCHEDULER_WAIT = REGISTRY.histogram('aegis_scheduler_wait_seconds', '批次从入队到发往 AI 的等待时间')
+
+# 评分权重
+SIGNATURE_BONUS = 5.0   # 批次中只要有一行命中签名
+SIGNATURE_WEIGHT = 10.0
+ERROR_WEIGHT = 3.0
+NEW_IP_WEIGHT = 1.0
+# 必须优先分析的批次 (容量型攻击候选) 直接使用该分数，高于任何评分结果，过载时最后才会被丢弃
+URGENT_SCORE = 1e9
+
+# token 估算: 约 4 个字符一个 token，另加响应预留
+CHARS_PER_TOKEN = 4
+COMPLETION_TOKENS = 100
+
+SHED_OVERFLOW = 'overflow'
+SHED_EXPIRED = 'expired'
+
+
+def estimate_tokens(lines):
+    """估算一次 AI 请求的 token 消耗 (提示词 + 日志 + 响应预留)"""
+    chars = len(AI_PROMPT_TEMPLATE) + sum(len(line) + 1 for line in lines)
+    return chars // CHARS_PER_TOKEN + COMPLETION_TOKENS
+
+
+class TokenBucket:
+    """令牌桶: 每秒补充 rate 个令牌，最多积累 capacity 个；rate <= 0 表示不限制"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now=None):
+        """还需等待多少秒才能取出 amount 个令牌 (超过容量的请求在桶满时放行，避免永远饿死)"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount, now=None):
+        if self.rate <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class BatchScorer:
+    """批次可疑度评分，记住最近见过的源 IP (LRU，固定上限)"""
+
+    def __init__(self, seen_capacity=SCHEDULER_SEEN_IPS):
+        self.seen_capacity = seen_capacity
+        self._seen = OrderedDict()
+        self._parser = LogParser()
+
+    def score(self, lines):
+        records = [self._parser.parse(line) for line in lines]
+        return self.score_records(records, [match_signature(line) is not None for line in lines])
+
+    def score_records(self, records, hits):
+        """按已解析的记录评分 (分片 worker 已完成解析和签名匹配时，协调者不必重复扫描文本)
+        Args:
+            hits: 与 records 对齐的签名是否命中
+        """
+        parsed = 0
+        errors = 0
+        hit_count = 0
+        ips = set()
+        for record, hit in zip(records, hits):
+            if record is None:
+                continue
+            parsed += 1
+            if record.auth in (AUTH_FAILED, AUTH_INVALID_USER) or (
+                    record.status is not None and record.status >= 400):
+                errors += 1
+            if hit:
+                hit_count += 1
+            if record.ip is not None:
+                ips.add(record.ip)
+        if not parsed:
+            return 0.0
+        new_ips = 0
+        for ip in ips:
+            if ip in self._seen:
+                self._seen.move_to_end(ip)
+            else:
+                new_ips += 1
+                self._seen[ip] = True
+        while len(self._seen) > self.seen_capacity:
+            self._seen.popitem(last=False)
+        score = SIGNATURE_WEIGHT * hit_count / parsed + ERROR_WEIGHT * errors / parsed
+        if hit_count:
+            score += SIGNATURE_BONUS
+        if ips:
+            score += NEW_IP_WEIGHT * new_ips / len(ips)
+        return score
+
+
+class BatchScheduler:
+    """按可疑度出队、受速率和成本预算限制的批次队列 (线程安全)"""
+
+    def __init__(self, rate_per_minute=AI_RATE_PER_MINUTE, token_budget_per_minute=AI_TOKEN_BUDGET_PER_MINUTE,
+                 max_pending=SCHEDULER_MAX_PENDING, max_age=SCHEDULER_MAX_AGE,
+                 shed_score=SCHEDULER_SHED_SCORE, shed=True, scorer=None):
+        """
+        Args:
+            shed: False 时从不丢弃批次 (处理有限的文件时使用)，调用方通过 full() 自行施加背压
+        """
+        # 容量取一分钟的量，允许短时突发
+        self.requests = TokenBucket(rate_per_minute / 60.0, max(1.0, rate_per_minute))
+        self.budget = TokenBucket(token_budget_per_minute / 60.0, token_budget_per_minute)
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.shed_score = shed_score
+        self.shed = shed
+        self.scorer = scorer or BatchScorer()
+        self.shed_batches = 0
+        self._next_expire = 0.0
+        self._heap = []     # (-score, seq, enqueued_at, cost, batch)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._depth = QUEUE_DEPTH.labels('scheduler')
+
+    def __len__(self):
+        return len(self._heap)
+
+    def full(self):
+        return len(self._heap) >= self.max_pending
+
+    def submit(self, batch, score=None):
+        """批次入队，返回其分数"""
+        with self._cond:
+            if score is None:
+                score = self.scorer.score(batch)
+            heapq.heappush(self._heap, (-score, next(self._seq), time.monotonic(), estimate_tokens(batch), batch))
+            if self.shed and len(self._heap) > self.max_pending:
+                self._shed_lowest()
+            self._depth.set(len(self._heap))
+            self._cond.notify()
+        return score
+
+    def get(self, timeout=None):
+        """取出最可疑的批次；队列为空或预算不足时最多等待 timeout 秒，超时返回 None
+        Args:
+            timeout: None 表示一直等待，0 表示不等待
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = None
+                if self._heap:
+                    metered = not get_ai_breaker().rejecting()
+                    cost = self._heap[0][3]
+                    wait = 0.0
+                    if metered:
+                        wait = max(self.requests.wait_time(1, now), self.budget.wait_time(cost, now))
+                    if wait <= 0:
+                        _, _, enqueued_at, cost, batch = heapq.heappop(self._heap)
+                        if metered:
+                            self.requests.take(1, now)
+                            self.budget.take(cost, now)
+                        self._depth.set(len(self._heap))
+                        SCHEDULER_WAIT.observe(now - enqueued_at)
+                        return batch
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def pending(self):
+        """排队中的 [分数, 批次] (按出队顺序)，供检查点保存"""
+        with self._cond:
+            return [[-item[0], item[4]] for item in sorted(self._heap)]
+
+    def restore(self, pending):
+        """重新放入 pending() 导出的批次 (排队时间从现在算起)"""
+        for score, batch in pending:
+            self.submit(batch, score)
+
+    def _shed(self, index, reason):
+        batch = self._heap[index][4]
+        self._heap[index] = self._heap[-1]
+        self._heap.pop()
+        self.shed_batches += 1
+        BATCHES_SHED.labels(reason).inc()
+        LINES_FILTERED.labels('shed').inc(len(batch))
+
+    def _shed_lowest(self):
+        # 分数最低的批次中最新的一个 (同分时保留先到的)
+        index = max(range(len(self._heap)), key=lambda i: (self._heap[i][0], self._heap[i][1]))
+        self._shed(index, SHED_OVERFLOW)
+        heapq.heapify(self._heap)
+
+    def _expire(self, now):
+        if not self.shed or self.max_age <= 0 or now < self._next_expire:
+            return
+        # 过期检查需要遍历整个队列，最多每秒一次
+        self._next_expire = now + 1.0
+        cutoff = now - self.max_age
+        expired = [i for i, item in enumerate(self._heap) if -item[0] < self.shed_score and item[2] < cutoff]
+        if not expired:
+            return
+        for index in reversed(expired):
+            self._shed(index, SHED_EXPIRED)
+        heapq.heapify(self._heap)
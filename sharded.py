@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多进程分片采集
+读取/解析/预过滤/签名匹配由多个 worker 进程并行完成 (按文件或按源 IP 哈希分片)，
+批次以解析后的 LogRecord 汇总到唯一的协调者，协调者只合并统计、不再重复解析文本；
+协调者并发调用 AI，但数据库写入和 FirewallAI 只在协调者线程中执行
+"""
+
+import multiprocessing
+import queue
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from circuit_breaker import get_ai_breaker
+from config import BATCH_SIZE, AI_CONCURRENCY, SHARD_QUEUE_SIZE, ANOMALY_GATE_AI
+from log_parsers import LogParser
+from logger import AegisLogger
+from metrics import LINES_READ, LINES_FILTERED, QUEUE_DEPTH
+from scheduler import BatchScheduler, URGENT_SCORE
+from signatures import match_signature
+
+logger = AegisLogger()
+
+SHARD_BY_FILE = 'file'
+SHARD_BY_IP = 'ip'
+
+
+def shard_of(ip, num_shards):
+    """源 IP 所属分片 (crc32 在各进程间稳定，不受 PYTHONHASHSEED 影响)"""
+    return zlib.crc32(ip.encode()) % num_shards
+
+
+class ShardStats:
+    """worker 内的计数，随批次一起发回协调者汇总到指标"""
+
+    __slots__ = ('read', 'empty', 'no_ip')
+
+    def __init__(self):
+        self.read = 0
+        self.empty = 0
+        self.no_ip = 0
+
+    def drain(self):
+        data = (self.read, self.empty, self.no_ip)
+        self.read = self.empty = self.no_ip = 0
+        return data
+
+
+def shard_worker(shard_id, num_shards, file_paths, shard_mode, batch_size, tail_mode, out_queue):
+    """worker 进程入口: 读取 -> 解析/预过滤 -> 签名匹配 -> 分批 -> 送入协调者队列
+    每个批次为 (shard_id, LogRecord 列表, 与之对齐的签名命中标记, 计数)
+    """
+    # 在子进程中导入，避免 spawn 时父进程状态被序列化
+    from aegis_log import stream_log_files
+
+    if shard_mode == SHARD_BY_FILE:
+        own_paths = file_paths[shard_id::num_shards]
+    else:
+        # 按 IP 分片时每个 worker 都扫描全部文件，但只保留属于自己分片的行，
+        # 同一 IP 的流量总是落在同一个 worker 上
+        own_paths = file_paths
+
+    # 无法按 IP 归属的行 (空行、无 IP) 只由一个 worker 计数，避免重复统计
+    counts_unsharded = shard_mode == SHARD_BY_FILE or shard_id == 0
+    stats = ShardStats()
+    parser = LogParser()
+    batch = []
+    hits = []
+    try:
+        for line in stream_log_files(own_paths, tail_mode=tail_mode):
+            # 预过滤: 空行和不含源 IP 的行 (无法封禁) 不发送给 AI
+            if not line.strip():
+                if counts_unsharded:
+                    stats.read += 1
+                    stats.empty += 1
+                continue
+            record = parser.parse(line)
+            if record.ip is None:
+                if counts_unsharded:
+                    stats.read += 1
+                    stats.no_ip += 1
+                continue
+            if shard_mode == SHARD_BY_IP and shard_of(record.ip, num_shards) != shard_id:
+                continue
+            stats.read += 1
+            batch.append(record)
+            hits.append(match_signature(line) is not None)
+            if len(batch) >= batch_size:
+                out_queue.put((shard_id, batch, hits, stats.drain()))
+                batch = []
+                hits = []
+        if batch:
+            out_queue.put((shard_id, batch, hits, stats.drain()))
+    finally:
+        # None 表示该 worker 已读完 (非 tail 模式)
+        out_queue.put((shard_id, None, None, stats.drain()))
+
+
+class ShardedIngestor:
+    """分片采集的协调者"""
+
+    def __init__(self, file_paths, fw, workers=None, shard_mode=SHARD_BY_FILE,
+                 batch_size=BATCH_SIZE, tail_mode=True, ai_concurrency=AI_CONCURRENCY, scheduler=None):
+        """
+        Args:
+            scheduler: AI 批次调度器，默认按可疑度优先；只有 tail 模式下过载时才丢弃低优先级批次
+        """
+        self.file_paths = list(file_paths)
+        self.fw = fw
+        self.workers = workers or multiprocessing.cpu_count()
+        if shard_mode == SHARD_BY_FILE:
+            # 按文件分片时 worker 数不超过文件数
+            self.workers = max(1, min(self.workers, len(self.file_paths)))
+        self.shard_mode = shard_mode
+        self.batch_size = batch_size
+        self.tail_mode = tail_mode
+        self.ai_concurrency = max(1, ai_concurrency)
+        # spawn 启动: 子进程不继承父进程的日志监听线程和数据库连接
+        self._ctx = multiprocessing.get_context('spawn')
+        self._queue = self._ctx.Queue(SHARD_QUEUE_SIZE)
+        self._processes = []
+        self._verdicts = queue.SimpleQueue()
+        self.scheduler = scheduler or BatchScheduler(shed=tail_mode)
+        self.batches = 0
+        self.lines = 0
+
+    def start(self):
+        for shard_id in range(self.workers):
+            p = self._ctx.Process(
+                target=shard_worker,
+                args=(shard_id, self.workers, self.file_paths, self.shard_mode,
+                      self.batch_size, self.tail_mode, self._queue),
+                name=f'aegis-shard-{shard_id}', daemon=True
+            )
+            p.start()
+            self._processes.append(p)
+        logger.info(f"分片采集已启动: {self.workers} 个 worker, 分片方式={self.shard_mode}")
+
+    def stop(self):
+        for p in self._processes:
+            if p.is_alive():
+                p.terminate()
+        for p in self._processes:
+            p.join(timeout=5)
+        self._processes = []
+
+    def _account(self, stats):
+        read, empty, no_ip = stats
+        LINES_READ.inc(read)
+        if empty:
+            LINES_FILTERED.labels('empty').inc(empty)
+        if no_ip:
+            LINES_FILTERED.labels('no_ip').inc(no_ip)
+
+    def _on_verdict(self, batch, verdict):
+        """AI 线程中的回调: 判定结果交回协调者线程处理"""
+        self._verdicts.put((batch, verdict))
+
+    def _drain_verdicts(self):
+        """在协调者线程中写库并封禁已解析出的攻击 (流式模式下无需等待整个响应)"""
+        from aegis_log import record_attacks, verdict_ip
+        while True:
+            try:
+                batch, verdict = self._verdicts.get_nowait()
+            except queue.Empty:
+                return
+            ip = verdict_ip(verdict)
+            if ip is None or ip in self.fw.blocked:
+                # 没有可用 IP 的判定跳过; 已封禁 IP 的重复判定不再写库
+                continue
+            result = record_attacks(batch, [verdict])
+            for ip in result["attack_ips"]:
+                self.fw.add_ip(ip)
+
+    def _finish(self, batch, future):
+        future.result()
+        self._drain_verdicts()
+
+    def run(self, on_batch=None, on_idle=None, idle_interval=1.0):
+        """消费 worker 的批次直到全部 worker 结束 (tail 模式下一直运行)
+        Args:
+            on_batch: 每个批次进入 AI 分析前的回调
+            on_idle: 队列空闲 idle_interval 秒时的回调 (例如打印统计)
+        """
+        from aegis_log import request_ai_verdicts, observe_records, record_local_verdicts
+        from fallback import get_reanalysis_queue
+
+        reanalysis = get_reanalysis_queue()
+        breaker = get_ai_breaker()
+        if not self._processes:
+            self.start()
+        remaining = self.workers
+        in_flight = deque()
+
+        def dispatch(timeout=0):
+            """按可疑度把调度队列中的批次发往 AI，在途请求不超过并发数的两倍"""
+            while len(in_flight) < self.ai_concurrency * 2:
+                batch = self.scheduler.get(timeout=timeout)
+                if batch is None:
+                    return
+                timeout = 0
+                if on_batch:
+                    on_batch(batch)
+                future = pool.submit(request_ai_verdicts, batch, partial(self._on_verdict, batch))
+                in_flight.append((batch, future))
+
+        depth = QUEUE_DEPTH.labels('shard_batches')
+        with ThreadPoolExecutor(max_workers=self.ai_concurrency, thread_name_prefix='aegis-ai') as pool:
+            try:
+                while remaining > 0:
+                    self._drain_verdicts()
+                    # 完成的 AI 请求按提交顺序出队
+                    while in_flight and in_flight[0][1].done():
+                        self._finish(*in_flight.popleft())
+                    # AI 恢复后, 降级期间本地分类过的批次重新交给 AI 复核
+                    reanalysis.drain_to(self.scheduler, breaker)
+                    dispatch()
+                    try:
+                        # 有在途请求或待发批次时短轮询，尽快把完成的结果落库/封禁
+                        timeout = 0.01 if in_flight or len(self.scheduler) else idle_interval
+                        shard_id, records, hits, stats = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        if on_idle and not in_flight:
+                            on_idle()
+                        continue
+                    self._account(stats)
+                    if records is None:
+                        remaining -= 1
+                        continue
+                    if not records:
+                        continue
+                    self.batches += 1
+                    self.lines += len(records)
+                    report = observe_records(records, blocked=self.fw.blocked)
+                    if report is not None:
+                        for ip in record_local_verdicts(report):
+                            self.fw.add_ip(ip)
+                        # 容量型攻击候选先于其它批次交给 AI 确认, 同样按 batch_size 切分
+                        urgent = report.urgent_lines
+                        for i in range(0, len(urgent), self.batch_size):
+                            self.scheduler.submit(urgent[i:i + self.batch_size], score=URGENT_SCORE)
+                    if ANOMALY_GATE_AI:
+                        # 只分析异常实体的日志行
+                        forward = report.forward_lines if report is not None else []
+                        for i in range(0, len(forward), self.batch_size):
+                            self.scheduler.submit(forward[i:i + self.batch_size])
+                    else:
+                        # 已封禁来源的日志行不再交给 AI; 直接用 worker 的解析和签名结果评分
+                        keep = self.fw.blocked.keep_mask(records) if len(self.fw.blocked) else None
+                        if keep is not None:
+                            records = [r for r, kept in zip(records, keep) if kept]
+                            hits = [h for h, kept in zip(hits, keep) if kept]
+                        if records:
+                            self.scheduler.submit([r.raw for r in records],
+                                                  score=self.scheduler.scorer.score_records(records, hits))
+                    if not self.scheduler.shed:
+                        # 不丢弃批次时 (读有限的文件)，调度队列满了就等待在途请求完成，形成背压
+                        while self.scheduler.full():
+                            if in_flight:
+                                self._finish(*in_flight.popleft())
+                            dispatch(timeout=0 if in_flight else idle_interval)
+                    dispatch()
+                    try:
+                        depth.set(self._queue.qsize())
+                    except NotImplementedError:
+                        pass
+                while in_flight or len(self.scheduler):
+                    if in_flight:
+                        self._finish(*in_flight.popleft())
+                    # 没有在途请求时等待速率/预算放行
+                    dispatch(timeout=0 if in_flight or not len(self.scheduler) else idle_interval)
+            finally:
+                self.stop()
+                depth.set(0)
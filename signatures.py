@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地攻击特征签名
+所有签名合并为一个带命名分组的正则，每行只扫描一次；命中的分组名即攻击类型
+签名只用于廉价的预判 (批次优先级评分等)，最终判定仍以 AI 为准
+"""
+
+import re
+from urllib.parse import unquote_plus
+
+# (攻击类型, 正则) 按顺序匹配，先命中的生效；类型与 config.ATTACK_TYPE_MAPPING 一致
+SIGNATURES = [
+    ('SQL Injection', r"union(?:\s|\+|/\*.*?\*/)+(?:all(?:\s|\+)+)?select"
+                      r"|'\s*(?:or|and)\s+\d+\s*=\s*\d+"
+                      r"|\b(?:sleep|benchmark|pg_sleep)\s*\("
+                      r"|information_schema|;\s*drop\s+table"),
+    ('XSS', r"<script|javascript:|\bon(?:error|load|mouseover)\s*=|document\.cookie"),
+    ('Scanning', r"\.\./|/etc/passwd|/\.env\b|/\.git/|wp-admin|wp-login\.php|xmlrpc\.php"
+                 r"|phpmyadmin|/cgi-bin/|\bzgrab\b|\bmasscan\b|\bnmap\b|\bnuclei\b"),
+    ('Brute Force', r"Failed password|Invalid user|authentication failure"
+                    r'|"POST /[^" ]*(?:login|signin|auth)[^" ]* HTTP/[\d.]+" 401'),
+    ('Malicious Crawler', r"\bsqlmap\b|\bnikto\b|\bhttrack\b|libwww-perl|\bscrapy\b"),
+]
+
+# 分组名 g0, g1, ... 对应 SIGNATURES 下标
+_COMBINED = re.compile('|'.join(f'(?P<g{i}>{pattern})' for i, (_, pattern) in enumerate(SIGNATURES)),
+                       re.IGNORECASE)
+_TYPES = {f'g{i}': attack_type for i, (attack_type, _) in enumerate(SIGNATURES)}
+
+
+def match_signature(line):
+    """返回日志行命中的攻击类型，未命中返回 None (URL 编码的载荷先解码再匹配)"""
+    m = _COMBINED.search(line)
+    if m is None and '%' in line:
+        m = _COMBINED.search(unquote_plus(line))
+    return _TYPES[m.lastgroup] if m is not None else None
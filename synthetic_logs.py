@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+合成日志生成器 - 用于压测与离线评估
+生成 nginx combined / sshd 格式的访问日志，按比例混入来自固定攻击者 IP 的攻击流量，
+并返回 {攻击者IP: 攻击类型} 作为真值
+
+用法:
+    python3 synthetic_logs.py access.log --lines 100000 --attack-ratio 0.05
+"""
+
+import argparse
+import random
+import time
+
+BENIGN_PATHS = ['/', '/index.html', '/about', '/products', '/products/42', '/cart',
+                '/static/app.js', '/static/style.css', '/api/items?page=2', '/favicon.ico']
+BENIGN_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/118.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 13_5) AppleWebKit/605.1.15 Version/16.6 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+]
+
+# 攻击类型 -> (方法, 路径, 状态码, User-Agent) 模板
+ATTACK_REQUESTS = {
+    'SQL Injection': [
+        ('GET', "/products.php?id=1'%20OR%201=1--", 500, 'Mozilla/5.0'),
+        ('GET', '/item?id=1%20UNION%20SELECT%20username,password%20FROM%20users', 500, 'Mozilla/5.0'),
+    ],
+    'XSS': [
+        ('GET', '/search?q=<script>alert(document.cookie)</script>', 200, 'Mozilla/5.0'),
+        ('GET', '/comment?text=%3Cscript%3Ealert(1)%3C/script%3E', 200, 'Mozilla/5.0'),
+    ],
+    'Scanning': [
+        ('GET', '/wp-admin/setup-config.php', 404, 'Mozilla/5.0 zgrab/0.x'),
+        ('GET', '/.env', 404, 'Mozilla/5.0 zgrab/0.x'),
+        ('GET', '/phpmyadmin/index.php', 404, 'Mozilla/5.0 zgrab/0.x'),
+        ('GET', '/.git/config', 404, 'Mozilla/5.0 zgrab/0.x'),
+    ],
+    'Brute Force': [
+        ('POST', '/login', 401, 'python-requests/2.31.0'),
+    ],
+    'Malicious Crawler': [
+        ('GET', '/products?page=9999', 200, 'sqlmap/1.7.2#stable (https://sqlmap.org)'),
+        ('GET', '/', 200, 'Nikto/2.5.0'),
+    ],
+}
+
+SSHD_ATTACK_TYPE = 'Brute Force'
+
+
+def _random_ip(rng):
+    return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def _nginx_line(ip, ts, method, path, status, agent, size):
+    stamp = time.strftime('%d/%b/%Y:%H:%M:%S +0000', time.gmtime(ts))
+    return f'{ip} - - [{stamp}] "{method} {path} HTTP/1.1" {status} {size} "-" "{agent}"'
+
+
+def _sshd_line(ip, ts, user, failed, pid):
+    stamp = time.strftime('%b %d %H:%M:%S', time.gmtime(ts))
+    result = 'Failed password' if failed else 'Accepted password'
+    return f'{stamp} web01 sshd[{pid}]: {result} for {user} from {ip} port {40000 + pid % 20000} ssh2'
+
+
+def generate_lines(num_lines, attack_ratio=0.05, attackers=20, formats=('nginx',),
+                   seed=0, start_time=None, benign_ips=2000):
+    """生成日志行
+    Yields:
+        (line, ip, attack_type): 正常流量的 attack_type 为 None
+    """
+    rng = random.Random(seed)
+    attack_types = list(ATTACK_REQUESTS)
+    attacker_pool = [(_random_ip(rng), attack_types[i % len(attack_types)]) for i in range(attackers)]
+    benign_pool = [_random_ip(rng) for _ in range(benign_ips)]
+    ts = start_time if start_time is not None else time.time() - num_lines * 0.01
+
+    for i in range(num_lines):
+        ts += 0.01
+        fmt = formats[i % len(formats)]
+        is_attack = attacker_pool and rng.random() < attack_ratio
+        if fmt == 'sshd':
+            if is_attack:
+                ip = attacker_pool[rng.randrange(len(attacker_pool))][0]
+                yield _sshd_line(ip, ts, rng.choice(['root', 'admin', 'oracle']), True, i % 30000), ip, SSHD_ATTACK_TYPE
+            else:
+                ip = rng.choice(benign_pool)
+                yield _sshd_line(ip, ts, 'deploy', False, i % 30000), ip, None
+            continue
+
+        if is_attack:
+            ip, attack_type = attacker_pool[rng.randrange(len(attacker_pool))]
+            method, path, status, agent = rng.choice(ATTACK_REQUESTS[attack_type])
+            yield _nginx_line(ip, ts, method, path, status, agent, rng.randint(100, 900)), ip, attack_type
+        else:
+            ip = rng.choice(benign_pool)
+            status = 200 if rng.random() < 0.95 else 404
+            yield _nginx_line(ip, ts, 'GET', rng.choice(BENIGN_PATHS), status,
+                              rng.choice(BENIGN_AGENTS), rng.randint(200, 50000)), ip, None
+
+
+def write_log_file(path, num_lines, **kwargs):
+    """把生成的日志写入文件
+    Returns:
+        dict: {攻击者IP: 攻击类型} 真值 (只包含实际出现在文件中的攻击者)
+    """
+    truth = {}
+    with open(path, 'w') as f:
+        for line, ip, attack_type in generate_lines(num_lines, **kwargs):
+            f.write(line + '\n')
+            if attack_type:
+                truth[ip] = attack_type
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成测试日志')
+    parser.add_argument('output', help='输出文件路径')
+    parser.add_argument('--lines', type=int, default=100000, help='行数')
+    parser.add_argument('--attack-ratio', type=float, default=0.05, help='攻击流量占比')
+    parser.add_argument('--attackers', type=int, default=20, help='攻击者 IP 数')
+    parser.add_argument('--formats', default='nginx', help='日志格式(逗号分隔): nginx,sshd')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    truth = write_log_file(args.output, args.lines, attack_ratio=args.attack_ratio,
+                           attackers=args.attackers, formats=tuple(args.formats.split(',')),
+                           seed=args.seed)
+    print(f"已生成 {args.lines} 行日志: {args.output}, 攻击者 {len(truth)} 个")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - AI 流式响应: 增量 JSON 解析，每个攻击对象解析完成即写库封禁
+"""
+
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from ai_stream import VerdictStreamParser
+from metrics import AI_FIRST_VERDICT_LATENCY
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+
+
+def _feed_in_pieces(text, size):
+    parser = VerdictStreamParser()
+    emitted = []
+    for i in range(0, len(text), size):
+        emitted.append(parser.feed(text[i:i + size]))
+    return parser, emitted
+
+
+def test_parser_emits_each_object_when_closed():
+    verdicts = [{"ip": "203.0.113.1", "attack_type": "XSS"},
+                {"ip": "203.0.113.2", "attack_type": "SQL Injection", "note": "id=1' or \"1\"=\"1 }]"}]
+    text = json.dumps({"attack_ips": verdicts})
+    for size in (1, 3, 7, len(text)):
+        parser, emitted = _feed_in_pieces(text, size)
+        assert parser.verdicts == verdicts
+        assert parser.complete
+    # 第一个对象在响应结束前就已返回
+    parser, emitted = _feed_in_pieces(text, 1)
+    first = next(i for i, e in enumerate(emitted) if e)
+    assert emitted[first] == [verdicts[0]]
+    assert first < text.index("203.0.113.2")
+
+
+def test_parser_ignores_fences_and_handles_empty():
+    parser, _ = _feed_in_pieces('好的，结果如下:\n```json\n{"attack_ips": [{"ip": "198.51.100.9", '
+                                '"attack_type": "Scanning"}]}\n```', 5)
+    assert parser.verdicts == [{"ip": "198.51.100.9", "attack_type": "Scanning"}]
+
+    # 说明文字中的括号不是 JSON 的开始
+    for prose in ('Found [2] attacks:\n', 'Use {ip} as key. Found {2}:\n', '[注意] { 见下 }\n'):
+        for size in (1, 4):
+            parser, _ = _feed_in_pieces(prose + '{"attack_ips": [{"ip": "198.51.100.9", '
+                                                '"attack_type": "Scanning"}]}', size)
+            assert parser.complete and parser.verdicts == [{"ip": "198.51.100.9", "attack_type": "Scanning"}]
+
+    parser, _ = _feed_in_pieces('{"attack_ips": []}', 4)
+    assert parser.complete and parser.verdicts == []
+
+    parser, _ = _feed_in_pieces('{"attack_ips": [{"ip": "198.51.100.9", "attack_', 4)
+    assert not parser.complete and parser.verdicts == []
+
+
+def test_streaming_blocks_before_response_completes():
+    try:
+        # 每个增量间隔 20ms，完整响应约需 0.3 秒以上
+        with MockAIServer(chunk_chars=8, chunk_delay=0.02) as server, temporary_db_manager() as db:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            lines = [f'203.0.113.{i} - - [10/Oct/2024:13:55:36 +0000] "GET /?q=<script>alert(1)</script> HTTP/1.1" '
+                     f'200 1 "-" "x"' for i in range(1, 5)]
+            blocked_at = {}
+            started = time.monotonic()
+            result = aegis_log.analyze_lines_ai(lines, on_attack=lambda ip: blocked_at.setdefault(ip, time.monotonic()))
+            finished = time.monotonic()
+
+            assert sorted(result["attack_ips"]) == sorted(f"203.0.113.{i}" for i in range(1, 5))
+            assert result["attack_types"] == ["XSS"]
+            assert db.get_total_blocked_ips() == 4
+            first = min(blocked_at.values())
+            assert first - started < (finished - started) / 2
+            assert server.completion_tokens > 0
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+def test_first_verdict_latency_when_one_chunk_closes_several():
+    try:
+        # 整个响应在一个增量中返回, 同时闭合多个攻击对象
+        with MockAIServer(chunk_chars=100000) as server, temporary_db_manager():
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            lines = [f'203.0.113.{i} - - [10/Oct/2024:13:55:36 +0000] "GET /?q=<script>alert(1)</script> HTTP/1.1" '
+                     f'200 1 "-" "x"' for i in range(1, 4)]
+            before = AI_FIRST_VERDICT_LATENCY.count
+            assert len(aegis_log.analyze_lines_ai(lines)["attack_ips"]) == 3
+            assert AI_FIRST_VERDICT_LATENCY.count == before + 1
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+def test_truncated_stream_is_not_cached():
+    try:
+        # 响应在第二个对象中间被截断 (如达到 max_tokens)
+        content = '{"attack_ips": [{"ip": "203.0.113.21", "attack_type": "XSS"}, {"ip": "203.0.113.22", "att'
+        with MockAIServer(content=content) as server, temporary_db_manager():
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            lines = ['203.0.113.21 - - [10/Oct/2024:13:55:36 +0000] "GET /?q=<script>truncated</script> HTTP/1.1" '
+                     '200 1 "-" "x"']
+            assert aegis_log.request_ai_verdicts(lines) == [{"ip": "203.0.113.21", "attack_type": "XSS"}]
+            # 不完整的结果不缓存, 再次读到相同批次时重新交给 AI
+            aegis_log.request_ai_verdicts(lines)
+            assert server.requests == 2
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_parser_emits_each_object_when_closed()
+    test_parser_ignores_fences_and_handles_empty()
+    test_streaming_blocks_before_response_completes()
+    test_first_verdict_latency_when_one_chunk_closes_several()
+    test_truncated_stream_is_not_cached()
+    print("AI 流式响应测试通过")
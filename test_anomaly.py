@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - NumPy EWMA 速率异常检测: 容量型攻击优先交给 AI (或开启后本地判定)，其余异常实体转交 AI
+"""
+
+import os
+import random
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+import numpy as np
+
+from anomaly import AnomalyDetector, KIND_IP, KIND_PATH, get_anomaly_detector, set_anomaly_detector
+from config import BATCH_SIZE
+from log_parsers import LogRecord, parse_line
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from scheduler import URGENT_SCORE
+
+
+def _http(ip, path="/", status=200):
+    return LogRecord("combined", ip, f'{ip} - - [10/Oct/2024:13:55:36 +0000] "GET {path} HTTP/1.1" {status} 1 "-" "x"',
+                     method="GET", path=path, status=status)
+
+
+def _normal_window(rng, n=400):
+    return [_http(f"10.0.{rng.randint(0, 3)}.{rng.randint(1, 200)}", f"/page/{rng.randint(0, 50)}")
+            for _ in range(n)]
+
+
+def _warm_detector(**kwargs):
+    rng = random.Random(0)
+    detector = AnomalyDetector(window=10, warmup=3, ip_slots=4096, path_slots=1024, **kwargs)
+    for i in range(5):
+        report = detector.score_window(_normal_window(rng), now=1000.0 + i * 10)
+        assert report.anomalies == []
+    return detector, rng
+
+
+def test_http_flood_is_blocked_locally():
+    detector, rng = _warm_detector(local_block=True)
+    window = _normal_window(rng) + [_http("203.0.113.50") for _ in range(500)]
+    report = detector.score_window(window, now=1100.0)
+
+    assert report.verdicts == [{"ip": "203.0.113.50", "attack_type": "DDoS"}]
+    assert len(report.verdict_lines["203.0.113.50"]) == 20
+    assert report.urgent_lines == []
+    assert all("203.0.113.50" not in line for line in report.forward_lines)
+    # 被攻击的路径 "/" 也是异常实体
+    assert any(a.kind == KIND_PATH and a.key == "/" for a in report.anomalies)
+
+
+def test_http_flood_goes_to_ai_by_default():
+    detector, rng = _warm_detector()
+    window = _normal_window(rng) + [_http("203.0.113.50") for _ in range(500)]
+    report = detector.score_window(window, now=1100.0)
+
+    # 默认不在本地封禁: 候选 IP 的日志行单独交给 AI 确认，不与其它异常实体的行重复
+    assert report.verdicts == [] and report.verdict_lines == {}
+    assert len(report.urgent_lines) == 20 and all("203.0.113.50" in line for line in report.urgent_lines)
+    assert all("203.0.113.50" not in line for line in report.forward_lines)
+
+
+def test_allowlist_is_never_judged_as_flood():
+    detector, rng = _warm_detector(local_block=True, allowlist=["203.0.113.0/24"])
+    window = _normal_window(rng) + [_http("203.0.113.50") for _ in range(500)]
+    window += [_http("198.51.100.50") for _ in range(500)]
+    report = detector.score_window(window, now=1100.0)
+    assert report.verdicts == [{"ip": "198.51.100.50", "attack_type": "DDoS"}]
+    # 白名单地址仍是异常实体，照常交给 AI 分析
+    assert any("203.0.113.50" in line for line in report.forward_lines)
+
+
+def test_hash_collisions_are_split_by_key():
+    # 只有 1 个 IP 槽位: 所有 IP 冲突, 仍按实际 IP 拆分且保持原有顺序
+    detector = AnomalyDetector(window=0, warmup=0, ip_slots=1, path_slots=1, min_count=2, flood_min=10 ** 6)
+    detector.baselines[KIND_IP].score = lambda counts: np.full(len(counts), 100.0)
+    records = [_http("192.0.2.1", f"/{i}") if i % 3 else _http("192.0.2.2", f"/{i}") for i in range(30)]
+    report = detector.score_window(records, now=1.0)
+    groups = {a.key: a.records for a in report.anomalies if a.kind == KIND_IP}
+    assert set(groups) == {"192.0.2.1", "192.0.2.2"}
+    assert groups["192.0.2.2"] == records[::3]
+    assert len(groups["192.0.2.1"]) == 20
+
+
+def test_syn_and_udp_floods():
+    detector, rng = _warm_detector(local_block=True)
+    syn = ("Oct 10 13:55:39 fw01 kernel: IN=eth0 OUT= SRC=198.51.100.7 DST=10.0.0.1 "
+           "PROTO=TCP SPT={} DPT=80 WINDOW=1024 SYN URGP=0")
+    udp = "Oct 10 13:55:39 fw01 kernel: IN=eth0 OUT= SRC=198.51.100.8 DST=10.0.0.1 PROTO=UDP SPT={} DPT=53 LEN=40"
+    window = _normal_window(rng)
+    window += [parse_line(syn.format(1024 + i)) for i in range(300)]
+    window += [parse_line(udp.format(1024 + i)) for i in range(300)]
+    report = detector.score_window(window, now=1100.0)
+    verdicts = {v["ip"]: v["attack_type"] for v in report.verdicts}
+    assert verdicts == {"198.51.100.7": "SYN Flood", "198.51.100.8": "UDP Flood"}
+
+
+def test_brute_force_is_forwarded_to_ai():
+    detector, rng = _warm_detector()
+    window = _normal_window(rng) + [_http("192.0.2.66", "/login", 401) for _ in range(300)]
+    report = detector.score_window(window, now=1100.0)
+    assert report.verdicts == []
+    assert any(a.kind == KIND_IP and a.key == "192.0.2.66" for a in report.anomalies)
+    assert report.forward_lines and all("192.0.2.66" in line for line in report.forward_lines)
+
+
+def test_time_windows():
+    detector = AnomalyDetector(window=5, warmup=0, ip_slots=1024, path_slots=256, flood_min=50, local_block=True)
+    flood = [_http("203.0.113.9") for _ in range(100)]
+    assert detector.feed(flood, now=100.0) is None
+    assert detector.feed(flood, now=103.0) is None
+    report = detector.feed([], now=105.0)
+    assert report.records == 200
+    assert report.verdicts == [{"ip": "203.0.113.9", "attack_type": "DDoS"}]
+
+
+def test_process_batch_blocks_flood_without_ai_verdict():
+    previous_detector = get_anomaly_detector()
+    try:
+        with MockAIServer(mode="none") as server, temporary_db_manager() as db:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            flood = [_http("203.0.113.77").raw for _ in range(150)]
+
+            # 默认只交给 AI 确认: AI 判为正常时不封禁
+            set_anomaly_detector(AnomalyDetector(window=0, warmup=0, ip_slots=1024, path_slots=256, flood_min=100))
+            fw = aegis_log.FirewallAI(dry_run=True)
+            aegis_log.process_batch(flood, fw)
+            assert fw.get_blacklist() == [] and server.requests == 1
+
+            # 开启本地封禁后无需 AI 判定
+            set_anomaly_detector(AnomalyDetector(window=0, warmup=0, ip_slots=1024, path_slots=256, flood_min=100,
+                                                 local_block=True))
+            aegis_log.process_batch(flood, fw)
+            assert fw.get_blacklist() == ["203.0.113.77"]
+            assert db.get_attack_type_statistics() == {"DDoS": 1}
+    finally:
+        aegis_log.set_ai_client(None)
+        set_anomaly_detector(previous_detector)
+
+
+def test_gated_lines_are_split_into_batches():
+    previous_detector = get_anomaly_detector()
+    gate = aegis_log.ANOMALY_GATE_AI
+    try:
+        with MockAIServer(mode="none") as server, temporary_db_manager():
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            aegis_log.ANOMALY_GATE_AI = True
+            set_anomaly_detector(AnomalyDetector(window=0, warmup=0, ip_slots=1024, path_slots=256, flood_min=100))
+            fw = aegis_log.FirewallAI(dry_run=True)
+            flood = [_http("203.0.113.78", f"/{i}").raw for i in range(150)]
+            # 容量型攻击候选的日志行同样按 batch_size 切分，且排在最前、以最高优先级调度
+            batches = aegis_log.screen_batch(flood, fw, batch_size=8)
+            assert batches and all(0 < len(lines) <= 8 for lines, _ in batches)
+            assert batches[0][1] == URGENT_SCORE
+            assert sum(len(lines) for lines, _ in batches) == len(set(line for lines, _ in batches for line in lines))
+
+            urgent = sum(len(lines) for lines, score in batches if score == URGENT_SCORE)
+            forward = sum(len(lines) for lines, score in batches if score is None)
+
+            # 同一批日志重新检测, 按默认 BATCH_SIZE 分多次请求 AI
+            set_anomaly_detector(AnomalyDetector(window=0, warmup=0, ip_slots=1024, path_slots=256, flood_min=100))
+            aegis_log.process_batch(flood, fw)
+            assert server.requests == -(-urgent // BATCH_SIZE) + -(-forward // BATCH_SIZE) > 1
+    finally:
+        aegis_log.ANOMALY_GATE_AI = gate
+        aegis_log.set_ai_client(None)
+        set_anomaly_detector(previous_detector)
+
+
+if __name__ == "__main__":
+    test_http_flood_is_blocked_locally()
+    test_http_flood_goes_to_ai_by_default()
+    test_allowlist_is_never_judged_as_flood()
+    test_hash_collisions_are_split_by_key()
+    test_syn_and_udp_floods()
+    test_brute_force_is_forwarded_to_ai()
+    test_time_windows()
+    test_process_batch_blocks_flood_without_ai_verdict()
+    test_gated_lines_are_split_into_batches()
+    print("异常检测测试通过")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 已封禁地址索引: 精确地址与 CIDR 网段匹配、流水线过滤与封禁去重
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from blocked_index import BlockedIndex
+from metrics import AI_ERRORS, LINES_FILTERED
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from sharded import ShardedIngestor
+from synthetic_logs import _nginx_line
+
+
+def test_index_matching():
+    index = BlockedIndex(["203.0.113.7", "10.0.0.0/8", "2001:db8::/32", "not-an-ip"])
+    assert len(index) == 3
+    assert "203.0.113.7" in index and "203.0.113.8" not in index
+    assert "10.1.2.3" in index and "11.0.0.1" not in index
+    assert "2001:db8::1" in index and "2001:db9::1" not in index
+    assert "garbage" not in index
+    # AI 返回的 null / 数字等非字符串值视为未封禁
+    assert None not in index and 123 not in index and ["10.0.0.1"] not in index
+    assert None not in BlockedIndex()
+
+    assert not index.add("bogus")
+    index.add("192.168.1.0/24")
+    assert "192.168.1.200" in index and "192.168.2.1" not in index
+    index.discard("10.0.0.0/8")
+    assert "10.1.2.3" not in index
+    index.discard("203.0.113.7/32")
+    assert "203.0.113.7" not in index
+
+    index.replace(["198.51.100.1"])
+    assert len(index) == 1 and "198.51.100.1" in index and "192.168.1.200" not in index
+
+
+def test_drop_blocked_lines():
+    index = BlockedIndex(["198.51.100.0/24"])
+    lines = [
+        _nginx_line("198.51.100.9", 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0),
+        _nginx_line("203.0.113.1", 1700000000, "GET", "/index.html", 200, "Mozilla/5.0", 100),
+        "no source address here",
+    ]
+    before = LINES_FILTERED.labels('blocked').value
+    assert index.drop_blocked(lines) == lines[1:]
+    assert LINES_FILTERED.labels('blocked').value - before == 1
+    assert BlockedIndex().drop_blocked(lines) is lines
+
+
+def test_firewall_dedupe_and_verdicts():
+    try:
+        with MockAIServer() as server, temporary_db_manager() as db:
+            fw = aegis_log.FirewallAI(dry_run=True)
+            fw.add_ip("198.51.100.1")
+            commands = fw.dry_run.commands
+            # 已封禁的地址不再执行 iptables 命令
+            fw.add_ip("198.51.100.1")
+            assert fw.dry_run.commands == commands
+            fw.dry_run.run(f"iptables -A {fw.chain} -s 10.0.0.0/8 -j DROP")
+            fw.sync_blacklist()
+            assert "10.20.30.40" in fw.blocked
+            commands = fw.dry_run.commands
+            fw.add_ip("10.20.30.40")
+            assert fw.dry_run.commands == commands
+
+            # 已封禁 IP 的判定不再写库
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            batch = [_nginx_line(ip, 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0)
+                     for ip in ("198.51.100.1", "203.0.113.5")]
+            result = aegis_log.analyze_lines_ai(batch, blocked=fw.blocked)
+            assert result["attack_ips"] == ["203.0.113.5"]
+            assert db.get_attack_type_statistics() == {"Scanning": 1}
+            assert fw.blocked.drop_blocked(batch) == batch[1:]
+
+            fw.remove_ip("198.51.100.1")
+            assert "198.51.100.1" not in fw.blocked
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+def test_malformed_verdicts_are_skipped():
+    content = ('{"attack_ips": [{"ip": null, "attack_type": "XSS"}, {"ip": 123, "attack_type": "XSS"}, '
+               '{"attack_type": "XSS"}, "203.0.113.1", {"ip": "203.0.113.9", "attack_type": "XSS"}]}')
+    stream = aegis_log.AI_STREAM
+    try:
+        with MockAIServer(content=content) as server, temporary_db_manager() as db:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            fw = aegis_log.FirewallAI(dry_run=True)
+            errors = AI_ERRORS.value
+            for i, aegis_log.AI_STREAM in enumerate((True, False)):
+                batch = [_nginx_line("203.0.113.9", 1700000000 + i, "GET", "/?q=<script>", 200, "x", 1)]
+                # 无效的判定被跳过, 同一响应中有效的判定照常写库封禁, 不算作 AI 调用失败
+                assert aegis_log.analyze_lines_ai(batch, on_attack=fw.add_ip, blocked=fw.blocked)["attack_ips"] == (
+                    ["203.0.113.9"] if i == 0 else [])
+            assert AI_ERRORS.value == errors and fw.get_blacklist() == ["203.0.113.9"]
+            assert db.get_attack_type_statistics() == {"XSS": 1}
+
+        # 多进程协调者线程中同样跳过, 不会因为一个无效判定退出
+        ingestor = ShardedIngestor([], aegis_log.FirewallAI(dry_run=True), workers=1)
+        with temporary_db_manager() as db:
+            for verdict in ({"ip": None}, {"ip": 123, "attack_type": "XSS"}, {"ip": "198.51.100.4", "attack_type": "XSS"}):
+                ingestor._on_verdict(["line"], verdict)
+            ingestor._drain_verdicts()
+            assert ingestor.fw.get_blacklist() == ["198.51.100.4"] and db.get_total_attacks() == 1
+    finally:
+        aegis_log.AI_STREAM = stream
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_index_matching()
+    test_drop_blocked_lines()
+    test_firewall_dedupe_and_verdicts()
+    test_malformed_verdicts_are_skipped()
+    print("已封禁地址索引测试通过")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 验证多进程共享的 Dashboard 缓存快照
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cache_snapshot import SnapshotReader, SingleRefresher, write_snapshot
+
+
+def test_snapshot_roundtrip():
+    """写入的快照可以被读取，文件变化后读到新数据"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'snapshot.json')
+        reader = SnapshotReader(path, check_interval=0)
+        assert reader.read() is None
+
+        write_snapshot(path, {'last_update': '1', 'blocked_ips': []})
+        assert reader.read()['last_update'] == '1'
+
+        write_snapshot(path, {'last_update': '2', 'blocked_ips': ['1.2.3.4']})
+        assert reader.read()['blocked_ips'] == ['1.2.3.4']
+        assert not [f for f in os.listdir(tmp) if f.endswith('.tmp')]
+
+
+def test_single_refresher_is_exclusive():
+    """同一把锁只能有一个刷新者，释放后其他刷新者可以接管"""
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, 'snapshot.json')
+        lock = os.path.join(tmp, 'refresh.lock')
+        calls = []
+
+        def build(name):
+            return lambda: calls.append(name) or {'by': name}
+
+        first = SingleRefresher(build('first'), snapshot, lock, interval=60)
+        second = SingleRefresher(build('second'), snapshot, lock, interval=60)
+
+        assert first.try_acquire()
+        assert not second.try_acquire()
+        first.refresh_once()
+
+        first.release()
+        assert second.try_acquire()
+        second.refresh_once()
+        second.release()
+
+        assert calls == ['first', 'second']
+        assert SnapshotReader(snapshot, check_interval=0).read() == {'by': 'second'}
+
+
+if __name__ == "__main__":
+    test_snapshot_roundtrip()
+    test_single_refresher_is_exclusive()
+    print("缓存快照测试通过")
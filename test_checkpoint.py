@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 分析进程状态检查点: 文件格式与损坏检测、IP 统计导出/恢复、重启后不重复读取和调用 AI
+"""
+
+import os
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from checkpoint import CheckpointError, Checkpointer, read_checkpoint, write_checkpoint
+from fallback import ReanalysisQueue, set_reanalysis_queue
+from ip_stats import IPStats, get_ip_stats, set_ip_stats
+from log_parsers import LogParser
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from scheduler import BatchScheduler
+from synthetic_logs import _nginx_line
+from verdict_cache import VerdictCache, get_verdict_cache, set_verdict_cache
+
+
+def test_file_format_and_corruption():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.bin")
+        assert read_checkpoint(path) is None
+        write_checkpoint(path, {"raw": b"\x00\x01" * 100, "json": {"a": [1, "二"]}}, saved_at=123.0)
+        assert read_checkpoint(path) == (123.0, {"raw": b"\x00\x01" * 100, "json": {"a": [1, "二"]}})
+
+        data = bytearray(open(path, "rb").read())
+        data[-1] ^= 0xff
+        with open(path, "wb") as f:
+            f.write(data)
+        try:
+            read_checkpoint(path)
+            assert False, "损坏的检查点应当被拒绝"
+        except CheckpointError:
+            pass
+        # 损坏时按冷启动处理
+        assert Checkpointer(path).load() == {}
+        with open(path, "wb") as f:
+            f.write(data[:10])
+        assert Checkpointer(path).load() == {}
+
+
+def test_ip_stats_round_trip():
+    parser = LogParser()
+    now = time.time()
+    stats = IPStats(window=60, buckets=6, width=256, depth=4, top_k=16, hll_precision=8)
+    for i in range(300):
+        line = _nginx_line(f"192.0.2.{i % 7}", 1700000000, "GET", f"/p{i % 13}", 404 if i % 3 else 200, "curl", 0)
+        stats.add(parser.parse(line), now - (i % 50))
+
+    restored = IPStats(window=60, buckets=6, width=256, depth=4, top_k=16, hll_precision=8)
+    restored.load_state(stats.dump_state())
+    assert restored.snapshot(now=now) == stats.snapshot(now=now)
+    assert restored.requests("192.0.2.3", now) == stats.requests("192.0.2.3", now)
+
+    try:
+        IPStats(window=60, buckets=6, width=512, depth=4, top_k=16, hll_precision=8).load_state(stats.dump_state())
+        assert False, "参数不同的状态应当被拒绝"
+    except ValueError:
+        pass
+
+
+def test_warm_restart_resumes_without_duplicate_ai_calls():
+    previous_stats = get_ip_stats()
+    previous_cache = get_verdict_cache()
+    try:
+        with MockAIServer() as server, temporary_db_manager() as db, tempfile.TemporaryDirectory() as tmp:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            log_path = os.path.join(tmp, "access.log")
+            lines = [_nginx_line(f"203.0.113.{i}", 1700000000, "GET", "/index.html", 200, "Mozilla/5.0", 100)
+                     for i in range(1, 4)]
+            lines.append(_nginx_line("198.51.100.7", 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0))
+            with open(log_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            checkpoint_path = os.path.join(tmp, "checkpoint.bin")
+
+            # 第一次运行: 读取并分析全部行, 另有一个批次还在排队
+            set_verdict_cache(VerdictCache())
+            set_ip_stats(IPStats())
+            set_reanalysis_queue(ReanalysisQueue())
+            fw = aegis_log.FirewallAI(dry_run=True)
+            scheduler = BatchScheduler()
+            offsets = {}
+            checkpoint = Checkpointer(checkpoint_path)
+            aegis_log.register_checkpoint(checkpoint, fw, scheduler, offsets)
+            batches = aegis_log.sample_log_lines(batch_size=10, file_paths=[log_path], offsets=offsets)
+            assert batches == [lines]
+            aegis_log.observe_lines(batches[0])
+            assert aegis_log.analyze_lines_ai(batches[0], on_attack=fw.add_ip)["attack_ips"] == ["198.51.100.7"]
+            assert server.requests == 1
+            scheduler.submit(["pending line"], score=5.0)
+            assert checkpoint.save()
+
+            # 重启: 全新的内存状态从检查点恢复
+            set_verdict_cache(VerdictCache())
+            set_ip_stats(IPStats())
+            set_reanalysis_queue(ReanalysisQueue())
+            checkpoint = Checkpointer(checkpoint_path)
+            saved = checkpoint.load()
+            assert saved["blocked"] == ["198.51.100.7"]
+            # 模拟的 iptables 链是新建的, 检查点中的黑名单视为失效
+            assert "198.51.100.7" not in aegis_log.FirewallAI(dry_run=True, blocked=saved["blocked"]).blocked
+            scheduler = BatchScheduler()
+            offsets = {}
+            aegis_log.register_checkpoint(checkpoint, fw, scheduler, offsets)
+            assert get_ip_stats().requests("198.51.100.7") == 1
+            assert scheduler.get(timeout=0) == ["pending line"]
+
+            # 没有新内容时不再返回已分析过的尾部, 重新读到的相同批次也不再调用 AI
+            assert aegis_log.sample_log_lines(batch_size=10, file_paths=[log_path], offsets=offsets) == []
+            assert aegis_log.analyze_lines_ai(lines, on_attack=fw.add_ip, blocked=fw.blocked)["attack_ips"] == []
+            assert server.requests == 1
+            assert db.get_total_attacks() == 1
+            # 手动解封后再读到相同批次: 缓存的判定同样回调, IP 重新封禁, 仍不调用 AI
+            fw.remove_ip("198.51.100.7")
+            assert "198.51.100.7" not in fw.blocked
+            result = aegis_log.analyze_lines_ai(lines, on_attack=fw.add_ip, blocked=fw.blocked)
+            assert result["attack_ips"] == ["198.51.100.7"] and "198.51.100.7" in fw.blocked
+            assert server.requests == 1
+
+            # 只读取新写入的完整行, 未写完的半行留到下次
+            with open(log_path, "a") as f:
+                f.write(lines[0] + "\n" + "203.0.113.9 - - [partial")
+            assert aegis_log.sample_log_lines(batch_size=10, file_paths=[log_path], offsets=offsets) == [[lines[0]]]
+            with open(log_path, "a") as f:
+                f.write(" line\n")
+            assert aegis_log.sample_log_lines(batch_size=10, file_paths=[log_path],
+                                              offsets=offsets) == [["203.0.113.9 - - [partial line"]]
+    finally:
+        aegis_log.set_ai_client(None)
+        set_ip_stats(previous_stats)
+        set_verdict_cache(previous_cache)
+        set_reanalysis_queue(None)
+
+
+if __name__ == "__main__":
+    test_file_format_and_corruption()
+    test_ip_stats_round_trip()
+    test_warm_restart_resumes_without_duplicate_ai_calls()
+    print("状态检查点测试通过")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - AI 熔断器、本地降级分类与恢复后的复核
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN, get_ai_breaker, set_ai_breaker
+from fallback import ReanalysisQueue, classify_locally, get_reanalysis_queue, set_reanalysis_queue
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from scheduler import BatchScheduler
+from synthetic_logs import _nginx_line, _sshd_line
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_states():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=60, min_calls=4, failure_rate=0.5, cooldown=30, half_open_probes=1, clock=clock)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    # 调用数不足 min_calls 时不熔断
+    assert breaker.state == STATE_CLOSED
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow() and breaker.rejecting()
+
+    clock.now += 31
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    # 半开状态只放行一个探测请求
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+
+    clock.now += 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED and breaker.allow()
+
+    # 窗口外的失败不计入
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 61
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+
+
+def test_classify_locally():
+    lines = [
+        _nginx_line("198.51.100.1", 1700000000, "GET", "/item?id=1%20UNION%20SELECT%201", 500, "Mozilla/5.0", 0),
+        _nginx_line("198.51.100.2", 1700000000, "GET", "/index.html", 200, "Mozilla/5.0", 100),
+        _sshd_line("198.51.100.3", 1700000000, "root", True, 1),
+    ]
+    # 单次登录失败不足以判定爆破
+    assert classify_locally(lines) == [
+        {"ip": "198.51.100.1", "attack_type": "SQL Injection", "analyzed_by": "signature"}
+    ]
+
+
+def test_degraded_mode_and_recovery():
+    previous_breaker = get_ai_breaker()
+    previous_queue = get_reanalysis_queue()
+    clock = FakeClock()
+    try:
+        with MockAIServer(fail_rate=1.0) as server, temporary_db_manager() as db:
+            set_ai_breaker(CircuitBreaker(window=60, min_calls=2, failure_rate=0.5, cooldown=30, clock=clock))
+            set_reanalysis_queue(ReanalysisQueue(maxlen=10))
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            batches = [[_nginx_line(f"198.51.100.{i}", 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0)]
+                       for i in range(1, 5)]
+            for batch in batches[:2]:
+                # 调用失败: 返回字典而不是空列表，本地分类结果照常返回
+                result = aegis_log.analyze_lines_ai(batch)
+                assert result["attack_types"] == ["Scanning"]
+            assert get_ai_breaker().state == STATE_OPEN
+            sent = server.requests
+
+            # 熔断期间不再请求 AI
+            for batch in batches[2:]:
+                assert aegis_log.analyze_lines_ai(batch)["attack_ips"] == [batch[0].split()[0]]
+            assert server.requests == sent
+            assert len(get_reanalysis_queue()) == 4
+            assert db.get_attack_type_statistics() == {"Scanning": 4}
+
+            # 熔断期间调度器不计量
+            scheduler = BatchScheduler(rate_per_minute=1, token_budget_per_minute=0)
+            scheduler.requests.tokens = 0
+            assert get_reanalysis_queue().drain_to(scheduler, get_ai_breaker()) == 0
+            scheduler.submit(batches[0])
+            assert scheduler.get(timeout=0) == batches[0]
+
+            # 冷却后探测成功，复核队列交回调度器
+            server.fail_rate = 0.0
+            clock.now += 31
+            aegis_log.analyze_lines_ai(batches[0])
+            assert get_ai_breaker().state == STATE_CLOSED
+            scheduler = BatchScheduler(rate_per_minute=0, token_budget_per_minute=0)
+            assert get_reanalysis_queue().drain_to(scheduler, get_ai_breaker()) == 4
+            assert len(scheduler) == 4 and len(get_reanalysis_queue()) == 0
+    finally:
+        aegis_log.set_ai_client(None)
+        set_reanalysis_queue(previous_queue)
+        set_ai_breaker(previous_breaker)
+
+
+def test_reanalysis_attempts_are_bounded():
+    reanalysis = ReanalysisQueue(maxlen=10, max_attempts=2)
+    batch = [_nginx_line("198.51.100.9", 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0)]
+    scheduler = BatchScheduler(rate_per_minute=0, token_budget_per_minute=0)
+    breaker = CircuitBreaker(window=60, min_calls=2, failure_rate=0.5, cooldown=30, clock=FakeClock())
+    # 复核时 AI 仍然失败: 批次再次入队, 达到次数上限后丢弃而不是无限循环
+    assert reanalysis.put(batch) and reanalysis.drain_to(scheduler, breaker) == 1
+    assert reanalysis.put(scheduler.get(timeout=0)) and reanalysis.drain_to(scheduler, breaker) == 1
+    assert not reanalysis.put(scheduler.get(timeout=0))
+    assert len(reanalysis) == 0 and reanalysis.pending() == []
+    # 其它批次不受影响
+    assert reanalysis.put(batch + batch)
+
+
+def test_callback_errors_do_not_trip_breaker():
+    previous_breaker = get_ai_breaker()
+    previous_queue = get_reanalysis_queue()
+    stream = aegis_log.AI_STREAM
+    content = ('{"attack_ips": [{"ip": "203.0.113.31", "attack_type": "XSS"}, '
+               '{"ip": "203.0.113.32", "attack_type": "XSS"}]}')
+    try:
+        with MockAIServer(content=content) as server:
+            set_ai_breaker(CircuitBreaker(window=60, min_calls=1, failure_rate=0.5, cooldown=30, clock=FakeClock()))
+            set_reanalysis_queue(ReanalysisQueue(maxlen=10))
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            errors = aegis_log.AI_ERRORS.value
+            for i, aegis_log.AI_STREAM in enumerate((True, False)):
+                delivered = []
+
+                def on_verdict(verdict):
+                    # 模拟写库/封禁失败
+                    if verdict["ip"] == "203.0.113.31":
+                        raise RuntimeError("database is locked")
+                    delivered.append(verdict["ip"])
+
+                batch = [_nginx_line("203.0.113.31", 1700000100 + i, "GET", "/?q=<script>", 200, "x", 1)]
+                aegis_log.request_ai_verdicts(batch, on_verdict)
+                # 回调失败不影响同一响应中的其它判定, 也不算作 AI 调用失败
+                assert delivered == ["203.0.113.32"]
+            assert aegis_log.AI_ERRORS.value == errors
+            assert get_ai_breaker().state == STATE_CLOSED and len(get_reanalysis_queue()) == 0
+            assert server.requests == 2
+    finally:
+        aegis_log.AI_STREAM = stream
+        aegis_log.set_ai_client(None)
+        set_reanalysis_queue(previous_queue)
+        set_ai_breaker(previous_breaker)
+
+
+if __name__ == "__main__":
+    test_breaker_states()
+    test_classify_locally()
+    test_degraded_mode_and_recovery()
+    test_reanalysis_attempts_are_bounded()
+    test_callback_errors_do_not_trip_breaker()
+    print("熔断与降级测试通过")
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - agent/collector 模式: 单机启动 collector 和多个 agent，
+任一 agent 上发现的攻击者会在所有 agent 上被封禁
+"""
+
+import io
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+import zlib
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from cluster import (Agent, Collector, FRAME_BATCH, FRAME_CHALLENGE, MAX_FRAME_SIZE, encode_frame, parse_address,
+                     read_frame)
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from synthetic_logs import write_log_file
+
+
+def _wait_for(predicate, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def test_frame_roundtrip():
+    lines = ["203.0.113.7 - - GET /?id=1' or 1=1 HTTP/1.1"] * 50
+    data = encode_frame(FRAME_BATCH, {"lines": lines})
+    # 重复内容压缩后应明显变小
+    assert len(data) < sum(len(l) for l in lines) // 4
+    assert read_frame(io.BytesIO(data)) == (FRAME_BATCH, {"lines": lines})
+    assert read_frame(io.BytesIO(data[:3])) is None
+
+    # 压缩后很小、解压后超过上限的帧直接拒绝
+    body = zlib.compress(b" " * (MAX_FRAME_SIZE + 1), 9)
+    try:
+        read_frame(io.BytesIO(struct.pack("!BI", FRAME_BATCH, len(body)) + body))
+        assert False, "解压后超过上限的帧应被拒绝"
+    except ValueError:
+        pass
+
+
+def test_non_local_address_requires_secret():
+    assert parse_address("tcp://:7410")[1] == ("127.0.0.1", 7410)
+    for cls, args in ((Collector, ()), (Agent, ([], None))):
+        try:
+            cls("tcp://10.0.0.1:7410", *args, secret="")
+            assert False, "未配置密钥时不允许非本机地址"
+        except ValueError:
+            pass
+    # 本机地址或配置了密钥时可以创建
+    Collector("tcp://127.0.0.1:0", secret="")
+    Collector("tcp://10.0.0.1:7410", secret="s3cret")
+
+
+def test_rejects_unauthenticated_agents():
+    collector = None
+    agent = None
+    try:
+        with temporary_db_manager() as db, tempfile.TemporaryDirectory() as tmp:
+            # 重启后的 collector 从数据库恢复黑名单
+            db.add_attack_record("198.51.100.9", "SQL Injection", "id=1 OR 1=1", severity=3, is_blocked=True)
+            address = f"unix://{os.path.join(tmp, 'collector.sock')}"
+            collector = Collector(address, secret="s3cret")
+            collector.start()
+            assert collector.blocked == {"198.51.100.9": "SQL Injection"}
+
+            # 密钥错误的 agent 收不到黑名单，也不会出现在 agent 列表中
+            agent = Agent(address, [], aegis_log.FirewallAI(dry_run=True), agent_id="intruder",
+                          tail_mode=False, flush_interval=0.1, secret="wrong")
+            agent.start()
+            time.sleep(0.5)
+            assert agent.blocked == set() and collector.agents == []
+            agent.stop()
+
+            # 不握手直接发送批次的连接被断开
+            raw = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            raw.connect(parse_address(address)[1])
+            stream = raw.makefile("rb")
+            assert read_frame(stream)[0] == FRAME_CHALLENGE
+            raw.sendall(encode_frame(FRAME_BATCH, {"lines": ["203.0.113.7 - - GET /?id=1' or 1=1 HTTP/1.1"]}))
+            assert read_frame(stream) is None
+            raw.close()
+
+            agent = Agent(address, [], aegis_log.FirewallAI(dry_run=True), agent_id="host0",
+                          tail_mode=False, flush_interval=0.1, secret="s3cret")
+            agent.start()
+            assert _wait_for(lambda: agent.blocked == {"198.51.100.9"})
+            assert collector.agents == ["host0"]
+    finally:
+        if agent is not None:
+            agent.stop()
+        if collector is not None:
+            collector.stop()
+
+
+def test_idle_agent_reconnects_after_collector_restart():
+    collectors = []
+    agent = None
+    try:
+        with temporary_db_manager(), tempfile.TemporaryDirectory() as tmp:
+            address = f"unix://{os.path.join(tmp, 'collector.sock')}"
+            collectors.append(Collector(address))
+            collectors[-1].start()
+            agent = Agent(address, [], aegis_log.FirewallAI(dry_run=True), agent_id="idle",
+                          tail_mode=False, flush_interval=0.1)
+            agent.start()
+            assert _wait_for(lambda: collectors[-1].agents == ["idle"])
+            collectors[-1].stop()
+
+            # 没有批次要发送的 agent 在 collector 重启后同样重连，继续接收封禁广播
+            collectors.append(Collector(address))
+            collectors[-1].start()
+            assert _wait_for(lambda: collectors[-1].agents == ["idle"])
+            collectors[-1].broadcast([{"ip": "198.51.100.12", "attack_type": "XSS"}])
+            assert _wait_for(lambda: agent.blocked == {"198.51.100.12"})
+    finally:
+        if agent is not None:
+            agent.stop()
+        for collector in collectors:
+            collector.stop()
+
+
+def test_blocks_fan_out_to_all_agents():
+    server = MockAIServer()
+    server.start()
+    collector = None
+    agents = []
+    try:
+        with temporary_db_manager(), tempfile.TemporaryDirectory() as tmp:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            address = f"unix://{os.path.join(tmp, 'collector.sock')}"
+            collector = Collector(address, batch_size=20, ai_concurrency=2)
+            collector.start()
+
+            truth = {}
+            for i in range(3):
+                path = os.path.join(tmp, f"host{i}.log")
+                truth.update(write_log_file(path, 100, attack_ratio=0.1, attackers=3, seed=i))
+                agent = Agent(address, [path], aegis_log.FirewallAI(dry_run=True), agent_id=f"host{i}",
+                              tail_mode=False, batch_lines=30, flush_interval=0.1)
+                agent.start()
+                agents.append(agent)
+
+            assert _wait_for(lambda: all(a.blocked == set(truth) for a in agents))
+            for agent in agents:
+                assert set(agent.fw.get_blacklist()) == set(truth)
+            assert set(collector.blocked) == set(truth)
+            assert sorted(collector.agents) == ["host0", "host1", "host2"]
+            # 每行只由 collector 分析一次
+            assert _wait_for(lambda: sum(a.lines_sent for a in agents) == 300)
+
+            # 之后连接的 agent 会先收到完整黑名单
+            late = Agent(address, [], aegis_log.FirewallAI(dry_run=True), agent_id="late",
+                         tail_mode=False, flush_interval=0.1)
+            late.start()
+            agents.append(late)
+            assert _wait_for(lambda: late.blocked == set(truth))
+    finally:
+        for agent in agents:
+            agent.stop()
+        if collector is not None:
+            collector.stop()
+        server.stop()
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_frame_roundtrip()
+    test_non_local_address_requires_secret()
+    test_rejects_unauthenticated_agents()
+    test_idle_agent_reconnects_after_collector_restart()
+    test_blocks_fan_out_to_all_agents()
+    print("agent/collector 测试通过")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 检测效果评估: 按类型计算精确率/召回率、在配置组合上运行标注语料、录制与重放 AI 响应
+"""
+
+import json
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from evaluate import (ReplayAIServer, ResponseRecorder, build_prompt, load_corpus, load_recordings, run_config,
+                      run_grid, score, write_corpus)
+from mock_ai_server import MockAIServer
+
+
+def test_score():
+    truth = {("192.0.2.1", "XSS"), ("192.0.2.2", "XSS"), ("192.0.2.3", "Scanning")}
+    predicted = {("192.0.2.1", "XSS"), ("192.0.2.3", "SQL Injection"), ("192.0.2.9", "Scanning")}
+    result = score(truth, predicted)
+    assert result["per_type"]["XSS"] == {"tp": 1, "fp": 0, "fn": 1, "precision": 1.0, "recall": 0.5, "f1": 0.6667}
+    assert result["per_type"]["Scanning"]["fp"] == 1 and result["per_type"]["Scanning"]["fn"] == 1
+    assert result["per_type"]["SQL Injection"]["precision"] == 0.0
+    assert result["overall"]["tp"] == 1 and result["overall"]["recall"] == 0.3333
+    # 只看 IP: 192.0.2.3 被判为攻击 (类型错误) 也算检出
+    assert result["detection"] == {"tp": 2, "fp": 1, "fn": 1, "precision": 0.6667, "recall": 0.6667, "f1": 0.6667}
+
+
+def test_load_corpus():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "corpus.jsonl")
+        assert write_corpus(path, 200, attack_ratio=0.2, attackers=5, seed=1) == 200
+        corpus = load_corpus(path)
+        assert len(corpus) == 200 and {label for _, _, label in corpus} >= {None, "XSS", "Scanning"}
+
+        with open(path, "a") as f:
+            f.write(json.dumps({"line": "x", "ip": "192.0.2.1", "label": "Phishing"}) + "\n")
+        try:
+            load_corpus(path)
+            assert False, "标签必须是 ATTACK_TYPES_EN 中的类型"
+        except ValueError as e:
+            assert ":201" in str(e)
+
+
+def test_grid_and_record_replay():
+    try:
+        with MockAIServer() as server, tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "corpus.jsonl")
+            write_corpus(path, 400, attack_ratio=0.1, attackers=10, seed=2)
+            corpus = load_corpus(path)
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            results = run_grid(corpus, batch_sizes=(5, 40), triage_models=("", "cheap"))
+            assert [(r["config"]["batch_size"], r["config"]["triage_model"]) for r in results] == [
+                (5, "none"), (5, "cheap"), (40, "none"), (40, "cheap")]
+            for r in results:
+                assert r["overall"]["recall"] == 1.0 and r["overall"]["precision"] == 1.0, r
+                assert r["lines"] == 400 and r["ai_errors"] == 0 and r["lines_per_sec"] > 0
+            # 批次越大调用越少; 初筛只把阳性批次交给完整模型
+            assert sum(results[2]["api_calls"].values()) < sum(results[0]["api_calls"].values())
+            assert results[1]["api_calls"]["full"] < results[0]["api_calls"]["full"]
+            assert results[1]["tokens"]["triage_completion"] > 0
+
+            # 录制真实 (此处为桩服务) 响应, 再离线重放
+            recording = os.path.join(tmp, "responses.jsonl")
+            client = OpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+            aegis_log.set_ai_client(ResponseRecorder(client, recording))
+            recorded = run_config(corpus, batch_size=20, stream=False)
+            requests = server.requests
+            with ReplayAIServer(load_recordings(recording), latency_scale=0) as replay:
+                aegis_log.set_ai_client(OpenAI(api_key="test", base_url=replay.base_url, max_retries=0))
+                replayed = run_config(corpus, batch_size=20, stream=True)
+                assert replay.misses == 0 and server.requests == requests
+                assert replayed["per_type"] == recorded["per_type"]
+                assert replayed["tokens"] == recorded["tokens"]
+
+                # 提示词不同的请求没有录制, 按 AI 调用失败处理
+                run_config(corpus, batch_size=20, prompt=build_prompt("只把 SQL 注入判为攻击"))
+                assert replay.misses > 0
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_score()
+    test_load_corpus()
+    test_grid_and_record_replay()
+    print("检测效果评估测试通过")
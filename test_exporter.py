@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 攻击记录/封禁 IP 的流式导出: 分块读取与续传、时间过滤、NDJSON/CSV/gzip 编码、/api/export
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from exporter import encode_rows, export_stream, parse_time
+from models import DatabaseManager, temporary_db_manager
+
+
+def _fill(db, count):
+    """批量写入 count 条攻击记录，每条间隔 1 分钟，从 2024-01-01 00:00:00 开始"""
+    with sqlite3.connect(db.db_path) as conn:
+        conn.executemany('''
+            INSERT INTO attack_records (timestamp, source_ip, attack_type, log_content, severity, is_blocked)
+            VALUES (datetime('2024-01-01', ? || ' minutes'), ?, ?, ?, 3, 1)
+        ''', [(i, f"198.51.100.{i % 200}", "XSS" if i % 2 else "Scanning", f'GET /?q=<script>{i}</script> "x",y')
+              for i in range(count)])
+
+
+def test_export_rows_and_resume():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        _fill(db, 50)
+        ids = [row["id"] for row in db.export_rows("attacks", chunk_size=7)]
+        assert ids == list(range(1, 51))
+        assert [row["id"] for row in db.export_rows("attacks", after_id=45, chunk_size=7)] == [46, 47, 48, 49, 50]
+
+        since, until = parse_time("2024-01-01T00:10:00"), parse_time("2024-01-01 00:20:00")
+        assert since == "2024-01-01 00:10:00"
+        assert parse_time("1704067800") == since
+        assert parse_time("2024-01-01T08:10:00+08:00") == since
+        rows = list(db.export_rows("attacks", since=since, until=until, filters={"attack_type": "XSS"}, chunk_size=3))
+        assert [row["id"] for row in rows] == [12, 14, 16, 18, 20]
+        try:
+            list(db.export_rows("attacks", filters={"log_content": "x"}))
+            assert False, "不允许按任意列过滤"
+        except ValueError:
+            pass
+
+        db.add_attack_record("203.0.113.5", "SQL Injection", "id=1 OR 1=1", severity=3, is_blocked=True)
+        blocked = list(db.export_rows("blocked_ips"))
+        assert len(blocked) == 1 and blocked[0]["ip_address"] == "203.0.113.5"
+
+        # 再次检测到时 last_detected 与新记录一样写 UTC，按 UTC 时间范围过滤
+        db.add_attack_record("203.0.113.5", "XSS", "<script>", severity=3, is_blocked=True)
+        row = list(db.export_rows("blocked_ips"))[0]
+        utc_now = datetime.now(timezone.utc)
+        assert abs((datetime.fromisoformat(row["last_detected"]).replace(tzinfo=timezone.utc) - utc_now).total_seconds()) < 60
+        since = parse_time((utc_now - timedelta(minutes=1)).isoformat())
+        assert [r["ip_address"] for r in db.export_rows("blocked_ips", since=since)] == ["203.0.113.5"]
+        # attack_records.block_timestamp 同样是 UTC，与 timestamp 列一致
+        record = list(db.export_rows("attacks"))[-1]
+        assert record["block_timestamp"] == record["timestamp"]
+
+
+def test_encodings():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        _fill(db, 20)
+        db.add_attack_record("203.0.113.5", "SQL Injection", "id=1", severity=3, is_blocked=True)
+
+        ndjson = b"".join(export_stream(db, "attacks")).decode("utf-8")
+        rows = [json.loads(line) for line in ndjson.splitlines()]
+        assert len(rows) == 21 and rows[0]["is_blocked"] is True
+        assert rows[3]["log_content"] == 'GET /?q=<script>3</script> "x",y'
+
+        text = b"".join(export_stream(db, "attacks", "csv")).decode("utf-8")
+        parsed = list(csv.DictReader(io.StringIO(text)))
+        assert [int(r["id"]) for r in parsed] == list(range(1, 22))
+        assert parsed[3]["log_content"] == 'GET /?q=<script>3</script> "x",y'
+        blocked = list(csv.DictReader(io.StringIO(b"".join(export_stream(db, "blocked_ips", "csv")).decode())))
+        assert json.loads(blocked[0]["attack_types"]) == ["SQL Injection"]
+
+        assert gzip.decompress(b"".join(export_stream(db, "attacks", compress=True))).decode() == ndjson
+
+        # 进度只包含已经取走的块，可以直接作为 after_id 续传
+        progress = {}
+        list(encode_rows(db.export_rows("attacks"), "ndjson", db.EXPORT_TABLES["attacks"][2], progress))
+        assert progress == {"rows": 21, "last_id": 21}
+
+
+def _export_peak(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        _fill(db, count)
+        tracemalloc.start()
+        try:
+            total = 0
+            for chunk in export_stream(db, "attacks", "csv", compress=True):
+                total += len(chunk)
+            return total, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def test_memory_is_constant():
+    small_total, small_peak = _export_peak(3000)
+    large_total, large_peak = _export_peak(30000)
+    # 行数增加 10 倍，峰值内存只与块大小有关
+    assert large_total > 5 * small_total
+    assert large_peak < small_peak * 1.5, (small_peak, large_peak)
+
+
+def test_export_api():
+    with temporary_db_manager() as db:
+        _fill(db, 30)
+        client = app.app.test_client()
+
+        assert client.get("/api/export/users").status_code == 404
+        assert client.get("/api/export/attacks?format=xml").status_code == 400
+        assert client.get("/api/export/attacks?since=yesterday").status_code == 400
+
+        response = client.get("/api/export/attacks?after_id=25")
+        assert response.mimetype == "application/x-ndjson"
+        assert [json.loads(line)["id"] for line in response.data.splitlines()] == [26, 27, 28, 29, 30]
+
+        response = client.get("/api/export/attacks?format=csv&gzip=1&since=2024-01-01T00:25:00"
+                              "&attack_type=Scanning")
+        assert response.headers["Content-Encoding"] == "gzip"
+        parsed = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+        assert [r["id"] for r in parsed] == ["27", "29"]
+
+
+if __name__ == "__main__":
+    test_export_rows_and_resume()
+    test_encodings()
+    test_memory_is_constant()
+    test_export_api()
+    print("流式导出测试通过")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 离线 GeoIP/ASN 库: CSV 转换、mmap 查询与 LRU 缓存、封禁 IP 记录国家/ASN、/api/asn-stats
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app
+import geoip
+from geoip import GeoIPDatabase, build_database, read_ranges
+from models import DatabaseManager, temporary_db_manager
+
+RANGES_CSV = """network,country_iso_code,autonomous_system_number,autonomous_system_organization
+203.0.113.0/24,JP,64500,Example Net
+198.51.100.0/24,US,64501,"Doc, Inc."
+198.51.100.128/25,CA,64502,Overlap
+2001:db8::/32,DE,64500,Example Net
+"""
+
+RANGES_TSV = "192.0.2.0\t192.0.2.9\t64510\tFR\tSmall Range\n10.0.0.0\t10.255.255.255\t0\tNone\tNot routed\n"
+
+
+def _build(tmp):
+    source = os.path.join(tmp, "ranges.csv")
+    with open(source, "w") as f:
+        f.write(RANGES_CSV)
+    path = os.path.join(tmp, "geoip.dat")
+    # 与 198.51.100.0/24 重叠的 /25 被丢弃
+    assert build_database(read_ranges(source), path) == 3
+    return path
+
+
+def test_build_and_lookup():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = GeoIPDatabase(_build(tmp), cache_size=2)
+        try:
+            assert database.lookup("203.0.113.7") == {"country": "JP", "asn": 64500, "as_org": "Example Net"}
+            assert database.lookup("198.51.100.200") == {"country": "US", "asn": 64501, "as_org": "Doc, Inc."}
+            assert database.lookup("2001:db8::1")["country"] == "DE"
+            assert database.lookup("8.8.8.8") is None
+            assert database.lookup("2001:db9::1") is None
+            assert database.lookup("not-an-ip") is None
+            # LRU 只保留最近 2 个 IP
+            assert len(database._cache) == 2
+            assert sorted(database.asn_networks(64500)) == ["2001:db8::/32", "203.0.113.0/24"]
+        finally:
+            database.close()
+
+        tsv = os.path.join(tmp, "ip2asn.tsv")
+        with open(tsv, "w") as f:
+            f.write(RANGES_TSV)
+        path = os.path.join(tmp, "ip2asn.dat")
+        build_database(read_ranges(tsv, "ip2asn"), path)
+        database = GeoIPDatabase(path)
+        try:
+            assert database.lookup("192.0.2.9") == {"country": "FR", "asn": 64510, "as_org": "Small Range"}
+            assert database.lookup("192.0.2.10") is None
+            assert database.lookup("10.1.2.3") == {"country": None, "asn": None, "as_org": None}
+        finally:
+            database.close()
+
+
+def test_reload_closes_previous_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _build(tmp)
+        try:
+            first = geoip.get_geoip(path)
+            assert geoip.get_geoip(path) is first
+            # 库文件更新后重新打开，旧库的 mmap 随即释放
+            os.utime(path, (0, os.stat(path).st_mtime + 10))
+            second = geoip.get_geoip(path)
+            assert second is not first and first._mm.closed and not second._mm.closed
+            assert second.lookup("203.0.113.7")["asn"] == 64500
+        finally:
+            database = geoip.get_geoip(path)
+            geoip.set_geoip(None)
+            database.close()
+
+
+def test_blocked_ips_enrichment():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        # 库文件生成之前封禁的 IP 没有国家/ASN
+        geoip.set_geoip(None)
+        db.add_attack_record("203.0.113.1", "Scanning", "GET /.env", severity=3, is_blocked=True)
+        database = GeoIPDatabase(_build(tmp))
+        try:
+            geoip.set_geoip(database)
+            db.add_attack_record("203.0.113.2", "Scanning", "GET /.git", severity=3, is_blocked=True)
+            db.add_attack_record("198.51.100.9", "SQL Injection", "id=1 OR 1=1", severity=3, is_blocked=True)
+            db.add_attack_record("198.51.100.9", "XSS", "<script>", severity=3, is_blocked=True)
+            blocked = {ip["ip_address"]: ip for ip in db.get_blocked_ips()}
+            assert blocked["203.0.113.1"]["asn"] is None
+            assert blocked["203.0.113.2"]["asn"] == 64500
+            assert blocked["198.51.100.9"]["as_org"] == "Doc, Inc."
+
+            assert db.enrich_blocked_ips() == 1
+            assert db.enrich_blocked_ips() == 0
+            stats = db.get_asn_statistics()
+            assert [(s["asn"], s["ip_count"], s["attack_count"]) for s in stats] == [(64500, 2, 2), (64501, 1, 2)]
+            assert stats[0]["countries"] == ["JP"]
+
+            with temporary_db_manager(db.db_path):
+                response = app.app.test_client().get("/api/asn-stats?limit=1")
+                assert response.status_code == 200
+                assert response.get_json() == stats[:1]
+        finally:
+            geoip.set_geoip(None)
+            database.close()
+
+
+if __name__ == "__main__":
+    test_build_and_lookup()
+    test_reload_closes_previous_database()
+    test_blocked_ips_enrichment()
+    print("GeoIP/ASN 测试通过")
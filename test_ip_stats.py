@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 固定内存的按 IP 滑动窗口统计 (Count-Min Sketch / HyperLogLog / Space-Saving)
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ip_stats import CountMinSketch, HyperLogLog, SpaceSaving, IPStats, hash64
+from log_parsers import LogRecord, parse_line
+
+
+def _req(ip, path="/", status=200, port=None, auth=None):
+    return LogRecord("combined", ip, "", path=path, status=status, port=port, auth=auth)
+
+
+def test_sketches():
+    cms = CountMinSketch(256, 4)
+    for i in range(2000):
+        cms.add(hash64(f"10.0.{i % 200}.1"))
+    # 只会高估，不会低估
+    assert all(cms.estimate(hash64(f"10.0.{i}.1")) >= 10 for i in range(200))
+
+    hll = HyperLogLog(12)
+    for i in range(20000):
+        hll.add(hash64(str(i)))
+    assert abs(hll.count() - 20000) < 20000 * 0.05
+    assert HyperLogLog(12).count() == 0
+
+    ss = SpaceSaving(10)
+    for i in range(5000):
+        ss.offer("heavy" if i % 3 == 0 else f"noise-{i}")
+    assert len(ss.entries) == 10
+    assert ss.entries["heavy"][0] >= 5000 // 3
+
+
+def test_window_statistics():
+    stats = IPStats(window=60, buckets=6, width=512, depth=4, top_k=20)
+    now = 1000.0
+    for i in range(300):
+        stats.add(_req("192.0.2.9", path=f"/p{i % 30}", status=404), now)
+        stats.add(_req(f"10.1.{i // 250}.{i % 250}"), now)
+    for _ in range(50):
+        stats.add(parse_line("Oct 10 13:55:36 web01 sshd[1]: Failed password for root from 198.51.100.3 port 22 ssh2"), now)
+
+    assert stats.requests("192.0.2.9", now) >= 300
+    assert stats.failures("192.0.2.9", now) >= 300
+    assert stats.failures("198.51.100.3", now) >= 50
+
+    top = stats.top(2, now)
+    assert [row["ip"] for row in top] == ["192.0.2.9", "198.51.100.3"]
+    assert 24 <= top[0]["distinct_paths"] <= 36
+    assert top[1]["distinct_ports"] == 1
+
+    snap = stats.snapshot(5, now)
+    json.dumps(snap)
+    assert snap["requests"] == 650
+    assert 280 <= snap["distinct_ips"] <= 325
+
+    # 子窗口逐个过期，超过窗口后全部清零
+    assert stats.requests("192.0.2.9", now + 55) >= 300
+    assert stats.requests("192.0.2.9", now + 61) == 0
+    assert stats.snapshot(5, now + 61)["top_ips"] == []
+
+
+def test_memory_is_fixed():
+    stats = IPStats(window=60, buckets=6, width=512, depth=4, top_k=20)
+    before = stats.memory_bytes()
+    for i in range(20000):
+        stats.add(_req(f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}"), 1000.0 + i * 0.001)
+    assert stats.memory_bytes() == before
+    assert all(len(b.heavy.entries) <= 20 for b in stats._buckets)
+
+
+if __name__ == "__main__":
+    test_sketches()
+    test_window_statistics()
+    test_memory_is_fixed()
+    print("IP 统计测试通过")
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 验证模块导入无副作用 (不打印、不创建文件、不启动线程、不加载 openai)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+CHECK_SCRIPT = """
+import sys, threading
+sys.path.insert(0, {root!r})
+import config, logger, models, aegis_log, app
+assert 'openai' not in sys.modules, 'openai 被提前导入'
+assert threading.active_count() == 1, '导入时启动了后台线程'
+"""
+
+
+def test_imports_are_side_effect_free():
+    """在空目录中导入所有模块，不应产生输出或文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run(
+            [sys.executable, '-c', CHECK_SCRIPT.format(root=ROOT)],
+            cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        assert result.returncode == 0, result.stderr
+        assert result.stdout == ''
+        assert os.listdir(tmp) == []
+
+
+if __name__ == "__main__":
+    test_imports_are_side_effect_free()
+    print("导入副作用测试通过")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 结构化日志解析: nginx/Apache 访问日志、sshd、内核 netfilter 和通用 syslog
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from log_parsers import (
+    LogParser, parse_line, detect_format, detect_file_format, parse_clf_time,
+    FORMAT_COMBINED, FORMAT_COMMON, FORMAT_SSHD, FORMAT_NETFILTER, FORMAT_SYSLOG, FORMAT_RAW,
+    AUTH_FAILED, AUTH_ACCEPTED, AUTH_INVALID_USER
+)
+from synthetic_logs import generate_lines
+
+NGINX = '203.0.113.7 - - [10/Oct/2024:13:55:36 +0800] "GET /index.php?id=1 HTTP/1.1" 404 153 "-" "sqlmap/1.7"'
+APACHE_COMMON = '198.51.100.2 - frank [10/Oct/2000:13:55:36 -0700] "POST /login HTTP/1.0" 401 2326'
+SSHD_FAILED = 'Oct 10 13:55:36 web01 sshd[4242]: Failed password for invalid user admin from 192.0.2.9 port 51234 ssh2'
+SSHD_ACCEPTED = 'Oct 10 13:55:37 web01 sshd[4243]: Accepted publickey for deploy from 192.0.2.10 port 40000 ssh2'
+SSHD_INVALID = 'Oct 10 13:55:38 web01 sshd[4244]: Invalid user oracle from 192.0.2.11 port 40001'
+NETFILTER = ('Oct 10 13:55:39 fw01 kernel: [12345.678] IN=eth0 OUT= MAC=00:00 SRC=192.0.2.55 DST=10.0.0.1 '
+             'LEN=60 TOS=0x00 TTL=52 ID=1 DF PROTO=TCP SPT=4444 DPT=22 WINDOW=29200 RES=0x00 SYN URGP=0')
+SYSLOG = '2024-10-10T13:55:40.123+00:00 app01 myapp[77]: rejected request from 192.0.2.77'
+
+
+def test_access_logs():
+    r = parse_line(NGINX)
+    assert r.fmt == FORMAT_COMBINED
+    assert (r.ip, r.method, r.path, r.status, r.size) == ("203.0.113.7", "GET", "/index.php?id=1", 404, 153)
+    assert r.user_agent == "sqlmap/1.7"
+    assert r.timestamp == parse_clf_time("10/Oct/2024:05:55:36 +0000")
+
+    r = parse_line(APACHE_COMMON)
+    assert r.fmt == FORMAT_COMMON
+    assert (r.ip, r.user, r.status, r.auth, r.user_agent) == ("198.51.100.2", "frank", 401, AUTH_FAILED, None)
+
+
+def test_sshd_logs():
+    r = parse_line(SSHD_FAILED)
+    assert (r.fmt, r.ip, r.user, r.auth, r.port) == (FORMAT_SSHD, "192.0.2.9", "admin", AUTH_INVALID_USER, 51234)
+    assert parse_line(SSHD_ACCEPTED).auth == AUTH_ACCEPTED
+    assert parse_line(SSHD_INVALID).user == "oracle"
+    assert parse_line(SSHD_FAILED.replace("invalid user ", "")).auth == AUTH_FAILED
+
+
+def test_netfilter_and_syslog():
+    r = parse_line(NETFILTER)
+    assert (r.fmt, r.ip, r.proto, r.port, r.flags) == (FORMAT_NETFILTER, "192.0.2.55", "TCP", 22, "SYN")
+
+    r = parse_line(SYSLOG)
+    assert (r.fmt, r.ip) == (FORMAT_SYSLOG, "192.0.2.77")
+    assert r.timestamp is not None
+
+    assert parse_line("") is None
+    r = parse_line("custom|192.0.2.99|blocked")
+    assert (r.fmt, r.ip) == (FORMAT_RAW, "192.0.2.99")
+    assert parse_line("-- MARK --").ip is None
+
+
+def test_detect_format_and_sticky_parser():
+    nginx = [line for line, _, _ in generate_lines(50, seed=1)]
+    sshd = [line for line, _, _ in generate_lines(50, formats=('sshd',), seed=1)]
+    assert detect_format(nginx) == FORMAT_COMBINED
+    assert detect_format(sshd) == FORMAT_SSHD
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as f:
+        f.write("\n".join(sshd))
+    try:
+        assert detect_file_format(f.name) == FORMAT_SSHD
+    finally:
+        os.unlink(f.name)
+
+    parser = LogParser()
+    for line in nginx + sshd:
+        assert parser.parse(line).ip is not None
+    assert parser.format_counts == {FORMAT_COMBINED: 50, FORMAT_SSHD: 50}
+
+
+if __name__ == "__main__":
+    test_access_logs()
+    test_sshd_logs()
+    test_netfilter_and_syslog()
+    test_detect_format_and_sticky_parser()
+    print("日志解析测试通过")
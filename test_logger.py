@@ -5,9 +5,12 @@
 
 import os
 import sys
+import json
+import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from logger import AegisLogger
+from config import LOG_LEVEL
+from logger import AegisLogger, JsonFormatter, RepeatFilter, DroppingQueueHandler, set_log_level
 
 def test_logger():
     """测试日志功能"""
@@ -38,8 +41,64 @@ def test_logger():
     print("日志测试完成！")
     print(f"日志文件路径: /var/log/my_service.log")
     print("请检查日志文件和控制台输出是否正常")
-    
+
+
+def test_handler_setup_is_idempotent():
+    """多次实例化 AegisLogger 不会重复添加处理器"""
+    first = AegisLogger('AegisLoggerIdempotentTest')
+    second = AegisLogger('AegisLoggerIdempotentTest')
+    first.info("第一个实例")
+    second.info("第二个实例")
+
+    handlers = logging.getLogger('AegisLoggerIdempotentTest').handlers
+    assert len(handlers) == 1
+    assert isinstance(handlers[0], DroppingQueueHandler)
+
+
+def test_log_level_override_survives_new_instances():
+    """set_log_level 之后再创建 AegisLogger 不会恢复为 LOG_LEVEL"""
+    try:
+        set_log_level("ERROR")
+        AegisLogger()
+        assert logging.getLogger('AegisLogger').level == logging.ERROR
+    finally:
+        set_log_level(None)
+    AegisLogger()
+    assert logging.getLogger('AegisLogger').level == logging.getLevelName(LOG_LEVEL)
+
+
+def _record(msg, level=logging.WARNING):
+    return logging.LogRecord('test', level, __file__, 0, msg, None, None)
+
+
+def test_repeat_filter_suppresses_duplicates():
+    """重复消息在间隔内被抑制，并在下次放行时报告抑制次数"""
+    repeat_filter = RepeatFilter(interval=60)
+    assert repeat_filter.filter(_record("调用 AI 接口失败"))
+    assert not repeat_filter.filter(_record("调用 AI 接口失败"))
+    assert not repeat_filter.filter(_record("调用 AI 接口失败"))
+    assert repeat_filter.filter(_record("另一条消息"))
+    assert repeat_filter.filter(_record("调用 AI 接口失败", logging.ERROR))
+
+    # 模拟间隔已过
+    for entry in repeat_filter._seen.values():
+        entry[0] -= 61
+    record = _record("调用 AI 接口失败")
+    assert repeat_filter.filter(record)
+    assert "已抑制 2 条重复消息" in record.getMessage()
+
+
+def test_json_formatter():
+    """JSON 格式的每条日志都是一个合法的 JSON 对象"""
+    line = JsonFormatter().format(_record("记录攻击: IP=1.2.3.4", logging.INFO))
+    entry = json.loads(line)
+    assert entry['level'] == 'INFO'
+    assert entry['message'] == "记录攻击: IP=1.2.3.4"
 
 
 if __name__ == "__main__":
-    test_logger()
\ No newline at end of file
+    test_logger()
+    test_handler_setup_is_idempotent()
+    test_log_level_override_survives_new_instances()
+    test_repeat_filter_suppresses_duplicates()
+    test_json_formatter()
\ No newline at end of file
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 验证 Prometheus 指标的计数与文本格式导出
+"""
+
+import os
+import sys
+import urllib.request
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import Registry, start_http_server
+
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    lines = registry.counter('lines_total', '读取行数')
+    filtered = registry.counter('filtered_total', '过滤行数', ['reason'])
+    depth = registry.gauge('queue_depth', '队列长度', ['queue'])
+
+    lines.inc()
+    lines.inc(4)
+    filtered.labels('empty').inc(2)
+    depth.labels('log').set_function(lambda: 7)
+
+    text = registry.render()
+    assert '# TYPE lines_total counter' in text
+    assert 'lines_total 5' in text
+    assert 'filtered_total{reason="empty"} 2' in text
+    assert 'queue_depth{queue="log"} 7' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', '耗时', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value)
+    with latency.time():
+        pass
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1"} 4' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 5' in text
+    assert 'latency_seconds_count 5' in text
+    assert latency.count == 5
+
+
+def test_registry_returns_existing_metric():
+    registry = Registry()
+    assert registry.counter('dup_total', 'a') is registry.counter('dup_total', 'a')
+
+
+def test_standalone_http_server():
+    registry = Registry()
+    registry.counter('served_total', '导出测试').inc(3)
+    server = start_http_server(0, '127.0.0.1', registry=registry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5) as resp:
+            body = resp.read().decode('utf-8')
+            assert resp.headers['Content-Type'].startswith('text/plain')
+        assert 'served_total 3' in body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    test_counter_and_gauge_render()
+    test_histogram_buckets_are_cumulative()
+    test_registry_returns_existing_metric()
+    test_standalone_http_server()
+    print("指标测试通过")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 从攻击记录训练本地分类器，并在调用 AI 之前分流日志
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from mock_ai_server import MockAIServer
+from ml_classifier import (
+    LABEL_BENIGN, NGramClassifier, get_ml_classifier, ngram_features, set_ml_classifier, training_examples
+)
+from models import DatabaseManager, temporary_db_manager
+from synthetic_logs import generate_lines
+
+
+def _history(db, seed, num_lines=4000, batch_size=20):
+    """模拟 AI 的历史判定: 每批日志中的攻击 IP 各写一条记录，返回含攻击的批次的总行数"""
+    recorded = 0
+    generated = list(generate_lines(num_lines, attack_ratio=0.1, attackers=30, formats=("nginx", "sshd"), seed=seed))
+    for start in range(0, len(generated), batch_size):
+        batch = generated[start:start + batch_size]
+        content = "\n".join(line for line, _, _ in batch)
+        attackers = {ip: t for _, ip, t in batch if t}
+        for ip, attack_type in attackers.items():
+            db.add_attack_record(ip, attack_type, content, severity=3, is_blocked=True)
+        recorded += len(batch) if attackers else 0
+    # 非 AI 来源的记录不参与训练
+    db.add_attack_record("192.0.2.1", "DDoS", batch[0][0], analyzed_by="anomaly")
+    return recorded
+
+
+def test_features():
+    features, line_ids = ngram_features(["abcdef", "", "xy", "abcdef"], dim=1024, ngram_min=3, ngram_max=4)
+    # "abcdef": 4 个 3-gram + 3 个 4-gram；过短的行和跨行的 n-gram 不产生特征
+    assert list(line_ids) == [0] * 4 + [3] * 4 + [0] * 3 + [3] * 3
+    assert all(0 <= f < 1024 for f in features)
+    # 数字被归一化
+    assert list(ngram_features(["id=123"], 1024, 3, 3)[0]) == list(ngram_features(["id=987"], 1024, 3, 3)[0])
+
+
+def test_train_and_triage():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        recorded = _history(db, seed=1)
+        lines, labels = training_examples(db)
+        assert len(lines) == recorded
+        assert LABEL_BENIGN in labels and "DDoS" not in labels
+
+        model = NGramClassifier.train(lines, labels, dim=1 << 16)
+        path = os.path.join(tmp, "model.npz")
+        model.save(path)
+        model = NGramClassifier.load(path, confidence=0.99)
+
+        test = list(generate_lines(2000, attack_ratio=0.1, attackers=30, formats=("nginx",), seed=2))
+        predictions = model.predict([line for line, _, _ in test])
+        correct = sum(1 for (label, _), (_, _, truth) in zip(predictions, test) if label == (truth or LABEL_BENIGN))
+        assert correct / len(test) > 0.98
+
+        verdicts, escalate = model.triage([line for line, _, _ in test[:200]])
+        # 登录失败次数未达阈值的爆破行交给 AI，其余攻击在本地判定，正常行被丢弃
+        attackers = {ip: t for _, ip, t in test[:200] if t and t != "Brute Force"}
+        assert {v["ip"]: v["attack_type"] for v in verdicts} == attackers
+        assert all(v["analyzed_by"] == "ML" for v in verdicts)
+        assert escalate == [line for line, _, t in test[:200] if t == "Brute Force"]
+
+
+def test_request_skips_ai_for_confident_lines():
+    try:
+        with MockAIServer() as server, temporary_db_manager() as db:
+            _history(db, seed=3)
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            set_ml_classifier(NGramClassifier.train(*training_examples(db), dim=1 << 16))
+            assert get_ml_classifier() is not None
+
+            batch = [line for line, _, t in generate_lines(400, attack_ratio=0.1, attackers=5, seed=4)
+                     if t in (None, "SQL Injection", "XSS")][:40]
+            result = aegis_log.analyze_lines_ai(batch)
+            assert result["attack_ips"]
+            assert server.requests == 0
+            records = db.get_training_records(analyzed_by="ML")
+            assert {ip for ip, _, _ in records} == set(result["attack_ips"])
+    finally:
+        set_ml_classifier(None)
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_features()
+    test_train_and_triage()
+    test_request_skips_ai_for_confident_lines()
+    print("本地分类器测试通过")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - AI 模型分级: 初筛模型判为正常的批次不再交给完整模型
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+import model_router
+from config import AI_MODEL
+from mock_ai_server import MockAIServer
+from model_router import (
+    TIER_FULL, TIER_TRIAGE, TIER_REQUESTS, TIER_TOKENS,
+    TRIAGE_ERROR, TRIAGE_NEGATIVE, TRIAGE_POSITIVE, TRIAGE_UNCERTAIN, parse_triage_response
+)
+from models import temporary_db_manager
+from synthetic_logs import _nginx_line
+
+
+def test_parse_triage_response():
+    assert parse_triage_response('{"attack": "yes", "ips": ["1.2.3.4"]}') == (TRIAGE_POSITIVE, ["1.2.3.4"])
+    assert parse_triage_response('```json\n{"attack": false, "ips": []}\n```') == (TRIAGE_NEGATIVE, [])
+    assert parse_triage_response('{"attack": "unsure"}') == (TRIAGE_UNCERTAIN, [])
+    # 无法解析或自相矛盾的回答交给完整模型
+    assert parse_triage_response('no attack') == (TRIAGE_UNCERTAIN, [])
+    assert parse_triage_response('{"attack": "no", "ips": ["1.2.3.4"]}') == (TRIAGE_UNCERTAIN, ["1.2.3.4"])
+
+
+def test_cascade_skips_full_model_for_clean_batches():
+    previous_model = model_router.AI_TRIAGE_MODEL
+    try:
+        with MockAIServer() as server, temporary_db_manager() as db:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            model_router.AI_TRIAGE_MODEL = "mock-triage"
+            negatives = TIER_REQUESTS.labels(TIER_TRIAGE, TRIAGE_NEGATIVE).value
+            full_attacks = TIER_REQUESTS.labels(TIER_FULL, "attack").value
+            triage_tokens = TIER_TOKENS.labels(TIER_TRIAGE, "completion").value
+
+            clean = [_nginx_line(f"203.0.113.{i}", 1700000000, "GET", "/index.html", 200, "Mozilla/5.0", 100)
+                     for i in range(1, 6)]
+            attack = clean[:4] + [_nginx_line("198.51.100.7", 1700000000, "GET", "/.env", 404, "zgrab/0.x", 0)]
+            assert aegis_log.analyze_lines_ai(clean)["attack_ips"] == []
+            assert aegis_log.analyze_lines_ai(attack)["attack_ips"] == ["198.51.100.7"]
+
+            assert server.requests_by_model == {"mock-triage": 2, AI_MODEL: 1}
+            assert TIER_REQUESTS.labels(TIER_TRIAGE, TRIAGE_NEGATIVE).value - negatives == 1
+            assert TIER_REQUESTS.labels(TIER_FULL, "attack").value - full_attacks == 1
+            assert TIER_TOKENS.labels(TIER_TRIAGE, "completion").value > triage_tokens
+            assert db.get_attack_type_statistics() == {"Scanning": 1}
+
+            # 初筛模型不可用时直接交给完整模型
+            unreachable = OpenAI(api_key="test", base_url="http://127.0.0.1:9/v1", max_retries=0, timeout=1)
+            assert model_router.triage(unreachable, attack) == (TRIAGE_ERROR, [])
+            assert model_router.needs_full_model(unreachable, clean)
+    finally:
+        model_router.AI_TRIAGE_MODEL = previous_model
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_parse_triage_response()
+    test_cascade_skips_full_model_for_clean_batches()
+    print("模型分级测试通过")
@@ -1,6 +1,8 @@
 import os
 import time
 import random
+import tempfile
+import threading
 from memory_profiler import profile
 from aegis_log import stream_log_files, sample_log_lines
 
@@ -12,58 +14,98 @@ def generate_test_log(file_path, num_lines=10000):
             f.write(f"[2025-08-22 12:34:56] {ip} - GET /test HTTP/1.1\n")
 
 @profile
-def test_streaming_memory(file_path, batch_size=100):
+def profile_streaming_memory(file_path, batch_size=100):
     """测试流式读取内存使用"""
     start_time = time.time()
     line_count = 0
-    
-    for line in stream_log_files():
+
+    for line in stream_log_files([file_path]):
         line_count += 1
         if line_count % batch_size == 0:
             print(f"Processed {line_count} lines", end='\r')
-    
+
     print(f"\nTotal lines: {line_count}")
     print(f"Time taken: {time.time() - start_time:.2f}s")
 
 @profile
-def test_tail_mode(file_path):
+def profile_tail_mode(file_path):
     """测试tail模式响应"""
     print("Starting tail mode test...")
     line_count = 0
-    
-    for line in stream_log_files(tail_mode=True):
+    writer = threading.Thread(target=_append_lines, args=(file_path, 5, 0.2), daemon=True)
+    writer.start()
+
+    for line in stream_log_files([file_path], tail_mode=True, poll_interval=0.05):
         line_count += 1
         print(f"New line detected: {line[:50]}...")
-        
+
         if line_count >= 5:  # 测试5行后退出
             break
 
+def _append_lines(file_path, count, delay=0.0):
+    """模拟服务持续写日志"""
+    for i in range(count):
+        time.sleep(delay)
+        with open(file_path, 'a') as f:
+            f.write(f"[2025-08-22 12:35:0{i}] 10.0.0.{i} - GET /new HTTP/1.1\n")
+
+def test_stream_log_files_reads_every_line():
+    """顺序模式读取全部行"""
+    with tempfile.TemporaryDirectory() as tmp:
+        test_file = os.path.join(tmp, "stream.log")
+        generate_test_log(test_file, 1000)
+        assert sum(1 for _ in stream_log_files([test_file])) == 1000
+
+def test_stream_log_files_tail_mode_follows_new_lines():
+    """tail 模式只返回启动后追加的行，并能跟随日志轮转"""
+    with tempfile.TemporaryDirectory() as tmp:
+        test_file = os.path.join(tmp, "tail.log")
+        generate_test_log(test_file, 100)
+
+        stream = stream_log_files([test_file], tail_mode=True, poll_interval=0.01)
+        writer = threading.Thread(target=_append_lines, args=(test_file, 3, 0.05))
+        writer.start()
+        lines = [next(stream) for _ in range(3)]
+        writer.join()
+        assert [l.split()[2] for l in lines] == ["10.0.0.0", "10.0.0.1", "10.0.0.2"]
+
+        # 模拟 logrotate: 原文件改名后重新创建
+        os.rename(test_file, test_file + ".1")
+        _append_lines(test_file, 1)
+        assert next(stream).split()[2] == "10.0.0.0"
+        stream.close()
+
+def test_sample_log_lines_batches():
+    """sample_log_lines 只取文件尾部 batch_size 行"""
+    with tempfile.TemporaryDirectory() as tmp:
+        test_file = os.path.join(tmp, "sample.log")
+        generate_test_log(test_file, 1000)
+        batches = sample_log_lines(batch_size=10, file_paths=[test_file])
+        assert sum(len(b) for b in batches) == 10
+
 def run_performance_tests():
     """运行所有性能测试"""
     test_file = "test_performance.log"
-    
+
     # 生成测试文件
     print("Generating test log file...")
     generate_test_log(test_file, 100000)  # 10万行测试数据
-    
-    # 设置测试环境
-    os.environ['ANALYZE_FILES'] = test_file
-    
+
     # 测试1: 流式读取内存效率
     print("\n=== Testing streaming memory efficiency ===")
-    test_streaming_memory(test_file)
-    
+    profile_streaming_memory(test_file)
+
     # 测试2: 不同batch_size性能
     print("\n=== Testing different batch sizes ===")
     for size in [10, 100, 1000]:
         print(f"\nBatch size: {size}")
         start = time.time()
-        batches = sample_log_lines(batch_size=size)
+        batches = sample_log_lines(batch_size=size, file_paths=[test_file])
         print(f"Processed {sum(len(b) for b in batches)} lines in {time.time()-start:.2f}s")
-    
+
     # 测试3: tail模式
     print("\n=== Testing tail mode ===")
-    test_tail_mode(test_file)
+    profile_tail_mode(test_file)
 
 if __name__ == "__main__":
-    run_performance_tests()
\ No newline at end of file
+    run_performance_tests()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 离线端到端流水线: 合成日志 + 本地桩 AI + 临时数据库 + dry-run 防火墙
+"""
+
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from synthetic_logs import write_log_file
+
+
+def test_dry_run_firewall_tracks_rules():
+    fw = aegis_log.FirewallAI(dry_run=True)
+    fw.add_ip("203.0.113.7")
+    fw.add_ip("203.0.113.7")
+    fw.add_ip("198.51.100.1")
+    assert fw.get_blacklist() == ["203.0.113.7", "198.51.100.1"]
+
+    fw.remove_ip("203.0.113.7")
+    assert fw.get_blacklist() == ["198.51.100.1"]
+    assert "203.0.113.7" in fw.dry_run.blocked_at
+
+
+def test_pipeline_blocks_and_records_attackers():
+    try:
+        with MockAIServer() as server, temporary_db_manager() as db, tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, "access.log")
+            truth = write_log_file(log_path, 300, attack_ratio=0.1, attackers=5, seed=1)
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            fw = aegis_log.FirewallAI(dry_run=True)
+            for batch in aegis_log.iter_batches(aegis_log.stream_log_files([log_path]), 50):
+                aegis_log.process_batch(batch, fw)
+
+            assert set(fw.get_blacklist()) == set(truth)
+            assert db.get_total_blocked_ips() == len(truth)
+            assert set(db.get_attack_type_statistics()) == set(truth.values())
+            assert server.requests == 6
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_dry_run_firewall_tracks_rules()
+    test_pipeline_blocks_and_records_attackers()
+    print("离线流水线测试通过")
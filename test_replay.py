@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 历史日志回放: 普通/.gz/.bz2 文件并行回放、dry-run 防火墙和可续传检查点
+"""
+
+import bz2
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from replay import Replayer, iter_file_lines
+from synthetic_logs import write_log_file
+
+
+def _compress(path, opener, suffix):
+    with open(path, "rb") as src, opener(path + suffix, "wb") as dst:
+        dst.write(src.read())
+    os.unlink(path)
+    return path + suffix
+
+
+def test_iter_file_lines_resumes_at_offset():
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "a.log")
+        with open(plain, "w") as f:
+            f.write("one\ntwo\r\n\nthree")
+        gz = os.path.join(tmp, "b.log")
+        with open(gz, "w") as f:
+            f.write("one\ntwo\r\n\nthree")
+        gz = _compress(gz, gzip.open, ".gz")
+
+        for path in (plain, gz):
+            items = list(iter_file_lines(path))
+            assert [line for _, line, _ in items] == ["one", "two", "", "three"]
+            offset = items[1][0]
+            assert [line for _, line, _ in iter_file_lines(path, offset)] == ["", "three"]
+            assert list(iter_file_lines(path, items[-1][0])) == []
+
+
+def test_replay_plain_gz_bz2_with_checkpoint():
+    try:
+        with MockAIServer() as server, temporary_db_manager(), tempfile.TemporaryDirectory() as tmp:
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+
+            truth = {}
+            paths = []
+            for i, (opener, suffix) in enumerate([(None, ""), (gzip.open, ".gz"), (bz2.open, ".bz2")]):
+                path = os.path.join(tmp, f"access.log.{i}")
+                truth.update(write_log_file(path, 200, attack_ratio=0.1, attackers=3, seed=i))
+                paths.append(_compress(path, opener, suffix) if opener else path)
+            checkpoint = os.path.join(tmp, "checkpoint.json")
+
+            fw = aegis_log.FirewallAI(dry_run=True)
+            replayer = Replayer(paths, fw, workers=2, batch_size=25, ai_concurrency=2,
+                                checkpoint_path=checkpoint, progress_stream=io.StringIO())
+            summary = replayer.run()
+            assert summary["lines"] == 600
+            assert summary["errors"] == {}
+            assert set(fw.get_blacklist()) == set(truth)
+            with open(checkpoint) as f:
+                state = json.load(f)["files"]
+            assert all(entry["done"] for entry in state.values())
+
+            # 再次运行时已完成的文件全部跳过
+            again = Replayer(paths, aegis_log.FirewallAI(dry_run=True), checkpoint_path=checkpoint,
+                             progress_interval=0)
+            requests = server.requests
+            assert again.run()["lines"] == 0
+            assert server.requests == requests
+
+            # 中断后从检查点记录的偏移继续
+            state[os.path.abspath(paths[0])].update(done=False, offset=os.path.getsize(paths[0]) // 2)
+            with open(checkpoint, "w") as f:
+                json.dump({"version": 1, "files": state}, f)
+            resumed = Replayer(paths, aegis_log.FirewallAI(dry_run=True), checkpoint_path=checkpoint,
+                               progress_interval=0).run()
+            assert 90 <= resumed["lines"] <= 110
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+if __name__ == "__main__":
+    test_iter_file_lines_resumes_at_offset()
+    test_replay_plain_gz_bz2_with_checkpoint()
+    print("日志回放测试通过")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 资源采样写入 system_status、逐级降采样和 Dashboard 运行时间/资源趋势接口
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from metrics import LINES_READ, QUEUE_DEPTH
+from models import DatabaseManager, temporary_db_manager
+from resource_sampler import ResourceSampler
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_migrates_old_table():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "old.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute("""
+                CREATE TABLE system_status (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    total_attacks INTEGER DEFAULT 0,
+                    blocked_ips_count INTEGER DEFAULT 0,
+                    active_attacks INTEGER DEFAULT 0,
+                    memory_usage REAL,
+                    cpu_usage REAL
+                )
+            """)
+            conn.execute("INSERT INTO system_status (memory_usage, cpu_usage) VALUES (1, 2)")
+        db = DatabaseManager(path)
+        db.update_system_status(memory_usage=3, cpu_usage=4, lines_per_sec=5, started_at=time.time())
+        samples = db.get_system_trends(3600)
+        assert [s["resolution"] for s in samples] == ["raw", "raw"]
+        assert samples[-1]["lines_per_sec"] == 5
+
+
+def test_sampler_and_downsampling():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        start = 1700000000  # 2023-11-14 22:13:20 UTC
+        clock = FakeClock(start)
+        sampler = ResourceSampler(db, interval=10, clock=clock)
+        QUEUE_DEPTH.labels("sampler_test").set(7)
+
+        clock.now += 10
+        LINES_READ.inc(500)
+        sample = sampler.sample()
+        assert sample["lines_per_sec"] >= 50
+        assert sample["memory_usage"] is None or sample["memory_usage"] > 0
+        assert sample["cpu_usage"] >= 0
+        assert sample["queue_depths"]["sampler_test"] == 7
+
+        # 两小时的原始样本: 超过保留时间的合并为每分钟一条
+        for _ in range(720):
+            clock.now += 10
+            sampler.record()
+        trends = db.get_system_trends(3 * 3600, now=clock.now)
+        resolutions = [s["resolution"] for s in trends]
+        assert resolutions[0] == "minute" and resolutions[-1] == "raw"
+        assert resolutions.count("raw") <= 370
+        # 各精度覆盖的时间段不重叠
+        minutes = [s["timestamp"] for s in trends if s["resolution"] == "minute"]
+        raws = [s["timestamp"] for s in trends if s["resolution"] == "raw"]
+        assert max(minutes) < min(raws)
+        assert all(s["queue_depths"]["sampler_test"] == 7 for s in trends)
+
+        # 两天后每分钟样本合并为每小时一条, 一个月后全部删除
+        sampler.downsample(start + 2 * 86400)
+        assert {s["resolution"] for s in db.get_system_trends(3 * 86400, now=start + 2 * 86400)} == {"hour"}
+        sampler.downsample(start + 40 * 86400)
+        assert db.get_system_trends(50 * 86400, now=start + 40 * 86400) == []
+
+
+def test_dashboard_uptime_and_trends():
+    with temporary_db_manager() as db:
+        assert app.get_uptime() == "未知"
+
+        now = time.time()
+        db.update_system_status(memory_usage=50, cpu_usage=10, lines_per_sec=100,
+                                started_at=now - 3 * 3600 - 120, timestamp=now)
+        assert app.get_uptime() == "3小时2分"
+        assert app.format_duration(2 * 86400 + 3600) == "2天1小时"
+
+        response = app.app.test_client().get("/api/system-trends?hours=1")
+        data = response.get_json()
+        assert response.status_code == 200
+        assert data["uptime"] == "3小时2分"
+        assert [s["memory_usage"] for s in data["samples"]] == [50]
+
+        # 样本过期说明分析进程已退出
+        db.update_system_status(started_at=now - 7200, timestamp=now - 3600)
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("DELETE FROM system_status WHERE memory_usage = 50")
+        assert app.get_uptime() == "已停止"
+
+
+def test_active_attacks_use_timestamp_index():
+    with temporary_db_manager() as db:
+        db.add_attack_record("198.51.100.7", "XSS", "line")
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("INSERT INTO attack_records (timestamp, source_ip, attack_type) "
+                         "VALUES (datetime('now', '-2 hours'), '198.51.100.8', 'XSS')")
+            # 每次状态采样都统计最近 1 小时的攻击数，应走时间索引而不是全表扫描
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT COUNT(*) FROM attack_records "
+                                "WHERE timestamp >= datetime('now', '-1 hour')").fetchall()
+        assert any("idx_attack_records_timestamp" in row[-1] for row in plan)
+        db.update_system_status(memory_usage=1)
+        with sqlite3.connect(db.db_path) as conn:
+            row = conn.execute("SELECT total_attacks, active_attacks FROM system_status").fetchone()
+        assert row == (2, 1)
+
+
+if __name__ == "__main__":
+    test_migrates_old_table()
+    test_sampler_and_downsampling()
+    test_dashboard_uptime_and_trends()
+    test_active_attacks_use_timestamp_index()
+    print("资源采样测试通过")
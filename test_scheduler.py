@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 特征签名与按可疑度优先的 AI 批次调度
+"""
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from scheduler import BatchScheduler, BatchScorer, TokenBucket
+from signatures import match_signature
+from synthetic_logs import ATTACK_REQUESTS, _nginx_line, _sshd_line
+
+
+def _benign(i):
+    return _nginx_line(f"10.0.0.{i % 5 + 1}", 1700000000 + i, "GET", "/index.html", 200, "Mozilla/5.0", 512)
+
+
+def test_signatures():
+    for attack_type, templates in ATTACK_REQUESTS.items():
+        for method, path, status, agent in templates:
+            line = _nginx_line("203.0.113.9", 1700000000, method, path, status, agent, 100)
+            assert match_signature(line) == attack_type, line
+    assert match_signature(_sshd_line("203.0.113.9", 1700000000, "root", True, 1)) == "Brute Force"
+    assert match_signature(_benign(0)) is None
+
+
+def test_scoring_order():
+    scorer = BatchScorer()
+    benign = [_benign(i) for i in range(10)]
+    scorer.score(benign)
+    # 同一批正常流量第二次评分: 没有新 IP，分数最低
+    assert scorer.score(benign) == 0.0
+    errors = [_nginx_line("10.0.0.1", 1700000000, "GET", "/missing", 404, "Mozilla/5.0", 0)] * 10
+    attack = benign[:9] + [_nginx_line("10.0.0.1", 1700000000, "GET", "/item?id=1%20UNION%20SELECT%201",
+                                       500, "Mozilla/5.0", 0)]
+    assert scorer.score(attack) > scorer.score(errors) > scorer.score(benign)
+
+
+def test_most_suspicious_first():
+    scheduler = BatchScheduler(rate_per_minute=0, token_budget_per_minute=0)
+    benign = [_benign(i) for i in range(10)]
+    scheduler.submit(benign)
+    for i in range(5):
+        scheduler.submit(benign)
+    attack = [_nginx_line("198.51.100.7", 1700000000, "GET", "/search?q=<script>alert(1)</script>",
+                          200, "Mozilla/5.0", 0)]
+    scheduler.submit(attack)
+    assert scheduler.get(timeout=0) is attack
+    assert len(scheduler) == 6
+
+
+def test_rate_limit():
+    bucket = TokenBucket(rate=10.0, capacity=2)
+    bucket.take(1)
+    bucket.take(1)
+    assert 0.05 < bucket.wait_time(1) <= 0.1
+
+    # 每分钟 120 次 -> 突发 120 次后每 0.5 秒一次
+    scheduler = BatchScheduler(rate_per_minute=120, token_budget_per_minute=0)
+    scheduler.requests.tokens = 1
+    scheduler.submit(["a"], score=1.0)
+    scheduler.submit(["b"], score=1.0)
+    assert scheduler.get(timeout=0) == ["a"]
+    assert scheduler.get(timeout=0) is None
+    started = time.monotonic()
+    assert scheduler.get(timeout=2) == ["b"]
+    assert 0.3 < time.monotonic() - started < 1.0
+
+
+def test_shedding():
+    scheduler = BatchScheduler(rate_per_minute=0, token_budget_per_minute=0, max_pending=3,
+                               max_age=0.01, shed_score=2.0)
+    scheduler.submit(["low-1"], score=0.5)
+    scheduler.submit(["high"], score=9.0)
+    scheduler.submit(["low-2"], score=0.5)
+    scheduler.submit(["mid"], score=3.0)
+    # 队列满: 丢弃分数最低且最新的批次
+    assert scheduler.shed_batches == 1
+    time.sleep(0.02)
+    # 低分批次排队超时被丢弃，高分批次保留
+    assert scheduler.get(timeout=0) == ["high"]
+    assert scheduler.get(timeout=0) == ["mid"]
+    assert scheduler.get(timeout=0) is None
+    assert scheduler.shed_batches == 2
+
+    keep = BatchScheduler(rate_per_minute=0, token_budget_per_minute=0, max_pending=1, max_age=0.01, shed=False)
+    keep.submit(["a"], score=0.0)
+    keep.submit(["b"], score=0.0)
+    assert keep.full() and keep.shed_batches == 0
+
+
+if __name__ == "__main__":
+    test_signatures()
+    test_scoring_order()
+    test_most_suspicious_first()
+    test_rate_limit()
+    test_shedding()
+    print("调度测试通过")
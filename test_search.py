@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 攻击记录日志内容的 FTS5 全文搜索: 触发器同步、旧数据库回填、排序与分页、/api/search
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import app
+from models import DatabaseManager, temporary_db_manager
+
+LINES = [
+    '198.51.100.1 - - "GET /wp-admin/setup.php HTTP/1.1" 404 0 "-" "zgrab/0.x"',
+    '198.51.100.2 - - "GET /item?id=1%20UNION%20SELECT%201 HTTP/1.1" 500 0 "-" "sqlmap/1.7"',
+    '198.51.100.3 - - "GET /index.html HTTP/1.1" 200 100 "-" "Mozilla/5.0"',
+]
+
+
+def _fill(db):
+    db.add_attack_record("198.51.100.1", "Scanning", LINES[0], severity=3, is_blocked=True)
+    db.add_attack_record("198.51.100.2", "SQL Injection", "\n".join(LINES[1:]), severity=3, is_blocked=True)
+    db.add_attack_record("198.51.100.1", "Scanning", LINES[0] + "\n" + LINES[0], severity=3, is_blocked=True)
+
+
+def test_search_and_pagination():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        assert db.fts_enabled
+        _fill(db)
+
+        results = db.search_attack_records("WP-ADMIN/setup")
+        # 命中两次的记录相关度更高
+        assert [r["id"] for r in results] == [3, 1]
+        assert "«wp-admin/setup»" in results[0]["snippet"]
+        assert results[0]["score"] < results[1]["score"]
+
+        assert [r["id"] for r in db.search_attack_records("UNION%20SELECT", attack_type="SQL Injection")] == [2]
+        assert db.search_attack_records("wp-admin", attack_type="SQL Injection") == []
+        # 双引号等 FTS5 语法字符按字面匹配
+        assert db.search_attack_records('"zgrab') != []
+
+        # 从新到旧键集分页
+        page = db.search_attack_records("wp-admin", limit=1, sort="recent")
+        assert [r["id"] for r in page] == [3]
+        page = db.search_attack_records("wp-admin", limit=1, sort="recent", before_id=page[-1]["id"])
+        assert [r["id"] for r in page] == [1]
+        assert [r["id"] for r in db.search_attack_records("wp-admin", limit=1, offset=1)] == [1]
+
+        # 少于 3 个字符退化为 LIKE, 通配符按字面匹配
+        assert [r["id"] for r in db.search_attack_records("%2")] == [2]
+        assert db.search_attack_records("_x") == []
+
+        # 删除和修改记录时索引同步更新
+        with sqlite3.connect(db.db_path) as conn:
+            conn.execute("DELETE FROM attack_records WHERE id = 3")
+            conn.execute("UPDATE attack_records SET log_content = 'cleaned' WHERE id = 1")
+        assert db.search_attack_records("wp-admin") == []
+        assert [r["id"] for r in db.search_attack_records("cleaned")] == [1]
+
+
+def test_backfills_existing_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "old.db")
+        db = DatabaseManager(path)
+        _fill(db)
+        with sqlite3.connect(path) as conn:
+            # 模拟建立全文索引之前的旧数据库
+            conn.executescript("""
+                DROP TRIGGER attack_records_fts_insert;
+                DROP TRIGGER attack_records_fts_delete;
+                DROP TRIGGER attack_records_fts_update;
+                DROP TABLE attack_records_fts;
+            """)
+        db = DatabaseManager(path)
+        assert [r["id"] for r in db.search_attack_records("sqlmap")] == [2]
+
+
+def test_search_api():
+    with temporary_db_manager() as db:
+        _fill(db)
+        client = app.app.test_client()
+
+        assert client.get("/api/search").status_code == 400
+        assert client.get("/api/search?q=abc&sort=bogus").status_code == 400
+
+        data = client.get("/api/search?q=wp-admin&per_page=1").get_json()
+        assert data["has_more"] and [r["id"] for r in data["results"]] == [3]
+        data = client.get("/api/search?q=wp-admin&per_page=1&page=2").get_json()
+        assert not data["has_more"] and [r["id"] for r in data["results"]] == [1]
+
+        data = client.get("/api/search?q=wp-admin&per_page=1&sort=recent").get_json()
+        assert data["next_before_id"] == 3
+        data = client.get("/api/search?q=wp-admin&per_page=1&sort=recent&before_id=3").get_json()
+        assert [r["id"] for r in data["results"]] == [1] and data["next_before_id"] is None
+        assert data["results"][0]["source_ip"] == "198.51.100.1"
+
+
+if __name__ == "__main__":
+    test_search_and_pagination()
+    test_backfills_existing_database()
+    test_search_api()
+    print("全文搜索测试通过")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试脚本 - 多进程分片采集: worker 预过滤分批，协调者统一写库和封禁
+"""
+
+import os
+import pickle
+import queue
+import sys
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI
+
+import aegis_log
+from mock_ai_server import MockAIServer
+from models import temporary_db_manager
+from scheduler import BatchScorer
+from sharded import ShardedIngestor, SHARD_BY_FILE, SHARD_BY_IP, shard_of, shard_worker
+from synthetic_logs import write_log_file
+
+
+def test_shard_of_is_stable():
+    assert shard_of("203.0.113.7", 4) == shard_of("203.0.113.7", 4)
+    assert {shard_of(f"10.0.0.{i}", 4) for i in range(64)} == {0, 1, 2, 3}
+
+
+def test_worker_sends_parsed_records():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        with open(path, "w") as f:
+            f.write('203.0.113.7 - - [10/Oct/2024:13:55:36 +0000] "GET /?id=1\' or 1=1 HTTP/1.1" 200 12\n'
+                    '\n'
+                    '198.51.100.2 - - [10/Oct/2024:13:55:37 +0000] "GET /index.html HTTP/1.1" 404 0\n')
+        out = queue.Queue()
+        shard_worker(0, 1, [path], SHARD_BY_FILE, 10, False, out)
+        _, records, hits, stats = out.get_nowait()
+        assert [r.ip for r in records] == ["203.0.113.7", "198.51.100.2"] and hits == [True, False]
+        assert stats == (3, 1, 0) and out.get_nowait()[1] is None
+
+        # 跨进程传递后字段不变，协调者直接评分，与按文本评分一致
+        received = pickle.loads(pickle.dumps(records))
+        assert [r.to_dict() for r in received] == [r.to_dict() for r in records]
+        lines = [r.raw for r in received]
+        assert BatchScorer().score_records(received, hits) == BatchScorer().score(lines)
+
+
+def _run(shard_mode, workers):
+    try:
+        with MockAIServer() as server, temporary_db_manager(), tempfile.TemporaryDirectory() as tmp:
+            truth = {}
+            paths = []
+            for i in range(3):
+                path = os.path.join(tmp, f"access{i}.log")
+                truth.update(write_log_file(path, 200, attack_ratio=0.1, attackers=4, seed=i))
+                paths.append(path)
+            # 空行和不含 IP 的行会被预过滤
+            with open(paths[0], "a") as f:
+                f.write("\n-- MARK --\n")
+
+            aegis_log.set_ai_client(OpenAI(api_key="test", base_url=server.base_url, max_retries=0))
+            fw = aegis_log.FirewallAI(dry_run=True)
+
+            seen = []
+            ingestor = ShardedIngestor(paths, fw, workers=workers, shard_mode=shard_mode,
+                                       batch_size=25, tail_mode=False, ai_concurrency=2)
+            ingestor.run(on_batch=seen.append)
+
+            assert ingestor.lines == 600
+            assert all(len(batch) <= 25 for batch in seen)
+            assert set(fw.get_blacklist()) == set(truth)
+            if shard_mode == SHARD_BY_IP:
+                # 同一 IP 只会出现在一个分片中
+                owners = {}
+                for batch in seen:
+                    for line in batch:
+                        ip = line.split()[0]
+                        owners.setdefault(ip, set()).add(shard_of(ip, workers))
+                assert all(len(s) == 1 for s in owners.values())
+    finally:
+        aegis_log.set_ai_client(None)
+
+
+def test_sharded_by_file():
+    _run(SHARD_BY_FILE, 2)
+
+
+def test_sharded_by_ip():
+    _run(SHARD_BY_IP, 2)
+
+
+if __name__ == "__main__":
+    test_shard_of_is_stable()
+    test_worker_sends_parsed_records()
+    test_sharded_by_file()
+    test_sharded_by_ip()
+    print("分片采集测试通过")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+已分析批次的判定缓存
+相同的日志批次 (日志在两个检测周期之间没有新内容，或重启后重新读到已分析过的尾部) 直接返回上次 AI 的判定，
+不再调用 AI。命中缓存时判定同样逐个回调 (已解封的 IP 会重新封禁，仍在封禁中的由调用方去重)；
+只缓存完整解析的响应，缓存随检查点保存，重启后仍然有效
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import VERDICT_CACHE_SIZE
+
+
+class VerdictCache:
+    """批次内容摘要 -> 判定列表的有界 LRU (线程安全)"""
+
+    def __init__(self, capacity=VERDICT_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(lines):
+        return hashlib.blake2b('\n'.join(lines).encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+    def get(self, key):
+        """返回缓存的判定列表，没有时返回 None"""
+        with self._lock:
+            verdicts = self._entries.get(key)
+            if verdicts is not None:
+                self._entries.move_to_end(key)
+            return verdicts
+
+    def put(self, key, verdicts):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = list(verdicts)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def dump(self):
+        """[[摘要 hex, 判定列表], ...] (从旧到新)，供检查点保存"""
+        with self._lock:
+            return [[key.hex(), verdicts] for key, verdicts in self._entries.items()]
+
+    def load(self, items):
+        for key, verdicts in items:
+            self.put(bytes.fromhex(key), verdicts)
+
+
+_verdict_cache = None
+_verdict_cache_lock = threading.Lock()
+
+
+def get_verdict_cache():
+    """进程内共享的判定缓存 (首次调用时创建)"""
+    global _verdict_cache
+    if _verdict_cache is None:
+        with _verdict_cache_lock:
+            if _verdict_cache is None:
+                _verdict_cache = VerdictCache()
+    return _verdict_cache
+
+
+def set_verdict_cache(cache):
+    """替换共享的判定缓存 (测试用)"""
+    global _verdict_cache
+    _verdict_cache = cache